@@ -1,15 +1,213 @@
-import uvicorn
-from fastapi import FastAPI
+import asyncio
+import contextlib
+import functools
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel
 
 from common import (
-    install_requests_cache,
-    prepare,
-    find_paths_for_fiat,
+    BINANCE_CONFIG,
+    prepare_async,
+    load_c2c_to_graph_async,
+    load_c2c_for_queries_async,
+    join_paths_for_fiat,
+    join_paths_for_queries,
+    precompute_best_rates,
+    search_paths_for_fiat,
+    search_paths_from_fiat,
+    search_cycles,
+    prepare_conversion_path,
     prepare_conversion_paths,
+    ConversionPath,
+    Path,
 )
+import profiling
+from providers.p2p import AsyncC2CClient
+from metrics import METRICS
+from result_cache import ResultCache
+from snapshots import GraphRefresher, SnapshotFileReader
+from ticker_feed import TickerFeed
+
+logger = logging.getLogger(__name__)
+
+# top K paths search is pruned, so longer chains are affordable
+MAX_HOPS = 6
+# threads for CPU bound work (path search, results serialization)
+SEARCH_WORKERS = 4
+# file of graph snapshots published by `cli publish`. When set, one graph is
+# shared by all worker processes instead of each of them building its own
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH")
+# target fiats of /best-rates/{currency_from} when none are given
+DEFAULT_FIATS = ["RUB", "KZT", "UAH", "TRY", "EUR", "USD", "GEL", "AMD", "UZS"]
+
+
+@contextlib.asynccontextmanager
+async def live_graph(on_update=None):
+    """
+    Crypto graph built once and refreshed in background. Between refreshes
+    it is kept up to date by streamed tickers.
+
+    :param on_update: called with keys of edges updated by streamed tickers
+    """
+    # ccxt is imported when the app starts, not when the module is loaded
+    import ccxt.async_support
+
+    binance = ccxt.async_support.binance(BINANCE_CONFIG)
+    refresher = GraphRefresher(
+        build=functools.partial(prepare_async, binance),
+        precompute_rates=functools.partial(precompute_best_rates, max_length=MAX_HOPS),
+        on_update=on_update,
+    )
+    await refresher.refresh()
+    tasks = [
+        asyncio.create_task(refresher.run()),
+        asyncio.create_task(TickerFeed(refresher).run()),
+    ]
+    try:
+        yield refresher
+    finally:
+        for task in tasks:
+            task.cancel()
+        await binance.close()
+
+
+@contextlib.asynccontextmanager
+async def shared_graph(path: str):
+    """Crypto graph published to the file by another process (cli publish)."""
+    reader = SnapshotFileReader(path)
+    await reader.wait_loaded()
+    task = asyncio.create_task(reader.run())
+    try:
+        yield reader
+    finally:
+        task.cancel()
+
+
+def converts_through(result, pairs: Set[Tuple[str, str]]) -> bool:
+    """Whether cached result has a conversion between any of currency pairs."""
+    if isinstance(result, Path):
+        return any(
+            (edge.from_.currency, edge.to.currency) in pairs for edge in result.edges
+        )
+    if isinstance(result, ConversionPath):
+        return any(
+            (conversion.from_currency, conversion.to_currency) in pairs
+            for conversion in result.conversions
+        )
+    if isinstance(result, dict):
+        return converts_through(list(result.values()), pairs)
+    if isinstance(result, list):
+        return any(converts_through(item, pairs) for item in result)
+    return False
+
+
+def invalidate_changed(caches: List[ResultCache], dirty):
+    """
+    Drop cached results converting through edges updated by streamed tickers.
+
+    Results not using them are kept until they expire, even if updated edges
+    would make other paths better.
+    """
+    pairs = {(from_currency, to_currency) for from_currency, to_currency, _ in dirty}
+    for cache in caches:
+        cache.invalidate_values(functools.partial(converts_through, pairs=pairs))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    import httpx
+
+    # found paths by query and amount tier and converted results by amount
+    app.state.paths_cache = ResultCache()
+    app.state.results_cache = ResultCache()
+    # requests work on a copy of the latest snapshot
+    if SNAPSHOT_PATH:
+        graph = shared_graph(SNAPSHOT_PATH)
+    else:
+        graph = live_graph(
+            on_update=functools.partial(
+                invalidate_changed,
+                [app.state.paths_cache, app.state.results_cache],
+            )
+        )
+    async with httpx.AsyncClient(timeout=30) as http, graph as refresher:
+        app.state.c2c = AsyncC2CClient(http)
+        app.state.refresher = refresher
+        app.state.search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+        app.state.profile_limiter = profiling.ProfileLimiter()
+        app.state.profiles = profiling.ProfileStore()
+        yield
+        app.state.search_pool.shutdown(wait=False)
+
 
-app = FastAPI()
-install_requests_cache()
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    with METRICS.timer("request"):
+        response = await call_next(request)
+    # route template, not the path with currencies
+    route = request.scope.get("route")
+    METRICS.inc(
+        "http_requests",
+        route=route.path if route else "unknown",
+        status=response.status_code,
+    )
+    return response
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """
+    Profile the query when asked by ``X-Profile`` header or ``profile``
+    parameter: ``cprofile`` or ``sample``. Report is downloaded from the
+    URL in ``X-Profile-Url`` response header.
+    """
+    mode = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if mode not in profiling.MODES:
+        return await call_next(request)
+    if not request.app.state.profile_limiter.allow():
+        response = await call_next(request)
+        response.headers["X-Profile-Skipped"] = "rate limit"
+        return response
+    profile = profiling.QueryProfile(mode)
+    token = profiling.CURRENT.set(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.CURRENT.reset(token)
+        request.app.state.profiles.add(profile, profile.finish())
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Url"] = f"/profiles/{profile.id}"
+    return response
+
+
+async def run_in_search_pool(request: Request, func, *args, **kwargs):
+    """
+    Run CPU bound function without blocking the event loop, under profiler
+    of the query if it is profiled.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        request.app.state.search_pool,
+        functools.partial(
+            profiling.run_profiled, profiling.CURRENT.get(), func, *args, **kwargs
+        ),
+    )
+
+
+async def cached(cache: ResultCache, key, compute):
+    """Result of compute from cache, profiled queries are computed again."""
+    if profiling.CURRENT.get() is not None:
+        return await compute()
+    return await cache.get(key, compute)
 
 
 @app.get("/")
@@ -17,19 +215,300 @@ async def root():
     return {"message": "Hello World"}
 
 
+def best_paths_for_fiat(
+    currency_from, currency_to, graph, hops, best_rates=None, amount=1, rated=False
+):
+    if best_rates is not None:
+        paths = join_paths_for_fiat(
+            currency_from,
+            currency_to,
+            graph,
+            best_rates,
+            hops,
+            top_k=10,
+            amount=amount,
+            rated=rated,
+        )
+    else:
+        paths = search_paths_for_fiat(
+            currency_from,
+            currency_to,
+            graph,
+            hops,
+            top_k=10,
+            amount=amount,
+            rated=rated,
+        )
+    logger.info(f"Found {len(paths)} paths to convert (Displaying top 10)")
+    return paths
+
+
+async def load_best_paths(
+    request: Request, snapshot, currency_from, currency_to, hops, amount
+):
+    graph = snapshot.graph.copy()
+    # offers of both fiats are loaded deep enough for the amount and rated at it
+    await load_c2c_to_graph_async(
+        request.app.state.c2c,
+        currency_from,
+        currency_to,
+        graph,
+        amount=amount,
+        max_length=hops,
+    )
+    return await run_in_search_pool(
+        request,
+        best_paths_for_fiat,
+        currency_from,
+        currency_to,
+        graph,
+        hops,
+        best_rates=snapshot.best_rates,
+        amount=amount,
+        rated=True,
+    )
+
+
+def amount_tier(amount: float) -> float:
+    """The smallest power of 10 not less than amount, like 1000 for 250."""
+    if amount <= 0:
+        return amount
+    return 10.0 ** math.ceil(math.log10(amount))
+
+
+async def load_best_conversion_paths(request: Request, snapshot, query, amount):
+    # paths are found for the amount tier, so they are shared by amounts of
+    # the same order. Offers deep enough for the tier can take the amount.
+    tier = amount_tier(amount)
+    paths = await cached(
+        request.app.state.paths_cache,
+        (*query, tier, snapshot.version),
+        functools.partial(load_best_paths, request, snapshot, *query, tier),
+    )
+    return await run_in_search_pool(
+        request, prepare_conversion_paths, paths, amount, top_k=10
+    )
+
+
 # TODO: rename max_length to 'hops'
 @app.get("/best-rates/{currency_from}-{currency_to}")
 async def best_path_cli(
-    currency_from: str, currency_to: str, hops: int = 4, amount: float = 1
+    request: Request,
+    currency_from: str,
+    currency_to: str,
+    hops: int = 4,
+    amount: float = 1,
 ):
     """Return best conversion paths."""
-    graph = prepare()
-    hops = min(hops, 4)
-    paths = find_paths_for_fiat(currency_from, currency_to, graph, hops)
-    print(f"Found {len(paths)} paths to convert (Displaying top 10)")
-    conversion_paths = prepare_conversion_paths(paths, amount)
-    return conversion_paths[:10]
+    # identical queries to the same snapshot are answered from cache,
+    # other amounts of the same tier reuse found paths
+    snapshot = request.app.state.refresher.snapshot
+    query = (currency_from, currency_to, min(hops, MAX_HOPS))
+    return await cached(
+        request.app.state.results_cache,
+        (*query, amount, snapshot.version),
+        functools.partial(
+            load_best_conversion_paths, request, snapshot, query, amount
+        ),
+    )
+
+
+class RatesQuery(BaseModel):
+    currency_from: str
+    currency_to: str
+    amount: float = 1
+
+
+class BatchRatesRequest(BaseModel):
+    queries: List[RatesQuery]
+    hops: int = 4
+
+
+def best_paths_for_queries(queries, graph, hops, best_rates=None):
+    if best_rates is not None:
+        return join_paths_for_queries(queries, graph, best_rates, hops, top_k=10)
+    return [
+        search_paths_for_fiat(
+            currency_from, currency_to, graph.copy(), hops, top_k=10, amount=amount
+        )
+        for currency_from, currency_to, amount in queries
+    ]
+
+
+def conversion_paths_for_queries(queries, paths):
+    return [
+        {
+            "currency_from": currency_from,
+            "currency_to": currency_to,
+            "amount": amount,
+            "paths": prepare_conversion_paths(query_paths, amount, top_k=10),
+        }
+        for (currency_from, currency_to, amount), query_paths in zip(queries, paths)
+    ]
+
+
+async def load_batch_conversion_paths(request: Request, snapshot, queries, hops):
+    # one graph with P2P offers of all fiats, each of them is loaded once
+    graph = snapshot.graph.copy()
+    await load_c2c_for_queries_async(request.app.state.c2c, queries, graph, hops)
+    paths = await run_in_search_pool(
+        request,
+        best_paths_for_queries,
+        queries,
+        graph,
+        hops,
+        best_rates=snapshot.best_rates,
+    )
+    return await run_in_search_pool(
+        request, conversion_paths_for_queries, queries, paths
+    )
+
+
+@app.post("/best-rates/batch")
+async def best_rates_batch(request: Request, batch: BatchRatesRequest):
+    """
+    Return best conversion paths of each query, in the same order.
+
+    P2P offers of each fiat are shared by all queries, deep enough for the
+    largest amount. Queries with the same source currency share the search work.
+    """
+    snapshot = request.app.state.refresher.snapshot
+    queries = tuple(
+        (query.currency_from, query.currency_to, query.amount)
+        for query in batch.queries
+    )
+    hops = min(batch.hops, MAX_HOPS)
+    return await cached(
+        request.app.state.results_cache,
+        ("batch", queries, hops, snapshot.version),
+        functools.partial(
+            load_batch_conversion_paths, request, snapshot, queries, hops
+        ),
+    )
+
+
+def conversion_paths_from_fiat(currency_from, fiats, graph, hops, amount):
+    found = search_paths_from_fiat(currency_from, graph, hops, top_k=10, amount=amount)
+    return {
+        fiat: prepare_conversion_paths(found[fiat], amount, top_k=10)
+        for fiat in fiats
+        if fiat in found
+    }
+
+
+async def load_conversion_paths_from_fiat(
+    request: Request, snapshot, currency_from, fiats, hops, amount
+):
+    graph = snapshot.graph.copy()
+    await load_c2c_for_queries_async(
+        request.app.state.c2c,
+        [(currency_from, fiat, amount) for fiat in fiats],
+        graph,
+        hops,
+    )
+    return await run_in_search_pool(
+        request, conversion_paths_from_fiat, currency_from, fiats, graph, hops, amount
+    )
+
+
+@app.get("/best-rates/{currency_from}")
+async def best_rates_from(
+    request: Request,
+    currency_from: str,
+    fiats: List[str] = Query(default=[]),
+    hops: int = 4,
+    amount: float = 1,
+):
+    """
+    Return best conversion paths from currency to each of fiats.
+
+    Paths to all fiats (DEFAULT_FIATS if none are given) are found in one
+    pass over the graph. Fiats which can't be reached are left out.
+    """
+    snapshot = request.app.state.refresher.snapshot
+    fiats = tuple(fiat for fiat in fiats or DEFAULT_FIATS if fiat != currency_from)
+    hops = min(hops, MAX_HOPS)
+    return await cached(
+        request.app.state.results_cache,
+        ("from", currency_from, fiats, hops, amount, snapshot.version),
+        functools.partial(
+            load_conversion_paths_from_fiat,
+            request,
+            snapshot,
+            currency_from,
+            fiats,
+            hops,
+            amount,
+        ),
+    )
+
+
+@app.get("/cache-stats")
+async def cache_stats(request: Request):
+    """Hit rate and evictions of results caches."""
+    return {
+        "paths": request.app.state.paths_cache.stats(),
+        "results": request.app.state.results_cache.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Stage timings and counters in Prometheus text format."""
+    caches = {
+        "paths": request.app.state.paths_cache,
+        "results": request.app.state.results_cache,
+    }
+    for name, cache in caches.items():
+        stats = cache.stats()
+        for stat in ("size", "hits", "misses", "evictions", "expirations"):
+            METRICS.set(f"result_cache_{stat}", stats[stat], cache=name)
+    return METRICS.render()
+
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(request: Request, profile_id: str):
+    """Report of a profiled query: pstats file or collapsed stacks."""
+    found = request.app.state.profiles.get(profile_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    filename, report = found
+    return Response(
+        report,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def profitable_cycles(graph, hops, min_profit, amount):
+    paths = search_cycles(graph, hops, min_profit=min_profit)
+    logger.info(f"Found {len(paths)} profitable cycles (Displaying top 10)")
+    return [prepare_conversion_path(path, amount) for path in paths[:10]]
+
+
+@app.get("/arbitrage")
+async def arbitrage(
+    request: Request,
+    fiats: List[str] = Query(default=[]),
+    hops: int = 4,
+    min_profit: float = 0,
+    amount: float = 1,
+):
+    """Return most profitable conversion cycles."""
+    graph = request.app.state.refresher.snapshot.graph.copy()
+    hops = min(hops, MAX_HOPS)
+    await asyncio.gather(
+        *[
+            load_c2c_to_graph_async(request.app.state.c2c, fiat, fiat, graph)
+            for fiat in fiats
+        ]
+    )
+    return await run_in_search_pool(
+        request, profitable_cycles, graph, hops, min_profit, amount
+    )
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app)
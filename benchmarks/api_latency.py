@@ -0,0 +1,147 @@
+"""
+Latency of the API under concurrent load.
+
+Runs ``api:app`` against a local server replaying recorded Binance responses
+and measures request latency with many concurrent clients:
+
+    python -m benchmarks.api_latency --clients 50 --requests 500
+
+The app, the replay server and the clients run in separate processes.
+``--app-dir`` runs the app from another checkout (like a ``git worktree`` of
+an older commit) to compare before/after.
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import click
+import httpx
+import requests.adapters
+
+from tests.replay_server import ReplayServer
+
+BINANCE_HOSTS = ("api.binance.com", "c2c.binance.com")
+
+
+def redirect_upstreams(url: str):
+    """Send Binance requests of sync and async clients to replay server."""
+    send = requests.adapters.HTTPAdapter.send
+
+    def send_to_replay_server(self, request, *args, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.hostname in BINANCE_HOSTS:
+            request.url = request.url.replace(f"{parts.scheme}://{parts.netloc}", url)
+        return send(self, request, *args, **kwargs)
+
+    requests.adapters.HTTPAdapter.send = send_to_replay_server
+
+    import common
+    from providers import p2p
+
+    if hasattr(p2p, "BINANCE_C2C_URL"):
+        p2p.BINANCE_C2C_URL = f"{url}/bapi/c2c/v2/friendly/c2c"
+    if hasattr(common, "BINANCE_CONFIG"):
+        common.BINANCE_CONFIG.update({"urls": {"api": {"public": f"{url}/api/v3"}}})
+
+
+def run_replay_server(port: int, latency: float):
+    with ReplayServer(latency=latency, port=port):
+        while True:
+            time.sleep(3600)
+
+
+def run_app(port: int, upstream_url: str, app_dir: str):
+    if app_dir:
+        sys.path.insert(0, os.path.abspath(app_dir))
+    # requests cache of the app is created in current directory
+    os.chdir(tempfile.mkdtemp())
+    redirect_upstreams(upstream_url)
+    import api
+    import uvicorn
+
+    uvicorn.run(api.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+async def wait_started(url: str):
+    async with httpx.AsyncClient() as http:
+        while True:
+            try:
+                (await http.get(url)).raise_for_status()
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+
+async def measure(url: str, clients: int, total: int):
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def client(http: httpx.AsyncClient):
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            response = await http.get(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as http:
+        # warm up
+        (await http.get(url)).raise_for_status()
+        started = time.perf_counter()
+        await asyncio.gather(*[client(http) for _ in range(clients)])
+        elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+def percentile(values, percent):
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+@click.command()
+@click.option("--clients", default=50, help="Number of concurrent clients.")
+@click.option("--requests", "total", default=500, help="Total number of requests.")
+@click.option(
+    "--upstream-latency", default=0.05, help="Seconds replay server waits to respond."
+)
+@click.option("--path", default="/best-rates/KZT-RUB?hops=4", help="Request path.")
+@click.option("--port", default=8765, help="Port to run the app on.")
+@click.option("--upstream-port", default=8766, help="Port to run replay server on.")
+@click.option("--app-dir", default=None, help="Directory to import api.py from.")
+def main(clients, total, upstream_latency, path, port, upstream_port, app_dir):
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    processes = [
+        multiprocessing.Process(
+            target=run_replay_server, args=(upstream_port, upstream_latency)
+        ),
+        multiprocessing.Process(target=run_app, args=(port, upstream_url, app_dir)),
+    ]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    try:
+        asyncio.run(wait_started(f"http://127.0.0.1:{port}/"))
+        latencies, elapsed = asyncio.run(
+            measure(f"http://127.0.0.1:{port}{path}", clients, total)
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+    print(f"clients={clients} requests={len(latencies)} elapsed={elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(
+        f"latency p50={percentile(latencies, 50) * 1000:.0f}ms "
+        f"p99={percentile(latencies, 99) * 1000:.0f}ms "
+        f"max={max(latencies) * 1000:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
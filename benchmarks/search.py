@@ -0,0 +1,218 @@
+"""
+Path search over synthetic market graphs.
+
+Times every stage of answering a fiat query (see benchmarks.synthetic for
+graphs) across graph sizes and hop counts:
+
+    python -m benchmarks.search
+    python -m benchmarks.search --size small --repeat 5
+
+For each stage it reports wall time (best of ``--repeat`` runs), nodes
+explored by the search, paths found and peak memory traced by tracemalloc.
+Results are compared with baselines and the command fails when a stage is
+slower or takes more memory than allowed, or explores a different number of
+nodes. ``--save-baseline`` stores the results as new baselines.
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import click
+
+import common
+from benchmarks.synthetic import SyntheticMarket
+from decider.search import SearchStats
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines", "search.json")
+
+# assets, pairs, fiats
+SIZES = {
+    "small": (100, 600, 2),
+    "medium": (300, 2_000, 4),
+    "large": (1_000, 6_000, 8),
+}
+# hops measured for each size, number of all paths grows exponentially
+HOPS = {
+    "small": [2, 3, 4, 5],
+    "medium": [2, 3, 4],
+    "large": [2, 3, 4],
+}
+FIAT_FROM, FIAT_TO = "KZT", "RUB"
+# amount of FIAT_FROM for amount dependent rates
+AMOUNT = 100_000
+TOP_K = 10
+
+# allowed growth of time and memory over baseline, plus absolute slack
+# for stages too fast or too small to be measured precisely
+TIME_TOLERANCE = 0.5
+TIME_SLACK = 0.001
+MEMORY_TOLERANCE = 0.2
+MEMORY_SLACK_KIB = 64
+
+
+def measure(func: Callable, repeat: int) -> Tuple[float, int]:
+    """Best wall time of ``repeat`` runs and peak memory of one more run."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def stages(graph, hops: int) -> Dict[str, Callable[[], Tuple[int, int]]]:
+    """Functions of each stage returning (explored, found)."""
+    source, target = f"{FIAT_FROM}(f)", f"{FIAT_TO}(f)"
+    paths = [
+        common.Path(edges=edges)
+        for edges in graph.paths(source, target, max_length=hops, simple=True)
+    ]
+
+    def all_paths():
+        stats = SearchStats()
+        found = graph.paths(source, target, max_length=hops, simple=True, stats=stats)
+        return stats.explored, len(found)
+
+    def best_paths():
+        stats = SearchStats()
+        found = graph.best_paths(
+            source,
+            target,
+            max_length=hops,
+            top_k=TOP_K,
+            hop_penalty=common.HOP_PENALTY,
+            simple=True,
+            stats=stats,
+        )
+        return stats.explored, len(found)
+
+    def ordered_paths():
+        return len(paths), len(common.ordered_paths(paths, top_k=TOP_K))
+
+    def ordered_iter_paths():
+        # top K of lazily enumerated paths, memory doesn't grow with paths
+        stats = SearchStats()
+        found = common.ordered_paths(
+            (
+                common.Path(edges=edges)
+                for edges in graph.iter_paths(
+                    source, target, max_length=hops, simple=True, stats=stats
+                )
+            ),
+            top_k=TOP_K,
+        )
+        return stats.explored, len(found)
+
+    def prepare_conversion_paths():
+        found = common.prepare_conversion_paths(paths, AMOUNT, top_k=TOP_K)
+        return len(paths), len(found)
+
+    return {
+        "paths": all_paths,
+        "best_paths": best_paths,
+        "ordered_paths": ordered_paths,
+        "ordered_iter_paths": ordered_iter_paths,
+        "prepare_conversion_paths": prepare_conversion_paths,
+    }
+
+
+def run_suite(sizes: List[str], repeat: int, seed: int = 0) -> Dict[str, dict]:
+    """Results by case name like ``small/hops=3/paths``."""
+    results = {}
+    for size in sizes:
+        assets, pairs, fiats = SIZES[size]
+        graph = SyntheticMarket(assets, pairs, fiats, seed=seed).graph()
+        for hops in HOPS[size]:
+            for stage, func in stages(graph, hops).items():
+                explored, found = func()
+                seconds, peak = measure(func, repeat)
+                results[f"{size}/hops={hops}/{stage}"] = {
+                    "seconds": round(seconds, 6),
+                    "explored": explored,
+                    "found": found,
+                    "peak_kib": round(peak / 1024),
+                }
+    return results
+
+
+def load_baselines(path: str = BASELINES_PATH) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results: Dict[str, dict], path: str = BASELINES_PATH):
+    baselines = load_baselines(path)
+    baselines.update(results)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dict(sorted(baselines.items())), f, indent=2)
+        f.write("\n")
+
+
+def regressions(
+    result: dict,
+    baseline: dict,
+    time_tolerance: float = TIME_TOLERANCE,
+    memory_tolerance: float = MEMORY_TOLERANCE,
+) -> List[str]:
+    """Descriptions of what got worse than baseline, empty if nothing."""
+    found = []
+    if result["seconds"] > baseline["seconds"] * (1 + time_tolerance) + TIME_SLACK:
+        found.append(f"time {baseline['seconds']:.4f}s -> {result['seconds']:.4f}s")
+    max_peak = baseline["peak_kib"] * (1 + memory_tolerance) + MEMORY_SLACK_KIB
+    if result["peak_kib"] > max_peak:
+        found.append(f"memory {baseline['peak_kib']}KiB -> {result['peak_kib']}KiB")
+    for counter in ("explored", "found"):
+        if result[counter] != baseline[counter]:
+            found.append(f"{counter} {baseline[counter]} -> {result[counter]}")
+    return found
+
+
+@click.command()
+@click.option(
+    "--size",
+    "sizes",
+    multiple=True,
+    type=click.Choice(list(SIZES)),
+    help="Graph sizes to measure, all by default.",
+)
+@click.option("--repeat", default=3, help="Runs of each stage to take the best of.")
+@click.option("--time-tolerance", default=TIME_TOLERANCE, help="Allowed slowdown.")
+@click.option("--save-baseline", is_flag=True, help="Store results as new baselines.")
+def main(sizes, repeat, time_tolerance, save_baseline):
+    results = run_suite(list(sizes or SIZES), repeat)
+    baselines = load_baselines()
+    failed = False
+    for case, result in results.items():
+        baseline = baselines.get(case)
+        if baseline:
+            problems = regressions(result, baseline, time_tolerance)
+        else:
+            problems = ["no baseline"]
+        failed = failed or (baseline is not None and bool(problems))
+        print(
+            f"{case:45} {result['seconds'] * 1000:10.2f}ms "
+            f"explored={result['explored']:<9} found={result['found']:<6} "
+            f"peak={result['peak_kib']}KiB"
+            + (f"  {'; '.join(problems)}" if problems else "")
+        )
+    if save_baseline:
+        save_baselines(results)
+        print(f"Saved baselines to {BASELINES_PATH}")
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
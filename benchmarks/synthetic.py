@@ -0,0 +1,154 @@
+"""
+Seeded generator of realistic market graphs.
+
+Markets look like Binance spot: most assets are quoted against a few hubs
+(USDT first, then BTC, BUSD, ETH, BNB) and some against larger assets.
+Fiat nodes get P2P offers to buy and sell hub assets. Data is generated in
+the format of ccxt tickers / markets and C2C offers, so graphs are built by
+the same code as real ones. The same seed always gives the same graph.
+"""
+import math
+import random
+from typing import Dict, List, Tuple
+
+import common
+from decider.core import Graph
+from providers import p2p
+
+# hub assets with USD value and share of pairs quoted against them
+HUBS = {
+    "USDT": (1.0, 0.45),
+    "BTC": (20_000.0, 0.25),
+    "BUSD": (1.0, 0.15),
+    "ETH": (1_100.0, 0.1),
+    "BNB": (250.0, 0.05),
+}
+# fiats with units per USD
+FIATS = {
+    "KZT": 470.0,
+    "RUB": 61.0,
+    "EUR": 0.97,
+    "TRY": 18.6,
+    "UAH": 36.9,
+    "GEL": 2.7,
+    "AMD": 395.0,
+    "UZS": 11_200.0,
+}
+# assets traded for fiats on P2P
+P2P_ASSETS = ["USDT", "BTC", "BUSD", "ETH", "BNB"]
+# the largest assets also quote some pairs
+MINOR_QUOTES = 10
+TAKER_FEE = 0.001
+OFFERS_PER_ASSET = 10
+
+
+class SyntheticMarket:
+    def __init__(
+        self, assets: int = 300, pairs: int = 2_000, fiats: int = 4, seed: int = 0
+    ):
+        """
+        :param assets: number of assets besides hubs
+        :param pairs: number of spot markets, at least one per asset
+        :param fiats: number of fiats with P2P offers
+        """
+        if fiats > len(FIATS):
+            raise ValueError(f"At most {len(FIATS)} fiats are supported")
+        self.random = random.Random(seed)
+        self.values = {hub: value for hub, (value, _) in HUBS.items()}
+        for num in range(assets):
+            # USD value of assets spans from meme coins to BTC like ones
+            self.values[f"A{num:04d}"] = math.exp(
+                self.random.uniform(math.log(1e-5), math.log(1e4))
+            )
+        self.assets = [asset for asset in self.values if asset not in HUBS]
+        self.fiats = list(FIATS)[:fiats]
+        self.markets = self._markets(pairs)
+        self.tickers = {
+            market["symbol"]: self._ticker(market) for market in self.markets
+        }
+        self.offers = [
+            self._offers(fiat, asset, trade_type)
+            for fiat in self.fiats
+            for asset in P2P_ASSETS
+            for trade_type in ("BUY", "SELL")
+        ]
+
+    def _market(self, base: str, quote: str) -> dict:
+        return {
+            "id": f"{base}{quote}",
+            "symbol": f"{base}/{quote}",
+            "base": base,
+            "quote": quote,
+            "taker": TAKER_FEE,
+        }
+
+    def _markets(self, pairs: int) -> List[dict]:
+        hubs = list(HUBS)
+        symbols: Dict[Tuple[str, str], dict] = {}
+        for num, base in enumerate(hubs):
+            for quote in hubs[:num]:
+                symbols[(base, quote)] = self._market(base, quote)
+        for asset in self.assets:
+            symbols[(asset, "USDT")] = self._market(asset, "USDT")
+        hub_weights = [share for _, share in HUBS.values()]
+        largest = sorted(self.assets, key=self.values.get, reverse=True)
+        minor_quotes = largest[:MINOR_QUOTES]
+        attempts = 0
+        while len(symbols) < pairs and attempts < pairs * 10:
+            attempts += 1
+            base = self.random.choice(self.assets)
+            if self.random.random() < 0.85:
+                quote = self.random.choices(hubs, hub_weights)[0]
+            else:
+                quote = self.random.choice(minor_quotes)
+            if base == quote or {(base, quote), (quote, base)} & symbols.keys():
+                continue
+            symbols[(base, quote)] = self._market(base, quote)
+        return list(symbols.values())
+
+    def _ticker(self, market: dict) -> dict:
+        mid = self.values[market["base"]] / self.values[market["quote"]]
+        mid *= math.exp(self.random.gauss(0, 0.002))
+        spread = self.random.uniform(0.0002, 0.005)
+        return {
+            "symbol": market["symbol"],
+            "bid": mid * (1 - spread / 2),
+            "ask": mid * (1 + spread / 2),
+        }
+
+    def _offers(self, fiat: str, asset: str, trade_type: str) -> List[dict]:
+        price = self.values[asset] * FIATS[fiat]
+        offers = []
+        for _ in range(OFFERS_PER_ASSET):
+            # limits in fiat, from 50 to 1000 USD
+            min_amount = self.random.choice([50, 100, 500, 1_000]) * FIATS[fiat]
+            max_amount = min_amount * self.random.uniform(2, 100)
+            offer_price = price * (1 + self.random.uniform(-0.02, 0.02))
+            available = max_amount / offer_price * self.random.uniform(0.5, 2)
+            offers.append(
+                {
+                    "adv": {
+                        "tradeType": trade_type,
+                        "asset": asset,
+                        "fiatUnit": fiat,
+                        "price": f"{offer_price:.8g}",
+                        "minSingleTransAmount": f"{min_amount:.2f}",
+                        "maxSingleTransAmount": f"{max_amount:.2f}",
+                        "surplusAmount": f"{available:.8g}",
+                        "tradableQuantity": f"{available:.8g}",
+                    }
+                }
+            )
+        # best offers first, like C2C search returns them
+        offers.sort(
+            key=lambda offer: float(offer["adv"]["price"]),
+            reverse=trade_type == "BUY",
+        )
+        return offers
+
+    def graph(self) -> Graph:
+        """Crypto graph with P2P offers of all fiats."""
+        graph = common.build_crypto_graph(tickers=self.tickers, markets=self.markets)
+        for offers in self.offers:
+            p2p.add_c2c_offers_to_graph(offers, graph)
+        return graph
@@ -0,0 +1,82 @@
+"""
+Throughput of applying streamed book ticker updates to the crypto graph.
+
+Replays recorded ``!bookTicker`` messages from a local websocket server to
+``TickerFeed`` over a graph built of recorded Binance tickers:
+
+    python -m benchmarks.ticker_feed --repeat 10 --max-batch 500
+
+``--rates-hops`` also keeps precomputed best rates up to date, 0 disables it.
+"""
+import asyncio
+import time
+from datetime import timedelta
+
+import ccxt
+import click
+import vcr
+
+import common
+from snapshots import GraphRefresher
+from ticker_feed import TickerFeed, book_ticker_messages
+from tests.testutils import cassette
+from tests.ticker_replay_server import TickerReplayServer
+
+
+def load_recorded_market():
+    # each cassette interaction is played once, load them separately
+    with vcr.use_cassette(cassette("cassettes/fixtures/binance.yaml")):
+        tickers = ccxt.binance().fetch_tickers()
+    with vcr.use_cassette(cassette("cassettes/fixtures/binance.yaml")):
+        markets = ccxt.binance().fetch_markets()
+    return tickers, markets
+
+
+async def measure(repeat: int, max_batch: int, batch_interval: float, rates_hops: int):
+    tickers, markets = load_recorded_market()
+
+    async def build():
+        return common.build_crypto_graph(tickers=tickers, markets=markets)
+
+    refresher = GraphRefresher(
+        build=build,
+        precompute_rates=(
+            (lambda graph: common.precompute_best_rates(graph, rates_hops))
+            if rates_hops
+            else None
+        ),
+    )
+    await refresher.refresh()
+    async with TickerReplayServer(repeat=repeat) as server:
+        feed = TickerFeed(
+            refresher,
+            messages=lambda: book_ticker_messages(server.url),
+            batch_interval=timedelta(seconds=batch_interval),
+            max_batch=max_batch,
+        )
+        started = time.perf_counter()
+        await feed.consume(feed.messages())
+        elapsed = time.perf_counter() - started
+    return feed, elapsed
+
+
+@click.command()
+@click.option("--repeat", default=10, help="Times to replay the recording.")
+@click.option("--max-batch", default=500, help="Symbols applied in one batch.")
+@click.option("--batch-interval", default=1.0, help="Seconds to collect a batch.")
+@click.option("--rates-hops", default=0, help="Hops of precomputed best rates.")
+def main(repeat, max_batch, batch_interval, rates_hops):
+    feed, elapsed = asyncio.run(measure(repeat, max_batch, batch_interval, rates_hops))
+    print(
+        f"messages={feed.messages_count} batches={feed.batches_count} "
+        f"edges updated={feed.updated_edges_count} elapsed={elapsed:.2f}s"
+    )
+    print(f"stream: {feed.messages_count / elapsed:.0f} messages/s")
+    print(
+        f"applied: {feed.updates_per_second:.0f} edge updates/s "
+        f"({feed.apply_seconds / max(feed.batches_count, 1) * 1000:.1f}ms per batch)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
+import asyncio
 import logging
+from datetime import datetime, timezone
 from typing import List
 
 import click
 
 from common import (
+    DEPTH_CANDIDATES,
+    binance_client,
     install_requests_cache,
     prepare,
+    prepare_for_fiat,
     find_paths_for_fiat,
+    find_paths_for_queries,
+    find_cycles,
     ConversionPath,
+    prepare_conversion_path,
     prepare_conversion_paths,
+    prepare_conversion_paths_with_depth,
 )
+from metrics import METRICS
+from profiling import MODES, QueryProfile
+from snapshot_file import load_graph, save_graph
+from snapshots import SnapshotFileWriter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -38,18 +51,101 @@ def display_conversion_path_detailed(path: ConversionPath):
         )
 
 
-@click.command()
+class DefaultCommandGroup(click.Group):
+    """
+    Group running ``best-path`` when no command is given, so that options of
+    it work without the command name: ``python cli.py --currency-from KZT``.
+    """
+
+    default_command = "best-path"
+
+    def parse_args(self, ctx, args):
+        options = {name: param for param in self.params for name in param.opts}
+        # the command goes after options of the group
+        position = 0
+        while position < len(args):
+            name, has_value, _ = args[position].partition("=")
+            param = options.get(name)
+            if param is None:
+                break
+            position += 1 if param.is_flag or has_value else 2
+        rest = args[position:]
+        if not rest or (rest[0] != "--help" and rest[0] not in self.commands):
+            args = [*args[:position], self.default_command, *rest]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+@click.option(
+    "--timings", is_flag=True, help="Print time of each stage and counters at exit."
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    default=None,
+    help="Profile the command and save the report to the file.",
+)
+@click.option(
+    "--profile-mode",
+    type=click.Choice(MODES),
+    default="cprofile",
+    help="cprofile saves pstats, sample saves collapsed stacks for flamegraphs.",
+)
+@click.pass_context
+def cli(ctx, timings, profile_path, profile_mode):
+    """Find best ways to convert currencies, best-path if no command is given."""
+    if timings:
+        ctx.call_on_close(lambda: print(f"Timings:\n{METRICS.summary()}"))
+    if profile_path:
+        # C2C offers are loaded in threads, only sampling sees them
+        profile = QueryProfile(profile_mode, all_threads=True)
+        ctx.call_on_close(lambda: save_profile(profile, profile_path))
+        # closed before the report is saved
+        ctx.with_resource(profile.running())
+
+
+def save_profile(profile: QueryProfile, path: str):
+    with open(path, "wb") as f:
+        f.write(profile.finish())
+    print(f"Saved {profile.mode} profile to {path}")
+
+
+@cli.command("best-path")
 @click.option("--currency-from", default="KZT", help="Source fiat currency.")
 @click.option("--currency-to", default="RUB", help="Target currency.")
 @click.option("--max-length", default=3, help="Maximum length of conversion chain.")
 @click.option("--amount", default=1, help="Amount in source currency.")
-def best_path_cli(currency_from, currency_to, max_length, amount):
+@click.option(
+    "--top-k", default=10, help="Number of best paths to find. 0 - find all paths."
+)
+@click.option(
+    "--depth/--no-depth",
+    default=False,
+    help="Rate amount by order books of best paths instead of top of the book.",
+)
+@click.option("--snapshot", default=None, help="Load crypto graph from snapshot file.")
+def best_path_cli(
+    currency_from, currency_to, max_length, amount, top_k, depth, snapshot
+):
     """Print best conversion paths."""
     install_requests_cache()
-    graph = prepare()
-    paths = find_paths_for_fiat(currency_from, currency_to, graph, max_length)
+    if snapshot:
+        graph = load_graph(snapshot)
+    else:
+        graph = prepare_for_fiat(currency_from, currency_to, max_length)
+    if depth and top_k:
+        # order books can change ranking, find more candidates to re-rank
+        top_k = max(top_k, DEPTH_CANDIDATES)
+    paths = find_paths_for_fiat(
+        currency_from, currency_to, graph, max_length, top_k=top_k, amount=amount
+    )
     print(f"Found {len(paths)} paths to convert (Displaying top 10)")
-    conversion_paths = prepare_conversion_paths(paths, amount)
+    if depth:
+        conversion_paths = prepare_conversion_paths_with_depth(
+            paths, amount, binance_client().fetch_order_book
+        )
+    else:
+        conversion_paths = prepare_conversion_paths(paths, amount, top_k=10)
     if conversion_paths:
         display_path_rates(conversion_paths)
         print(f"Best paths:")
@@ -58,5 +154,92 @@ def best_path_cli(currency_from, currency_to, max_length, amount):
             display_conversion_path_detailed(path)
 
 
+def parse_query(query: str):
+    """``KZT-RUB`` or ``KZT-RUB:1000`` to (currency_from, currency_to, amount)."""
+    pair, _, amount = query.partition(":")
+    currency_from, _, currency_to = pair.partition("-")
+    if not currency_from or not currency_to:
+        raise click.BadParameter(f"{query} is not like KZT-RUB:1000")
+    return currency_from, currency_to, float(amount) if amount else 1
+
+
+@cli.command("best-paths")
+@click.argument("queries", nargs=-1, required=True)
+@click.option("--max-length", default=3, help="Maximum length of conversion chain.")
+@click.option("--snapshot", default=None, help="Load crypto graph from snapshot file.")
+def best_paths_cli(queries, max_length, snapshot):
+    """
+    Print best conversion paths of many queries at once.
+
+    P2P offers of each fiat are loaded once for all queries, like:
+
+    \b
+        python cli.py best-paths KZT-RUB:1000 KZT-EUR:1000 RUB-KZT:50000
+    """
+    queries = [parse_query(query) for query in queries]
+    install_requests_cache()
+    graph = load_graph(snapshot) if snapshot else prepare()
+    found = find_paths_for_queries(queries, graph, max_length, top_k=10)
+    for (currency_from, currency_to, amount), paths in zip(queries, found):
+        print("=" * 50)
+        print(f"{amount:g} {currency_from} to {currency_to}: found {len(paths)} paths")
+        display_path_rates(prepare_conversion_paths(paths, amount, top_k=10))
+
+
+@cli.command("arbitrage")
+@click.option(
+    "--fiat", "fiats", multiple=True, help="Include P2P offers of fiat currency."
+)
+@click.option("--max-length", default=4, help="Maximum length of conversion cycle.")
+@click.option("--min-profit", default=0.0, help="Minimal profit, like 0.001 for 0.1%.")
+@click.option("--amount", default=1, help="Amount in cycle start currency.")
+@click.option("--snapshot", default=None, help="Load crypto graph from snapshot file.")
+def arbitrage_cli(fiats, max_length, min_profit, amount, snapshot):
+    """Print profitable conversion cycles."""
+    install_requests_cache()
+    graph = load_graph(snapshot) if snapshot else prepare()
+    paths = find_cycles(fiats, graph, max_length, min_profit=min_profit)
+    print(f"Found {len(paths)} profitable cycles (Displaying top 10)")
+    conversion_paths = [prepare_conversion_path(path, amount) for path in paths]
+    if conversion_paths:
+        display_path_rates(conversion_paths)
+        print(f"Best cycles:")
+        for path in conversion_paths[0:3]:
+            print("=" * 50)
+            display_conversion_path_detailed(path)
+
+
+@cli.command("snapshot")
+@click.argument("path")
+def snapshot_cli(path):
+    """Save crypto graph to a snapshot file."""
+    install_requests_cache()
+    graph = prepare()
+    save_graph(path, graph, metadata={"created_at": datetime.now(timezone.utc).isoformat()})
+    print(f"Saved {len(graph.edges())} edges to {path}")
+
+
+@cli.command("publish")
+@click.argument("path")
+def publish_cli(path):
+    """
+    Keep crypto graph up to date and write its snapshots to a file.
+
+    API workers started with SNAPSHOT_PATH environment variable set to the
+    same path share the graph instead of building their own, like:
+
+    \b
+        python cli.py publish /dev/shm/graph.bin &
+        SNAPSHOT_PATH=/dev/shm/graph.bin uvicorn api:app --workers 4
+    """
+    from api import live_graph
+
+    async def publish():
+        async with live_graph() as refresher:
+            await SnapshotFileWriter(refresher, path).run()
+
+    asyncio.run(publish())
+
+
 if __name__ == "__main__":
-    best_path_cli()
+    cli()
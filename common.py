@@ -1,20 +1,42 @@
+import asyncio
+import heapq
+import logging
 import math
 from datetime import timedelta
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 
-import ccxt
+import numpy as np
 from pydantic import BaseModel
-from requests_cache import install_cache
 
+from decider.allpairs import BestRates
+from decider.compact import edge_multiplier
 from decider.core import Graph, Edge
+from decider.search import SearchStats
+from metrics import METRICS
 from providers import p2p, crypto
 
+if TYPE_CHECKING:
+    import ccxt.async_support
+
+logger = logging.getLogger(__name__)
+
+# each additional hop reduces path score by 2%
+HOP_PENALTY = 0.02
+
+# best paths by top of the book rates which order books are loaded for
+DEPTH_CANDIDATES = 30
+
+# ccxt binance exchange config, allows to point clients to another server
+BINANCE_CONFIG = {}
+
 
 def install_requests_cache():
+    from requests_cache import install_cache
+
     default_expire_after = timedelta(hours=1)
     urls_expire_after = {
-        "c2c.binance.com/bapi/c2c/v2/friendly/c2c/portal/config": timedelta(days=3),
-        "c2c.binance.com/bapi/c2c/v2/friendly/c2c/adv/search": timedelta(minutes=30),
+        "c2c.binance.com/bapi/c2c/v2/friendly/c2c/portal/config": p2p.C2C_CONFIG_EXPIRE,
+        "c2c.binance.com/bapi/c2c/v2/friendly/c2c/adv/search": p2p.C2C_SEARCH_EXPIRE,
         "api.binance.com/api/v3/exchangeInfo": timedelta(days=3),
         "api.binance.com/api/v3/ticker/24hr": timedelta(minutes=30),
     }
@@ -27,35 +49,547 @@ def install_requests_cache():
     )
 
 
+def binance_client():
+    # ccxt loads all exchanges on import, import it only when it is used
+    import ccxt
+
+    return ccxt.binance(BINANCE_CONFIG)
+
+
 def prepare():
     # load binance crypto quotes
-    graph = Graph()
-    binance = ccxt.binance()
-    crypto.add_quotes_to_graph(
-        tickers=binance.fetch_tickers(), markets=binance.fetch_markets(), graph=graph
+    binance = binance_client()
+    with METRICS.timer("fetch_markets"):
+        markets = list(binance.load_markets().values())
+    with METRICS.timer("fetch_tickers"):
+        tickers = binance.fetch_tickers()
+    return build_crypto_graph(tickers=tickers, markets=markets)
+
+
+def prepare_for_fiat(fiat_from, fiat_to, max_length) -> Graph:
+    """
+    Same as prepare() with tickers of markets paths between fiats can go through.
+
+    Assets of P2P offers are taken from C2C configs, only tickers of markets
+    within ``max_length - 2`` conversions between them are fetched. Use
+    prepare() to warm up a graph for any query.
+    """
+    binance = binance_client()
+    with METRICS.timer("fetch_markets"):
+        markets = list(binance.load_markets().values())
+    planned = crypto.markets_within_hops(
+        markets,
+        sources=p2p.binance_c2c_assets(fiat_from, "BUY"),
+        targets=p2p.binance_c2c_assets(fiat_to, "SELL"),
+        hops=max(max_length - 2, 0),
+    )
+    logger.info(f"Fetching tickers of {len(planned)} of {len(markets)} markets")
+    with METRICS.timer("fetch_tickers"):
+        tickers = crypto.fetch_market_tickers(binance, planned)
+    return build_crypto_graph(tickers=tickers, markets=planned)
+
+
+async def prepare_async(binance: "ccxt.async_support.binance") -> Graph:
+    """
+    Same as prepare() using async ccxt client.
+
+    Markets are loaded once per client, only tickers are fetched every call.
+    """
+    with METRICS.timer("fetch_markets"):
+        await binance.load_markets()
+    with METRICS.timer("fetch_tickers"):
+        tickers = await binance.fetch_tickers()
+    return await asyncio.to_thread(
+        build_crypto_graph, tickers=tickers, markets=list(binance.markets.values())
     )
+
+
+def build_crypto_graph(tickers, markets) -> Graph:
+    with METRICS.timer("build_graph"):
+        graph = Graph()
+        crypto.add_quotes_to_graph(tickers=tickers, markets=markets, graph=graph)
+    METRICS.set("graph_edges", len(graph.edges()), graph="crypto")
     return graph
 
 
-def load_c2c_to_graph(fiat_from, fiat_to, graph):
-    # load binance C2C quotes
-    for offers in p2p.load_binance_c2c_offers(fiat=fiat_from, trade_type="BUY").values():
-        p2p.add_c2c_offers_to_graph(offers, graph)
-    for offers in p2p.load_binance_c2c_offers(fiat=fiat_to, trade_type="SELL").values():
-        p2p.add_c2c_offers_to_graph(offers, graph)
+def load_c2c_to_graph(fiat_from, fiat_to, graph, amount=None, max_length=None):
+    """
+    Load binance C2C quotes.
+
+    :param amount: amount of fiat_from to convert, offers are loaded until
+        they can take it. None - only the first page.
+    :param max_length: maximum length of conversion chain, offers selling
+        assets for fiat_to are loaded deeper when their first page can't
+        take what ``amount`` converts to (see c2c_target_liquidity). P2P
+        edges are left rated at amount (see rate_c2c_at_amount), searches
+        don't need to rate them again.
+    """
+    load_c2c_sides_to_graph(
+        [(fiat_from, "BUY"), (fiat_to, "SELL")],
+        graph,
+        min_liquidity={fiat_from: amount} if amount else None,
+    )
+    if amount and max_length:
+        liquidity = c2c_target_liquidity(fiat_from, fiat_to, graph, amount, max_length)
+        if liquidity:
+            load_c2c_sides_to_graph(
+                [(fiat_to, "SELL")], graph, min_liquidity={fiat_to: liquidity}
+            )
+            rate_c2c_at_amount(fiat_from, graph, amount, max_length)
+
+
+def load_c2c_sides_to_graph(sides, graph, min_liquidity=None):
+    """
+    Load binance C2C quotes of several fiats at once.
+
+    :param sides: list of (fiat, trade_type)
+    :param min_liquidity: fiat amount offers of each asset should take, by fiat
+    """
+    with METRICS.timer("load_c2c"):
+        side_offers = p2p.load_binance_c2c_offers_bulk(
+            sides, min_liquidity=min_liquidity
+        )
+        for asset_offers in side_offers:
+            for offers in asset_offers.values():
+                p2p.add_c2c_offers_to_graph(offers, graph)
+
+
+async def load_c2c_to_graph_async(
+    client: p2p.AsyncC2CClient,
+    fiat_from,
+    fiat_to,
+    graph,
+    amount=None,
+    max_length=None,
+):
+    """
+    Same as load_c2c_to_graph, offers of both sides are loaded concurrently.
+    Searches on the graph run in a thread, not to block the event loop.
+    """
+    with METRICS.timer("load_c2c"):
+        offers_from, offers_to = await asyncio.gather(
+            p2p.load_binance_c2c_offers_async(
+                client, fiat=fiat_from, trade_type="BUY", min_liquidity=amount
+            ),
+            p2p.load_binance_c2c_offers_async(client, fiat=fiat_to, trade_type="SELL"),
+        )
+        for offers in list(offers_from.values()) + list(offers_to.values()):
+            p2p.add_c2c_offers_to_graph(offers, graph)
+        if not (amount and max_length):
+            return
+        liquidity = await asyncio.to_thread(
+            c2c_target_liquidity, fiat_from, fiat_to, graph, amount, max_length
+        )
+        if liquidity:
+            offers_to = await p2p.load_binance_c2c_offers_async(
+                client, fiat=fiat_to, trade_type="SELL", min_liquidity=liquidity
+            )
+            for offers in offers_to.values():
+                p2p.add_c2c_offers_to_graph(offers, graph)
+            await asyncio.to_thread(
+                rate_c2c_at_amount, fiat_from, graph, amount, max_length
+            )
+
+
+def c2c_target_liquidity(fiat_from, fiat_to, graph, amount, max_length):
+    """
+    Amount of fiat_to which offers selling assets for it should take, when
+    the loaded ones can't take what ``amount`` of fiat_from converts to.
+
+    It is estimated by the best conversion of amount to each asset (see
+    rate_c2c_at_amount) at reference prices of the offers.
+
+    :return: fiat_to amount, None if loaded offers are deep enough
+    """
+    asset_amounts = rate_c2c_at_amount(fiat_from, graph, amount, max_length)
+    return _target_liquidity(fiat_to, graph, asset_amounts)
+
+
+def _target_liquidity(fiat_to, graph, asset_amounts):
+    edges = [
+        edge
+        for edge in graph.edges_to(f"{fiat_to}(f)")
+        if isinstance(edge, p2p.BinnanceP2PEdge)
+        and edge.from_.currency in asset_amounts
+    ]
+    target_amount = max(
+        (asset_amounts[edge.from_.currency] * edge.price for edge in edges), default=0
+    )
+    if all(
+        sum(map(p2p.offer_liquidity, edge.offers)) >= target_amount for edge in edges
+    ):
+        return None
+    return target_amount
+
+
+def c2c_sides_of_queries(queries):
+    """
+    P2P offers needed for (fiat_from, fiat_to, amount) queries.
+
+    Each side is loaded once: offers to buy assets for source fiats, deep
+    enough for the largest amount of the fiat, and to sell assets for
+    target fiats.
+
+    :return: list of (fiat, trade_type) and min_liquidity by fiat
+    """
+    sides = {}
+    min_liquidity = {}
+    for fiat_from, fiat_to, amount in queries:
+        sides[(fiat_from, "BUY")] = None
+        sides[(fiat_to, "SELL")] = None
+        if amount:
+            min_liquidity[fiat_from] = max(amount, min_liquidity.get(fiat_from, 0))
+    return list(sides), min_liquidity
+
+
+def c2c_targets_liquidity(queries, graph, max_length):
+    """
+    Same as c2c_target_liquidity for many (fiat_from, fiat_to, amount) queries.
+
+    Queries are grouped by source fiat and amount, P2P edges are rated at
+    amount of each group in its own copy of the graph.
+
+    :return: the largest amount of each target fiat which loaded offers
+        can't take, by fiat
+    """
+    targets = {}
+    for fiat_from, fiat_to, amount in queries:
+        if amount:
+            targets.setdefault((fiat_from, amount), {})[fiat_to] = None
+    min_liquidity = {}
+    for (fiat_from, amount), fiat_tos in targets.items():
+        rated = graph.copy()
+        asset_amounts = rate_c2c_at_amount(fiat_from, rated, amount, max_length)
+        for fiat_to in fiat_tos:
+            liquidity = _target_liquidity(fiat_to, rated, asset_amounts)
+            if liquidity:
+                min_liquidity[fiat_to] = max(liquidity, min_liquidity.get(fiat_to, 0))
+    return min_liquidity
+
+
+def load_c2c_for_queries(queries, graph, max_length=None):
+    """
+    Load binance C2C quotes of all (fiat_from, fiat_to, amount) queries once.
+
+    :param max_length: maximum length of conversion chain, offers selling
+        assets for target fiats are loaded deeper when their first page can't
+        take what amounts convert to (see c2c_targets_liquidity)
+    """
+    sides, min_liquidity = c2c_sides_of_queries(queries)
+    load_c2c_sides_to_graph(sides, graph, min_liquidity=min_liquidity)
+    if not max_length:
+        return
+    min_liquidity = c2c_targets_liquidity(queries, graph, max_length)
+    if min_liquidity:
+        load_c2c_sides_to_graph(
+            [(fiat, "SELL") for fiat in min_liquidity],
+            graph,
+            min_liquidity=min_liquidity,
+        )
+
+
+async def load_c2c_for_queries_async(
+    client: p2p.AsyncC2CClient, queries, graph, max_length=None
+):
+    """
+    Same as load_c2c_for_queries, all offers are loaded concurrently.
+    Searches on the graph run in a thread, not to block the event loop.
+    """
+    sides, min_liquidity = c2c_sides_of_queries(queries)
+    with METRICS.timer("load_c2c"):
+        await _load_c2c_sides_async(client, sides, graph, min_liquidity)
+        if not max_length:
+            return
+        min_liquidity = await asyncio.to_thread(
+            c2c_targets_liquidity, queries, graph, max_length
+        )
+        if min_liquidity:
+            await _load_c2c_sides_async(
+                client, [(fiat, "SELL") for fiat in min_liquidity], graph, min_liquidity
+            )
+
+
+async def _load_c2c_sides_async(client, sides, graph, min_liquidity):
+    side_offers = await asyncio.gather(
+        *[
+            p2p.load_binance_c2c_offers_async(
+                client,
+                fiat=fiat,
+                trade_type=trade_type,
+                min_liquidity=min_liquidity.get(fiat),
+            )
+            for fiat, trade_type in sides
+        ]
+    )
+    for asset_offers in side_offers:
+        for offers in asset_offers.values():
+            p2p.add_c2c_offers_to_graph(offers, graph)
 
 
-def find_paths_for_fiat(fiat_from, fiat_to, graph, max_length):
-    load_c2c_to_graph(fiat_from, fiat_to, graph)
+def find_paths_for_fiat(
+    fiat_from, fiat_to, graph, max_length, top_k=None, amount=None
+):
+    """
+    Find conversion paths between fiats.
 
-    paths = graph.paths(
-        from_currency=f"{fiat_from}(f)",
-        to_currency=f"{fiat_to}(f)",
-        max_length=max_length,
+    :param top_k: return only K best paths (by score). None - return all paths.
+    :param amount: amount of fiat_from, P2P offers are loaded deep enough for it
+        and rated at it
+    """
+    load_c2c_to_graph(fiat_from, fiat_to, graph, amount=amount, max_length=max_length)
+    return search_paths_for_fiat(
+        fiat_from,
+        fiat_to,
+        graph,
+        max_length,
+        top_k=top_k,
+        amount=amount or 1,
+        rated=bool(amount),
     )
+
+
+def rate_c2c_at_amount(fiat_from, graph, amount, max_length):
+    """
+    Rate P2P edges of graph at amounts a conversion of ``amount`` fiat_from
+    passes through them, instead of a unit of their input currency.
+
+    Offers to buy assets for fiat_from are rated at ``amount``. Offers to sell
+    assets are rated at amount of the asset the best path up to
+    ``max_length - 1`` hops gives for it. Offers which can't take the amount
+    get 0 rate, searches skip them.
+
+    :return: amounts of assets bought for amount, by asset
+    """
+    source = f"{fiat_from}(f)"
+    for edge in graph.edges_from(source):
+        if isinstance(edge, p2p.BinnanceP2PEdge):
+            graph.update_edge(edge.at_amount(amount))
+    sell_edges = [
+        edge
+        for edge in graph.edges()
+        if isinstance(edge, p2p.BinnanceP2PEdge)
+        and edge.to.currency.endswith("(f)")
+        and edge.to.currency != source
+    ]
+    if not sell_edges or max_length < 2:
+        return {}
+    best = graph.best_paths_from(
+        from_currency=source,
+        to_currencies={edge.from_.currency for edge in sell_edges},
+        max_length=max_length - 1,
+        top_k=1,
+        hop_penalty=HOP_PENALTY,
+        simple=True,
+    )
+    asset_amounts = {
+        asset: Path(edges=paths[0]).converted(amount)
+        for asset, paths in best.items()
+        if paths
+    }
+    for edge in sell_edges:
+        asset_amount = asset_amounts.get(edge.from_.currency, 0)
+        if asset_amount > 0:
+            graph.update_edge(edge.at_amount(asset_amount))
+    return asset_amounts
+
+
+def search_paths_for_fiat(
+    fiat_from, fiat_to, graph, max_length, top_k=None, amount=1, rated=False
+):
+    """
+    Same as find_paths_for_fiat for graph which already has P2P offers.
+
+    :param amount: amount of fiat_from, P2P edges of graph are rated at it
+    :param rated: P2P edges are already rated at amount, like by
+        load_c2c_to_graph with max_length
+    """
+    if not rated:
+        rate_c2c_at_amount(fiat_from, graph, amount, max_length)
+    # paths going through the same currency twice are not practical
+    stats = SearchStats()
+    METRICS.set("graph_edges", len(graph.edges()), graph="query")
+    with METRICS.timer("search"):
+        if top_k:
+            paths = graph.best_paths(
+                from_currency=f"{fiat_from}(f)",
+                to_currency=f"{fiat_to}(f)",
+                max_length=max_length,
+                top_k=top_k,
+                hop_penalty=HOP_PENALTY,
+                simple=True,
+                stats=stats,
+            )
+        else:
+            paths = graph.paths(
+                from_currency=f"{fiat_from}(f)",
+                to_currency=f"{fiat_to}(f)",
+                max_length=max_length,
+                simple=True,
+                stats=stats,
+            )
+    METRICS.inc("paths_explored", stats.explored)
+    METRICS.inc("paths_found", len(paths))
+    logger.info(f"Search {fiat_from}-{fiat_to} in {max_length} hops: {stats}")
+    return [Path(edges=edges) for edges in paths]
+
+
+def search_paths_from_fiat(
+    fiat_from, graph, max_length, top_k=10, amount=1
+) -> Dict[str, List["Path"]]:
+    """
+    Same as search_paths_for_fiat with top_k to every fiat which P2P offers
+    are in the graph. All of them are found in one pass over the graph.
+
+    :return: paths by reachable target fiat
+    """
+    rate_c2c_at_amount(fiat_from, graph, amount, max_length)
+    source = f"{fiat_from}(f)"
+    targets = [
+        currency
+        for currency in graph.compact().currencies
+        if currency.endswith("(f)") and currency != source
+    ]
+    stats = SearchStats()
+    METRICS.set("graph_edges", len(graph.edges()), graph="query")
+    with METRICS.timer("search_from"):
+        found = graph.best_paths_from(
+            from_currency=source,
+            to_currencies=targets,
+            max_length=max_length,
+            top_k=top_k,
+            hop_penalty=HOP_PENALTY,
+            simple=True,
+            stats=stats,
+        )
+    METRICS.inc("paths_explored", stats.explored)
+    METRICS.inc("paths_found", sum(map(len, found.values())))
+    logger.info(f"Search from {fiat_from} in {max_length} hops: {stats}")
+    return {
+        currency[: -len("(f)")]: [Path(edges=edges) for edges in paths]
+        for currency, paths in found.items()
+    }
+
+
+def precompute_best_rates(graph, max_length) -> BestRates:
+    """
+    Best rates of crypto graph for fiat queries up to ``max_length`` hops.
+
+    Paths between fiats are P2P buy, crypto conversions and P2P sell, so two
+    hops less are precomputed.
+    """
+    return graph.best_rates(max_length=max(max_length - 2, 0), hop_penalty=HOP_PENALTY)
+
+
+def join_paths_for_fiat(
+    fiat_from,
+    fiat_to,
+    graph,
+    best_rates,
+    max_length,
+    top_k=10,
+    amount=1,
+    rated=False,
+):
+    """
+    Same as search_paths_for_fiat with top_k using rates precomputed before
+    P2P offers were added to the graph.
+
+    Precomputed rates bound the rest of each path, so paths are the same as
+    search_paths_for_fiat finds. Paths through P2P offers of other fiats in
+    the graph are not considered.
+    """
+    if not rated:
+        rate_c2c_at_amount(fiat_from, graph, amount, max_length)
+    with METRICS.timer("join"):
+        paths = best_rates.best_paths(
+            first_edges=graph.edges_from(f"{fiat_from}(f)"),
+            last_edges=graph.edges_to(f"{fiat_to}(f)"),
+            max_length=max_length,
+            top_k=top_k,
+        )
+    METRICS.inc("paths_found", len(paths))
     return [Path(edges=edges) for edges in paths]
 
 
+def join_paths_for_queries(queries, graph, best_rates, max_length, top_k=10):
+    """
+    Same as join_paths_for_fiat for many (fiat_from, fiat_to, amount) queries.
+
+    Queries are grouped by source fiat and amount, so first edges of a source
+    are joined once for all of its targets. P2P edges are rated at amount of
+    each group in its own copy of the graph.
+
+    :return: paths of each query, in the same order
+    """
+    targets = {}
+    for fiat_from, fiat_to, amount in queries:
+        targets.setdefault((fiat_from, amount or 1), {})[fiat_to] = None
+    found = {}
+    for (fiat_from, amount), fiat_tos in targets.items():
+        rated = graph.copy()
+        rate_c2c_at_amount(fiat_from, rated, amount, max_length)
+        with METRICS.timer("join"):
+            target_paths = best_rates.best_paths_many(
+                first_edges=rated.edges_from(f"{fiat_from}(f)"),
+                last_edges_of_targets=[
+                    rated.edges_to(f"{fiat_to}(f)") for fiat_to in fiat_tos
+                ],
+                max_length=max_length,
+                top_k=top_k,
+            )
+        for fiat_to, paths in zip(fiat_tos, target_paths):
+            found[(fiat_from, fiat_to, amount)] = [
+                Path(edges=edges) for edges in paths
+            ]
+    METRICS.inc("paths_found", sum(map(len, found.values())))
+    return [
+        found[(fiat_from, fiat_to, amount or 1)]
+        for fiat_from, fiat_to, amount in queries
+    ]
+
+
+def find_paths_for_queries(queries, graph, max_length, top_k=10):
+    """
+    Find conversion paths of many (fiat_from, fiat_to, amount) queries.
+
+    Best rates of the crypto graph are computed once for all queries and
+    P2P offers of each fiat are loaded once, paths are joined like
+    join_paths_for_queries.
+
+    :param graph: crypto graph, P2P offers are added to it
+    :return: paths of each query, in the same order
+    """
+    best_rates = precompute_best_rates(graph, max_length)
+    load_c2c_for_queries(queries, graph, max_length)
+    return join_paths_for_queries(queries, graph, best_rates, max_length, top_k=top_k)
+
+
+def find_cycles(fiats, graph, max_length, min_profit=0):
+    """
+    Find profitable conversion cycles (arbitrage).
+
+    :param fiats: fiat currencies which P2P offers are included in the graph
+    :param min_profit: minimal profit of the cycle, like 0.001 for 0.1%
+    :return: cycles, most profitable first. Cycles going through a fiat start from it.
+    """
+    load_c2c_sides_to_graph(
+        [(fiat, trade_type) for fiat in fiats for trade_type in ("BUY", "SELL")], graph
+    )
+    return search_cycles(graph, max_length, min_profit=min_profit)
+
+
+def search_cycles(graph, max_length, min_profit=0):
+    """Same as find_cycles for graph which already has P2P offers."""
+    paths = []
+    for _, edges in graph.cycles(max_length=max_length, min_profit=min_profit):
+        for num, edge in enumerate(edges):
+            if edge.from_.currency.endswith("(f)"):
+                edges = edges[num:] + edges[:num]
+                break
+        paths.append(Path(edges=edges))
+    return paths
+
+
 class Path:
     def __init__(self, edges: List[Edge]) -> None:
         self.edges = edges
@@ -65,6 +599,12 @@ class Path:
             [edge.converted() * (1 - edge.commission()) for edge in self.edges]
         )
 
+    def converted(self, amount: float = 1) -> float:
+        """Amount received for ``amount`` of source currency, for amount dependent rates."""
+        for edge in self.edges:
+            amount = edge.converted(amount) * (1 - edge.commission())
+        return amount
+
     def score(self):
         """
         Score for ordering paths. Highter score - better path.
@@ -74,12 +614,66 @@ class Path:
         3. TODO: take into account other possible difficulties of conversion
 
         """
-        return self.rate() * (1 - 0.02) ** len(self.edges)
+        return self.rate() * (1 - HOP_PENALTY) ** len(self.edges)
+
 
+def score_paths(
+    paths: List[Path], source_amount: float = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rates and scores of many paths at once, the same as Path.rate() and Path.score().
+
+    Paths are packed into a matrix of edge indexes padded with a neutral edge,
+    multipliers of each distinct edge are computed once. Rates for other
+    ``source_amount`` are computed by walking amount through each path, as
+    rates of P2P and order book edges depend on it.
+    """
+    lengths = np.fromiter((len(path.edges) for path in paths), np.int64, len(paths))
+    if source_amount != 1:
+        rates = np.fromiter(
+            (path.converted(source_amount) / source_amount for path in paths),
+            np.float64,
+            len(paths),
+        )
+        return rates, rates * (1 - HOP_PENALTY) ** lengths
+    edge_indexes = {}
+    multipliers = [1.0]  # padding
+    matrix = np.zeros((len(paths), lengths.max(initial=0)), dtype=np.int64)
+    for row, path in enumerate(paths):
+        for column, edge in enumerate(path.edges):
+            index = edge_indexes.get(id(edge))
+            if index is None:
+                index = edge_indexes[id(edge)] = len(multipliers)
+                multipliers.append(edge_multiplier(edge))
+            matrix[row, column] = index
+    rates = np.array(multipliers)[matrix].prod(axis=1)
+    scores = rates * (1 - HOP_PENALTY) ** lengths
+    return rates, scores
+
+
+def _top_indexes(scores: np.ndarray, top_k: Optional[int]) -> np.ndarray:
+    """Indexes of best scores, best first. Equal scores keep original order."""
+    candidates = np.arange(len(scores))
+    if top_k and top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
 
-def ordered_paths(path_rates: List[Path]) -> List[Path]:
-    """Re-order path rates according to score."""
-    return sorted(path_rates, key=lambda path: path.score(), reverse=True)
+
+def ordered_paths(
+    path_rates: Iterable[Path], top_k: Optional[int] = None
+) -> List[Path]:
+    """
+    Re-order path rates according to score. Only top_k best if given.
+
+    Paths which are not in a list, like of Graph.iter_paths(), are consumed
+    one by one keeping only top_k best in a heap.
+    """
+    with METRICS.timer("rank"):
+        if top_k and not isinstance(path_rates, list):
+            return heapq.nlargest(top_k, path_rates, key=Path.score)
+        path_rates = list(path_rates)
+        _, scores = score_paths(path_rates)
+        return [path_rates[index] for index in _top_indexes(scores, top_k)]
 
 
 class Conversion(BaseModel):
@@ -101,13 +695,20 @@ class ConversionPath(BaseModel):
     conversions: List[Conversion]
 
 
-def prepare_conversion_path(path: Path, source_amount=1) -> ConversionPath:
+def prepare_conversion_path(
+    path: Path, source_amount=1, rate: Optional[float] = None
+) -> ConversionPath:
+    """
+    :param rate: path.rate() if already known
+    """
+    if rate is None:
+        rate = path.rate()
     conversion_path = ConversionPath(
         source_currency=path.edges[0].from_.currency,
         amount_source_currency=source_amount,
-        conversion_rate=path.rate(),
+        conversion_rate=rate,
         target_currency=path.edges[-1].to.currency,
-        amount_target_currency=source_amount * path.rate(),
+        amount_target_currency=source_amount * rate,
         conversions=list(),
     )
     amount = source_amount
@@ -129,9 +730,70 @@ def prepare_conversion_path(path: Path, source_amount=1) -> ConversionPath:
 
 
 def prepare_conversion_paths(
-    paths: List[Path], source_amount=1
+    paths: List[Path], source_amount=1, top_k: Optional[int] = None
 ) -> List[ConversionPath]:
-    result = []
-    for path in ordered_paths(paths):
-        result.append(prepare_conversion_path(path, source_amount))
-    return result
+    """
+    Conversion paths ordered by score. Only top_k best are prepared if given.
+    Paths which can't convert the amount, like P2P offers can't take it, are
+    left out.
+    """
+    with METRICS.timer("rank"):
+        rates, scores = score_paths(paths, source_amount)
+        # P2P offers can't take the amount
+        scores[~(rates > 0)] = -np.inf
+        indexes = _top_indexes(scores, top_k)
+        indexes = indexes[rates[indexes] > 0]
+    with METRICS.timer("serialize"):
+        conversion_paths = [
+            prepare_conversion_path(
+                paths[index], source_amount, rate=float(rates[index])
+            )
+            for index in indexes
+        ]
+    METRICS.inc("paths_returned", len(conversion_paths))
+    return conversion_paths
+
+
+def load_order_books(paths: List[Path], fetch_order_book) -> int:
+    """
+    Load order books of crypto edges of paths.
+
+    :param fetch_order_book: function like ccxt ``binance.fetch_order_book``
+    :return: number of loaded order books
+    """
+    edges_by_symbol = {}
+    for path in paths:
+        for edge in path.edges:
+            if isinstance(edge, crypto.BinanceOrderBookEdge) and not edge.has_depth:
+                edges_by_symbol.setdefault(edge.ticker["symbol"], {})[id(edge)] = edge
+    for symbol, edges in edges_by_symbol.items():
+        METRICS.inc("upstream_requests", api="order_book")
+        with METRICS.timer("fetch_order_book"):
+            order_book = fetch_order_book(symbol, crypto.ORDER_BOOK_DEPTH)
+        for edge in edges.values():
+            edge.set_order_book(order_book)
+    logger.info(f"Loaded {len(edges_by_symbol)} order books")
+    return len(edges_by_symbol)
+
+
+def prepare_conversion_paths_with_depth(
+    paths: List[Path], source_amount, fetch_order_book, top_k=10
+) -> List[ConversionPath]:
+    """
+    Conversion paths ordered by amount received using order book depth.
+
+    Order books are loaded only for DEPTH_CANDIDATES best paths by top of
+    the book rates, they are re-ordered by amount actually received.
+    """
+    candidates = ordered_paths(paths, top_k=DEPTH_CANDIDATES)
+    load_order_books(candidates, fetch_order_book)
+    with METRICS.timer("serialize"):
+        rates = [path.converted(source_amount) / source_amount for path in candidates]
+        conversion_paths = [
+            prepare_conversion_path(path, source_amount, rate=rate)
+            for path, rate in zip(candidates, rates)
+            if rate > 0
+        ]
+        conversion_paths.sort(key=lambda path: path.conversion_rate, reverse=True)
+    METRICS.inc("paths_returned", min(len(conversion_paths), top_k))
+    return conversion_paths[:top_k]
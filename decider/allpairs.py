@@ -0,0 +1,296 @@
+"""
+All pairs best rates.
+
+Best walk scores between all pairs of nodes for every number of hops are
+computed by max-plus (max-product in log space) "matrix multiplication" of
+the score matrix with sparse edge weights: one vectorized relaxation of all
+edges per hop. Queries adding edges at both ends (like P2P offers of fiats)
+are then answered by a branch and bound search which takes upper bounds of
+the rest of the path from columns of the matrix instead of computing them.
+"""
+import copy
+import heapq
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from decider.compact import CompactGraph, edge_multiplier
+
+if TYPE_CHECKING:
+    from decider.core import Edge
+
+# start nodes relaxed together, limits memory to batch x edges
+BATCH_SIZE = 256
+
+
+class BestRates:
+    def __init__(self, graph: CompactGraph, max_length: int, hop_penalty: float = 0):
+        """
+        :param max_length: maximum hops of walks
+        :param hop_penalty: score reduction for each hop, like in best_paths
+        """
+        self.graph = graph
+        self.max_length = max_length
+        self.hop_penalty = hop_penalty
+        nodes = len(graph)
+        # scores[k, i, j] - best log score of walk from i to j of exactly k hops
+        self.scores = np.full((max_length + 1, nodes, nodes), -np.inf)
+        # CSR position of the last edge of such walk, -1 if there is no walk
+        self.predecessors = np.full(
+            (max_length + 1, nodes, nodes), -1, dtype=np.int32
+        )
+        np.fill_diagonal(self.scores[0], 0)
+        self._compute_rows(np.arange(nodes))
+
+    @classmethod
+    def from_arrays(
+        cls,
+        graph: CompactGraph,
+        max_length: int,
+        hop_penalty: float,
+        scores: np.ndarray,
+        predecessors: np.ndarray,
+    ) -> "BestRates":
+        """Rates computed before, like loaded from a file. Arrays are not copied."""
+        best_rates = cls.__new__(cls)
+        best_rates.graph = graph
+        best_rates.max_length = max_length
+        best_rates.hop_penalty = hop_penalty
+        best_rates.scores = scores
+        best_rates.predecessors = predecessors
+        return best_rates
+
+    def _compute_rows(self, rows: np.ndarray):
+        weights = self.graph.weights(self.hop_penalty)
+        sources = self.graph.sources
+        for batch_start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[batch_start : batch_start + BATCH_SIZE]
+            for length in range(1, self.max_length + 1):
+                best, predecessors = self.graph.best_in_edges(
+                    self.scores[length - 1, batch][:, sources] + weights
+                )
+                self.scores[length, batch] = best
+                self.predecessors[length, batch] = predecessors
+
+    def copy(self) -> "BestRates":
+        """Copy which can be updated without changing this one."""
+        best_rates = copy.copy(self)
+        best_rates.scores = self.scores.copy()
+        best_rates.predecessors = self.predecessors.copy()
+        return best_rates
+
+    def update(self, graph: CompactGraph, currencies: Iterable[str]) -> int:
+        """
+        Recompute rows of start nodes which walks can go through changed edges.
+
+        :param graph: the same graph with updated edges (see Graph.update_edge)
+        :param currencies: currencies which out-edges were changed
+        :return: number of recomputed rows
+        """
+        assert graph.currencies == self.graph.currencies
+        self.graph = graph
+        changed = [graph.index(currency) for currency in set(currencies)]
+        if not changed:
+            return 0
+        # walks of max_length hops use edges of nodes reachable in fewer hops
+        reaches = self.scores[: self.max_length][:, :, changed] > -np.inf
+        rows = np.flatnonzero(reaches.any(axis=(0, 2)))
+        self._compute_rows(rows)
+        return len(rows)
+
+    def walk(self, source: int, target: int, length: int) -> List[int]:
+        """CSR positions of edges of the best walk of ``length`` hops."""
+        positions = []
+        node = target
+        for hop in range(length, 0, -1):
+            position = int(self.predecessors[hop, source, node])
+            positions.append(position)
+            node = self.graph.sources[position]
+        positions.reverse()
+        return positions
+
+    def _log_weights(self, edges: Sequence["Edge"]) -> np.ndarray:
+        multipliers = np.array([edge_multiplier(edge) for edge in edges])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.log(multipliers) + math.log1p(-self.hop_penalty)
+        weights[~(multipliers > 0)] = -np.inf
+        return weights
+
+    def best_paths(
+        self,
+        first_edges: Sequence["Edge"],
+        last_edges: Sequence["Edge"],
+        max_length: Optional[int] = None,
+        top_k: int = 10,
+    ) -> List[List["Edge"]]:
+        """
+        Top K simple paths: one of first edges, walk through graph, one of last edges.
+
+        First and last edges are not part of the graph. Paths are the same as
+        search.best_paths finds in the graph with them added (the same scores,
+        equal scores can come in other order). Edges with ends outside of the
+        graph are ignored.
+
+        :param max_length: maximum hops of the whole path, including first
+            and last edges
+        :return: paths of edges, best first
+        """
+        return self.best_paths_many(first_edges, [last_edges], max_length, top_k)[0]
+
+    def best_paths_many(
+        self,
+        first_edges: Sequence["Edge"],
+        last_edges_of_targets: Sequence[Sequence["Edge"]],
+        max_length: Optional[int] = None,
+        top_k: int = 10,
+    ) -> List[List[List["Edge"]]]:
+        """
+        Same as best_paths for several targets sharing the first edges.
+
+        Weights of first edges and of the graph are gathered once, bounds and
+        the search are done for each target.
+
+        :param last_edges_of_targets: last edges of each target
+        :return: paths of each target, in the same order
+        """
+        max_length = self.max_length + 2 if max_length is None else max_length
+        hops = max_length - 2
+        first_edges = [
+            edge for edge in first_edges if self.graph.index(edge.to.currency) is not None
+        ]
+        if hops < 0 or not first_edges or top_k <= 0:
+            return [[] for _ in last_edges_of_targets]
+        starts = [self.graph.index(edge.to.currency) for edge in first_edges]
+        first_weights = self._log_weights(first_edges).tolist()
+        weights = self.graph.weights(self.hop_penalty)
+        return [
+            self._join(
+                first_edges, starts, first_weights, weights, last_edges, hops, top_k
+            )
+            for last_edges in last_edges_of_targets
+        ]
+
+    def _bounds(
+        self,
+        ends: List[int],
+        last_weights: np.ndarray,
+        weights: np.ndarray,
+        hops: int,
+    ) -> List[List[float]]:
+        """
+        ``bounds[k][node]`` is the best score of a walk from node of at most k
+        hops followed by one of last edges (ending at ``ends``).
+
+        Up to max_length hops it is exact best walk from the matrix, longer
+        walks are relaxed over edges like search.remaining_bounds. Walks can
+        repeat nodes, so it is never less than the score of a simple path.
+        """
+        has_outs = np.flatnonzero(np.diff(self.graph.offsets))
+        starts = self.graph.offsets[has_outs]
+        bound = np.full(len(self.graph), -np.inf)
+        bounds = []
+        for length in range(hops + 1):
+            if length <= self.max_length:
+                # best walk of exactly length hops to any of last edges
+                layer = (self.scores[length][:, ends] + last_weights).max(axis=1)
+            else:
+                layer = np.full(len(self.graph), -np.inf)
+                if len(starts):
+                    candidates = weights + bounds[-1][self.graph.targets]
+                    layer[has_outs] = np.maximum.reduceat(candidates, starts)
+            bound = np.maximum(bound, layer)
+            bounds.append(bound)
+        return [bound.tolist() for bound in bounds]
+
+    def _join(
+        self,
+        first_edges: List["Edge"],
+        starts: List[int],
+        first_weights: List[float],
+        weights: np.ndarray,
+        last_edges: Sequence["Edge"],
+        hops: int,
+        top_k: int,
+    ) -> List[List["Edge"]]:
+        """
+        Depth first branch and bound like search.best_paths. A path can end
+        by one of last edges at any node, walks go on by edges of the graph.
+        """
+        last_edges = [
+            edge
+            for edge in last_edges
+            if self.graph.index(edge.from_.currency) is not None
+        ]
+        if not last_edges:
+            return []
+        ends = [self.graph.index(edge.from_.currency) for edge in last_edges]
+        last_weights = self._log_weights(last_edges)
+        bounds = self._bounds(ends, last_weights, weights, hops)
+        # (weight, last edge) by node the last edge starts from
+        lasts: Dict[int, List[Tuple[float, int]]] = {}
+        for last, (end, weight) in enumerate(zip(ends, last_weights.tolist())):
+            lasts.setdefault(end, []).append((weight, last))
+        offsets = self.graph.offsets.tolist()
+        targets = self.graph.targets.tolist()
+        weights = weights.tolist()
+
+        # min-heap of (score, sequence, first edge, positions, last edge)
+        found = []
+        sequence = 0
+        positions: List[int] = []
+
+        def threshold() -> float:
+            return found[0][0] if len(found) >= top_k else -math.inf
+
+        def visit(first: int, node: int, score: float, visited: int, remaining: int):
+            nonlocal sequence
+            # (upper bound, is walk going on, last edge or CSR position)
+            candidates = [
+                (score + weight, False, last) for weight, last in lasts.get(node, [])
+            ]
+            if remaining:
+                reachable = bounds[remaining - 1]
+                for position in range(offsets[node], offsets[node + 1]):
+                    to = targets[position]
+                    if not visited >> to & 1:
+                        upper = score + weights[position] + reachable[to]
+                        candidates.append((upper, True, position))
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            for upper, goes_on, item in candidates:
+                if upper <= threshold():
+                    # candidates are sorted, the rest are even worse
+                    break
+                if not goes_on:
+                    sequence += 1
+                    path = (upper, sequence, first, list(positions), item)
+                    if len(found) < top_k:
+                        heapq.heappush(found, path)
+                    else:
+                        heapq.heapreplace(found, path)
+                    continue
+                to = targets[item]
+                positions.append(item)
+                visit(
+                    first, to, score + weights[item], visited | 1 << to, remaining - 1
+                )
+                positions.pop()
+
+        order = sorted(
+            range(len(first_edges)),
+            key=lambda first: first_weights[first] + bounds[hops][starts[first]],
+            reverse=True,
+        )
+        for first in order:
+            start = starts[first]
+            if first_weights[first] + bounds[hops][start] <= threshold():
+                break
+            visit(first, start, first_weights[first], 1 << start, hops)
+        return [
+            [first_edges[first]]
+            + [self.graph.edge(position) for position in path]
+            + [last_edges[last]]
+            for _, _, first, path, last in sorted(
+                found, key=lambda item: (-item[0], item[1])
+            )
+        ]
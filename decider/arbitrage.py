@@ -0,0 +1,150 @@
+"""
+Arbitrage (profitable cycle) detection.
+
+Cycle is profitable when sum of log multipliers of its edges is positive (the
+same as negative cycle for ``-log`` weights). Hop bounded Bellman-Ford over
+CompactGraph edge arrays gives, for a batch of start nodes at once, the best
+log-rate of any walk back to the start within k hops. It bounds a depth first
+enumeration of simple cycles: branches which can't close above the threshold
+are pruned, all cycles above it are found.
+"""
+import logging
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from decider.compact import CompactGraph
+
+logger = logging.getLogger(__name__)
+
+# number of start nodes relaxed together, limits memory to batch x edges
+BATCH_SIZE = 256
+# bounds are summed in another order than cycle weights, rounding must not
+# prune cycles right at the threshold
+BOUND_TOLERANCE = 1e-9
+
+
+def canonical_cycle(cycle: List[int]) -> Tuple[int, ...]:
+    """Rotation of cycle starting from its smallest edge position."""
+    start = cycle.index(min(cycle))
+    return tuple(cycle[start:] + cycle[:start])
+
+
+def return_bounds(
+    graph: CompactGraph, weights: np.ndarray, starts: np.ndarray, max_length: int
+) -> np.ndarray:
+    """
+    Upper bound of the best log-rate from each node back to each start.
+
+    ``bounds[k, row, node]`` is the best log-rate of any walk from node to
+    ``starts[row]`` with at most k hops, ``-inf`` if there is none.
+    """
+    has_outs = np.flatnonzero(np.diff(graph.offsets))
+    out_starts = graph.offsets[has_outs]
+    rows = np.arange(len(starts))
+    bound = np.full((len(starts), len(graph)), -np.inf)
+    bound[rows, starts] = 0
+    bounds = [bound]
+    for _ in range(max_length):
+        bound = np.full((len(starts), len(graph)), -np.inf)
+        if len(out_starts):
+            # CSR is grouped by source, so reduceat gives best out-edge per node
+            candidates = weights + bounds[-1][:, graph.targets]
+            bound[:, has_outs] = np.maximum.reduceat(candidates, out_starts, axis=1)
+        bound[rows, starts] = 0
+        bounds.append(bound)
+    return np.stack(bounds)
+
+
+def _cycles_from(
+    start: int,
+    bounds: List[List[float]],
+    offsets: List[int],
+    targets: List[int],
+    weights: List[float],
+    max_length: int,
+    threshold: float,
+    found: Dict[Tuple[int, ...], float],
+) -> int:
+    """
+    Add simple cycles through start above threshold to found.
+
+    Other nodes of the cycles are larger than start, so each cycle is found
+    once, from its smallest node.
+
+    :param bounds: ``bounds[k][node]`` of return_bounds() for the start
+    :return: number of explored nodes
+    """
+    edges: List[int] = []
+    visited = {start}
+    explored = 0
+
+    def visit(node: int, rate: float):
+        nonlocal explored
+        explored += 1
+        remaining = max_length - len(edges)
+        for position in range(offsets[node], offsets[node + 1]):
+            to = targets[position]
+            total = rate + weights[position]
+            if to == start:
+                if total > threshold:
+                    cycle = canonical_cycle(edges + [position])
+                    found[cycle] = math.expm1(total)
+                continue
+            if to < start or to in visited or remaining <= 1:
+                continue
+            if total + bounds[remaining - 1][to] < threshold - BOUND_TOLERANCE:
+                continue
+            edges.append(position)
+            visited.add(to)
+            visit(to, total)
+            visited.discard(to)
+            edges.pop()
+
+    visit(start, 0.0)
+    return explored
+
+
+def find_cycles(
+    graph: CompactGraph, max_length: int = 4, min_profit: float = 0
+) -> List[Tuple[float, List[int]]]:
+    """
+    Find all simple profitable cycles up to ``max_length`` hops.
+
+    :param min_profit: minimal profit, like 0.001 for 0.1%
+    :return: list of (profit, cycle as CSR edge positions), best first
+    """
+    if max_length < 1:
+        return []
+    threshold = math.log1p(min_profit)
+    weights = graph.weights()
+    offsets = graph.offsets.tolist()
+    targets = graph.targets.tolist()
+    weight_list = weights.tolist()
+    found: Dict[Tuple[int, ...], float] = {}
+    explored = 0
+    for batch_start in range(0, len(graph), BATCH_SIZE):
+        starts = np.arange(batch_start, min(batch_start + BATCH_SIZE, len(graph)))
+        bounds = return_bounds(graph, weights, starts, max_length)
+        for row, start in enumerate(starts.tolist()):
+            # best closed walk through start, most starts have none
+            outs = slice(offsets[start], offsets[start + 1])
+            closing = weights[outs] + bounds[max_length - 1, row, graph.targets[outs]]
+            if not len(closing) or closing.max() < threshold - BOUND_TOLERANCE:
+                continue
+            explored += _cycles_from(
+                start,
+                bounds[:, row].tolist(),
+                offsets,
+                targets,
+                weight_list,
+                max_length,
+                threshold,
+                found,
+            )
+    logger.info(
+        f"Found {len(found)} cycles up to {max_length} hops, explored {explored} nodes"
+    )
+    cycles = sorted(found.items(), key=lambda item: item[1], reverse=True)
+    return [(profit, list(cycle)) for cycle, profit in cycles]
@@ -0,0 +1,181 @@
+"""
+Compact, integer indexed form of the conversion graph.
+
+Currencies are interned to ints and adjacency is stored in CSR form:
+out-edges of node ``i`` are positions ``offsets[i]:offsets[i + 1]`` of the
+``targets`` and ``multipliers`` arrays. Edge objects are kept only to build
+the final result.
+"""
+import copy
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from decider.core import Edge
+
+
+def edge_multiplier(edge: "Edge") -> float:
+    """
+    Effective edge multiplier at ``edge.rate_amount``. For the default unit
+    amount it is the same as used by Path.rate.
+    """
+    amount = edge.rate_amount
+    if amount == 1:
+        return edge.converted() * (1 - edge.commission())
+    return edge.converted(amount) / amount * (1 - edge.commission(amount) / amount)
+
+
+class CompactGraph:
+    def __init__(
+        self, edges: Sequence["Edge"], base: Optional["CompactGraph"] = None
+    ):
+        """
+        Freeze edges into CSR arrays.
+
+        :param edges: graph edges. Order of out-edges of each node is kept.
+        :param base: compact form of the first edges (graph this one was copied
+            from). Its interned currencies and multipliers are reused.
+        """
+        self.currencies: List[str] = list(base.currencies) if base is not None else []
+        self._index: Dict[str, int] = dict(base._index) if base is not None else {}
+        reused = len(base._edges) if base is not None else 0
+        added = edges[reused:]
+        sources = np.fromiter(
+            (self._intern(edge.from_.currency) for edge in added),
+            dtype=np.int32,
+            count=len(added),
+        )
+        targets = np.fromiter(
+            (self._intern(edge.to.currency) for edge in added),
+            dtype=np.int32,
+            count=len(added),
+        )
+        multipliers = np.fromiter(
+            (edge_multiplier(edge) for edge in added),
+            dtype=np.float64,
+            count=len(added),
+        )
+        if base is not None:
+            base_sources, base_targets, base_multipliers = base.insertion_arrays()
+            sources = np.concatenate([base_sources, sources])
+            targets = np.concatenate([base_targets, targets])
+            multipliers = np.concatenate([base_multipliers, multipliers])
+        self._build(sources, targets, multipliers, edges)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        currencies: Sequence[str],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        multipliers: np.ndarray,
+        edges: Sequence["Edge"],
+    ) -> "CompactGraph":
+        """
+        Compact graph of already interned edges, like loaded from a file.
+
+        :param sources: index of edge source currency, in insertion order of edges
+        :param targets: index of edge target currency
+        :param multipliers: edge_multiplier() of each edge
+        """
+        compact = cls.__new__(cls)
+        compact.currencies = list(currencies)
+        compact._index = {currency: num for num, currency in enumerate(currencies)}
+        compact._build(sources, targets, multipliers, edges)
+        return compact
+
+    def _build(self, sources, targets, multipliers, edges: Sequence["Edge"]):
+        # stable sort keeps insertion order of out-edges of each node
+        order = self._order = np.argsort(sources, kind="stable")
+        # CSR position of each edge by its insertion position
+        self._positions = np.empty_like(order)
+        self._positions[order] = np.arange(len(order))
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.multipliers = multipliers[order]
+        self.offsets = np.zeros(len(self.currencies) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.sources, minlength=len(self.currencies)),
+            out=self.offsets[1:],
+        )
+        self._edges = [edges[position] for position in order.tolist()]
+
+        # in-edges grouped by target, used for vectorized relaxation
+        self._by_target = np.argsort(self.targets, kind="stable")
+        in_degrees = np.bincount(self.targets, minlength=len(self.currencies))
+        self._has_ins = np.flatnonzero(in_degrees)
+        self._in_degrees = in_degrees[self._has_ins]
+        self._in_starts = np.concatenate([[0], np.cumsum(self._in_degrees)[:-1]])
+
+    def _intern(self, currency: str) -> int:
+        index = self._index.get(currency)
+        if index is None:
+            index = self._index[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.currencies)
+
+    def index(self, currency: str) -> Optional[int]:
+        """Index of currency node, None if there is no such node."""
+        return self._index.get(currency)
+
+    def insertion_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sources, targets and multipliers of edges in their insertion order."""
+        restore = self._positions
+        return self.sources[restore], self.targets[restore], self.multipliers[restore]
+
+    def edge(self, position: int) -> "Edge":
+        """Edge object by its CSR position."""
+        return self._edges[position]
+
+    def copy(self) -> "CompactGraph":
+        """Copy which edges can be updated without changing this one."""
+        compact = copy.copy(self)
+        compact.multipliers = self.multipliers.copy()
+        compact._edges = list(self._edges)
+        return compact
+
+    def update_edges(self, edges: Mapping[int, "Edge"]):
+        """
+        Replace edges in place. Graph structure (ends of edges) must not change.
+
+        :param edges: new edges by insertion position
+        """
+        positions = self._positions[list(edges)]
+        self.multipliers[positions] = [edge_multiplier(edge) for edge in edges.values()]
+        for position, edge in zip(positions.tolist(), edges.values()):
+            self._edges[position] = edge
+
+    def weights(self, hop_penalty: float = 0) -> np.ndarray:
+        """Log multipliers of edges including per hop penalty. -inf for dead edges."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.log(self.multipliers) + np.log1p(-hop_penalty)
+        weights[~(self.multipliers > 0)] = -np.inf
+        return weights
+
+    def best_in_edges(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best (max) value over in-edges of every node.
+
+        :param values: array of shape (rows, edges) with value per CSR position
+        :return: best value per node, shape (rows, nodes), -inf for nodes
+            without in-edges; CSR position of the edge giving it, -1 if none
+        """
+        rows = values.shape[0]
+        best = np.full((rows, len(self)), -np.inf)
+        predecessors = np.full((rows, len(self)), -1, dtype=np.int64)
+        if not len(self._has_ins):
+            return best, predecessors
+        grouped = values[:, self._by_target]
+        grouped_best = np.maximum.reduceat(grouped, self._in_starts, axis=1)
+        # first position in each group which reaches the best value
+        is_best = grouped == np.repeat(grouped_best, self._in_degrees, axis=1)
+        positions = np.where(is_best, np.arange(grouped.shape[1]), grouped.shape[1])
+        first = np.minimum.reduceat(positions, self._in_starts, axis=1)
+        best[:, self._has_ins] = grouped_best
+        predecessors[:, self._has_ins] = self._by_target[first]
+        predecessors[best == -np.inf] = -1
+        return best, predecessors
@@ -1,9 +1,14 @@
 import logging
-from typing import List, Set, Optional
+from typing import Dict, Iterable, Iterator, List, Set, Optional, Tuple
 
+import numpy as np
 from pydantic import BaseModel
 from pydantic.fields import defaultdict, DefaultDict
 
+from decider import arbitrage, search
+from decider.allpairs import BestRates
+from decider.compact import CompactGraph
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,11 +19,24 @@ class Node(BaseModel):
         return hash(self.currency)
 
 
+# (from currency, to currency, provider)
+EdgeKey = Tuple[str, str, str]
+
+
 class Edge:
+    # source of rates, edges of different providers can connect the same nodes
+    provider = ""
+    # amount of input currency searches compare rate of the edge at, for
+    # edges which rate depends on amount (see edge_multiplier)
+    rate_amount: float = 1
+
     def __init__(self, from_: Node, to: Node):
         self.from_ = from_
         self.to = to
 
+    def key(self) -> EdgeKey:
+        return self.from_.currency, self.to.currency, self.provider
+
     def commission(self, amount: float = 1) -> float:
         return 0
 
@@ -59,13 +77,281 @@ class Graph:
         self._nodes: Set[Node] = set()
         self._edges: List[Edge] = list()
         self._node_outs: DefaultDict[Node, List[Edge]] = defaultdict(list)
+        self._node_ins: DefaultDict[Node, List[Edge]] = defaultdict(list)
+        # position of the last added edge with the key
+        self._positions: Dict[EdgeKey, int] = {}
+        # keys of edges updated since last pop_dirty()
+        self.dirty: Set[EdgeKey] = set()
+        self._compact: Optional[CompactGraph] = None
+        # compact form is shared with copies, it is cloned before update
+        self._compact_shared = False
+        # compact form of the graph this one was copied from
+        self._base: Optional[CompactGraph] = None
+        # positions of edges updated after base was taken
+        self._updated_base_edges: Set[int] = set()
+
+    @classmethod
+    def from_compact(cls, compact: CompactGraph) -> "Graph":
+        """Graph of edges of the compact form, which is used as is."""
+        graph = cls()
+        edges = [compact.edge(position) for position in compact._positions.tolist()]
+        graph._edges = edges
+        graph._positions = {edge.key(): num for num, edge in enumerate(edges)}
+        sources, targets, _ = compact.insertion_arrays()
+        # edges grouped by node in insertion order, the same as add() does
+        for ends, by_node, node_of in (
+            (sources, graph._node_outs, lambda edge: edge.from_),
+            (targets, graph._node_ins, lambda edge: edge.to),
+        ):
+            order = np.argsort(ends, kind="stable").tolist()
+            bounds = np.cumsum(np.bincount(ends, minlength=len(compact))).tolist()
+            start = 0
+            for end in bounds:
+                if end > start:
+                    group = [edges[num] for num in order[start:end]]
+                    by_node[node_of(group[0])] = group
+                start = end
+        graph._nodes = set(graph._node_outs) | set(graph._node_ins)
+        graph._compact = compact
+        return graph
+
+    def compact(self) -> CompactGraph:
+        """Frozen array form of the graph. Rebuilt after graph is changed."""
+        if self._compact is None:
+            self._compact = CompactGraph(self._edges, base=self._base)
+            if self._updated_base_edges:
+                self._compact.update_edges(
+                    {
+                        position: self._edges[position]
+                        for position in self._updated_base_edges
+                    }
+                )
+        return self._compact
+
+    def copy(self) -> "Graph":
+        """
+        Copy of the graph which can be extended without changing this one.
+
+        Edges are shared. Compact form of the copy reuses arrays of this graph.
+        """
+        graph = Graph()
+        graph._nodes = set(self._nodes)
+        graph._edges = list(self._edges)
+        graph._node_outs = defaultdict(
+            list, {node: list(edges) for node, edges in self._node_outs.items()}
+        )
+        graph._node_ins = defaultdict(
+            list, {node: list(edges) for node, edges in self._node_ins.items()}
+        )
+        graph._positions = dict(self._positions)
+        graph._base = self.compact()
+        graph._compact = graph._base
+        graph._compact_shared = self._compact_shared = True
+        return graph
 
     def paths(
-        self, from_currency: str, to_currency: str, max_length=4
+        self,
+        from_currency: str,
+        to_currency: str,
+        max_length=4,
+        simple: bool = False,
+        stats: Optional[search.SearchStats] = None,
     ) -> List[List[Edge]]:
-        from_ = Node(currency=from_currency)
-        to = Node(currency=to_currency)
-        return self.paths_recursive(from_node=from_, to_node=to, max_length=max_length)
+        """
+        All paths up to ``max_length`` hops.
+
+        :param simple: skip paths which visit the same currency twice
+        :param stats: search counters to fill
+        """
+        return list(
+            self.iter_paths(from_currency, to_currency, max_length, simple, stats)
+        )
+
+    def iter_paths(
+        self,
+        from_currency: str,
+        to_currency: str,
+        max_length=4,
+        simple: bool = False,
+        stats: Optional[search.SearchStats] = None,
+    ) -> Iterator[List[Edge]]:
+        """
+        Paths up to ``max_length`` hops one by one, in the order of paths().
+
+        Memory used by the search doesn't grow with the number of paths,
+        consumers keeping only best of them stay bounded too.
+
+        :param simple: skip paths which visit the same currency twice
+        :param stats: search counters to fill
+        """
+        compact = self.compact()
+        source = compact.index(from_currency)
+        target = compact.index(to_currency)
+        if from_currency == to_currency:
+            yield []
+            return
+        if source is None or target is None:
+            return
+        for path in search.iter_paths(
+            compact, source, target, max_length, simple=simple, stats=stats
+        ):
+            yield [compact.edge(position) for position in path]
+
+    def best_paths(
+        self,
+        from_currency: str,
+        to_currency: str,
+        max_length=4,
+        top_k=10,
+        hop_penalty: float = 0,
+        simple: bool = False,
+        stats: Optional[search.SearchStats] = None,
+    ) -> List[List[Edge]]:
+        """
+        Top K paths by score without enumerating all of them.
+
+        Score of the path is product of edge rates (including commissions)
+        reduced by ``hop_penalty`` for each hop.
+
+        :param simple: skip paths which visit the same currency twice
+        :param stats: search counters to fill
+        """
+        compact = self.compact()
+        source = compact.index(from_currency)
+        target = compact.index(to_currency)
+        if from_currency == to_currency:
+            return [[]]
+        if source is None or target is None:
+            return []
+        paths = search.best_paths(
+            compact,
+            source=source,
+            target=target,
+            max_length=max_length,
+            top_k=top_k,
+            hop_penalty=hop_penalty,
+            simple=simple,
+            stats=stats,
+        )
+        return [[compact.edge(position) for position in path] for path in paths]
+
+    def best_paths_from(
+        self,
+        from_currency: str,
+        to_currencies: Optional[Iterable[str]] = None,
+        max_length=4,
+        top_k=10,
+        hop_penalty: float = 0,
+        simple: bool = False,
+        stats: Optional[search.SearchStats] = None,
+    ) -> Dict[str, List[List[Edge]]]:
+        """
+        Top K paths from one currency to each of many at once.
+
+        The same as best_paths for each target currency, all of them are
+        found by one pass over the graph (see search.best_paths_from).
+
+        :param to_currencies: target currencies. None - all currencies.
+        :return: paths by reachable target currency, best first
+        """
+        compact = self.compact()
+        source = compact.index(from_currency)
+        if source is None:
+            return {}
+        targets = None
+        if to_currencies is not None:
+            targets = [
+                index
+                for index in map(compact.index, to_currencies)
+                if index is not None
+            ]
+        found = search.best_paths_from(
+            compact,
+            source=source,
+            max_length=max_length,
+            top_k=top_k,
+            hop_penalty=hop_penalty,
+            simple=simple,
+            targets=targets,
+            stats=stats,
+        )
+        return {
+            compact.currencies[target]: [
+                [compact.edge(position) for position in path] for path in paths
+            ]
+            for target, paths in found.items()
+        }
+
+    def cycles(
+        self, max_length=4, min_profit: float = 0
+    ) -> List[Tuple[float, List[Edge]]]:
+        """
+        Profitable cycles (arbitrage) up to ``max_length`` hops.
+
+        :param min_profit: minimal profit of the cycle, like 0.001 for 0.1%
+        :return: list of (profit, cycle edges), most profitable first
+        """
+        compact = self.compact()
+        return [
+            (profit, [compact.edge(position) for position in cycle])
+            for profit, cycle in arbitrage.find_cycles(
+                compact, max_length=max_length, min_profit=min_profit
+            )
+        ]
+
+    def best_rates(self, max_length=4, hop_penalty: float = 0) -> BestRates:
+        """
+        Best rates between all pairs of currencies up to ``max_length`` hops.
+
+        Computing takes a while, result is not cached and is not updated when
+        the graph changes.
+        """
+        return BestRates(self.compact(), max_length=max_length, hop_penalty=hop_penalty)
+
+    def edges(self) -> List[Edge]:
+        return list(self._edges)
+
+    def get_edge(self, key: EdgeKey) -> Optional[Edge]:
+        """The last added edge with the key."""
+        position = self._positions.get(key)
+        return self._edges[position] if position is not None else None
+
+    def edges_from(self, currency: str) -> List[Edge]:
+        return list(self._node_outs.get(Node(currency=currency), []))
+
+    def edges_to(self, currency: str) -> List[Edge]:
+        return list(self._node_ins.get(Node(currency=currency), []))
+
+    def update_edge(self, edge: Edge) -> Edge:
+        """
+        Replace edge with the same key (from, to, provider), like fresh quote.
+
+        Compact form is updated in place instead of rebuild. Key of the edge
+        is added to ``dirty`` so that data derived from the graph can be
+        updated only where needed.
+
+        :return: replaced edge
+        :raises KeyError: there is no edge with the key
+        """
+        position = self._positions[edge.key()]
+        old = self._edges[position]
+        self._edges[position] = edge
+        for edges in (self._node_outs[edge.from_], self._node_ins[edge.to]):
+            edges[next(num for num, item in enumerate(edges) if item is old)] = edge
+        if self._base is not None and position < len(self._base._edges):
+            self._updated_base_edges.add(position)
+        if self._compact is not None:
+            if self._compact_shared:
+                self._compact = self._compact.copy()
+                self._compact_shared = False
+            self._compact.update_edges({position: edge})
+        self.dirty.add(edge.key())
+        return old
+
+    def pop_dirty(self) -> Set[EdgeKey]:
+        """Keys of edges updated since previous call."""
+        dirty, self.dirty = self.dirty, set()
+        return dirty
 
     def add(self, edge: Edge):
         assert edge
@@ -73,28 +359,21 @@ class Graph:
         assert edge.to
         self._nodes.add(edge.from_)
         self._nodes.add(edge.to)
+        self._positions[edge.key()] = len(self._edges)
         self._edges.append(edge)
         self._node_outs[edge.from_].append(edge)
-
-    def __from_node(self, node: Node) -> List[Edge]:
-        return self._node_outs[node]
+        self._node_ins[edge.to].append(edge)
+        self._compact = None
+        self._compact_shared = False
 
     def paths_recursive(
         self, from_node: Node, to_node: Node, max_length: int, edges: List[Edge] = None
     ) -> List[List[Edge]]:
+        """All paths continuing ``edges``, see iter_paths()."""
         edges = edges if edges else []
-        if from_node == to_node:
-            return [edges]
-        if len(edges) >= max_length:
-            return []
-        found_paths = []
-        for edge in self.__from_node(from_node):
-            new_edges = list(edges)
-            new_edges.append(edge)
-            found_paths += self.paths_recursive(
-                from_node=edge.to,
-                to_node=to_node,
-                max_length=max_length,
-                edges=new_edges,
+        return [
+            edges + path
+            for path in self.iter_paths(
+                from_node.currency, to_node.currency, max_length - len(edges)
             )
-        return found_paths
+        ]
@@ -0,0 +1,348 @@
+"""
+Conversion path search over CompactGraph arrays.
+
+Top-K search works in log-rate space: a path score is the sum of log
+multipliers of its edges (plus a log hop penalty per edge), so the best path
+is the one with the largest sum.
+"""
+import heapq
+import logging
+import math
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from decider.compact import CompactGraph
+
+logger = logging.getLogger(__name__)
+
+NO_PATH = -math.inf
+
+
+class SearchStats:
+    """Per query search counters."""
+
+    def __init__(self):
+        # nodes visited by the search
+        self.explored = 0
+        # branches skipped because they return to already visited node
+        self.pruned_cycles = 0
+        # branches skipped because they can't reach target or can't enter top K
+        self.pruned_bound = 0
+
+    @property
+    def pruned(self) -> int:
+        return self.pruned_cycles + self.pruned_bound
+
+    def __repr__(self) -> str:
+        return (
+            f"SearchStats(explored={self.explored}, "
+            f"pruned_cycles={self.pruned_cycles}, pruned_bound={self.pruned_bound})"
+        )
+
+
+def remaining_bounds(
+    graph: CompactGraph, weights: np.ndarray, target: int, max_length: int
+) -> List[np.ndarray]:
+    """
+    Upper bound of the best remaining log-rate from each node to target.
+
+    ``bounds[k][node]`` is the best log-rate of any walk from node to target
+    with at most k hops. Walks are allowed to repeat nodes, so this is never
+    less than the score of the best simple path. ``-inf`` means target can't
+    be reached within k hops.
+    """
+    return [
+        bound[:, 0]
+        for bound in remaining_bounds_many(graph, weights, [target], max_length)
+    ]
+
+
+def remaining_bounds_many(
+    graph: CompactGraph, weights: np.ndarray, targets: List[int], max_length: int
+) -> List[np.ndarray]:
+    """
+    Same as remaining_bounds for many targets at once, ``bounds[k][node, i]``
+    is the bound of ``targets[i]``.
+    """
+    has_outs = np.flatnonzero(np.diff(graph.offsets))
+    starts = graph.offsets[has_outs]
+    columns = np.arange(len(targets))
+    bound = np.full((len(graph), len(targets)), NO_PATH)
+    bound[targets, columns] = 0
+    bounds = [bound]
+    for _ in range(max_length):
+        bound = np.full((len(graph), len(targets)), NO_PATH)
+        if len(starts):
+            # CSR is grouped by source, so reduceat gives best out-edge per node
+            candidates = weights[:, None] + bounds[-1][graph.targets]
+            bound[has_outs] = np.maximum.reduceat(candidates, starts, axis=0)
+        # path ends as soon as it reaches target
+        bound[targets, columns] = 0
+        bounds.append(bound)
+    return bounds
+
+
+def best_paths(
+    graph: CompactGraph,
+    source: int,
+    target: int,
+    max_length: int,
+    top_k: int = 10,
+    hop_penalty: float = 0,
+    simple: bool = False,
+    stats: Optional[SearchStats] = None,
+) -> List[List[int]]:
+    """
+    Find top K paths from ``source`` to ``target`` node ordered by score.
+
+    Depth first branch and bound. Children are explored best first (by their
+    upper bound) and a branch is dropped as soon as its upper bound can't beat
+    the K-th best path found so far.
+
+    :param hop_penalty: score reduction for each hop, like 0.02 for 2%
+    :param simple: skip paths which visit the same node twice
+    :param stats: counters to fill
+    :return: list of paths (CSR edge positions), best first
+    """
+    stats = stats if stats is not None else SearchStats()
+    if source == target:
+        return [[]]
+    if top_k <= 0:
+        return []
+
+    weights_array = graph.weights(hop_penalty)
+    bounds = [
+        bound.tolist()
+        for bound in remaining_bounds(graph, weights_array, target, max_length)
+    ]
+    if bounds[max_length][source] == NO_PATH:
+        return []
+    offsets = graph.offsets.tolist()
+    targets = graph.targets.tolist()
+    weights = weights_array.tolist()
+
+    # min-heap of (score, sequence, edges). found[0] is K-th best found so far
+    found = []
+    sequence = 0
+    edges: List[int] = []
+
+    def threshold() -> float:
+        return found[0][0] if len(found) >= top_k else NO_PATH
+
+    def visit(node: int, score: float, visited: int):
+        nonlocal sequence
+        stats.explored += 1
+        if node == target:
+            sequence += 1
+            item = (score, sequence, list(edges))
+            if len(found) < top_k:
+                heapq.heappush(found, item)
+            else:
+                heapq.heapreplace(found, item)
+            return
+        remaining = max_length - len(edges) - 1
+        if remaining < 0:
+            return
+        reachable = bounds[remaining]
+        lowest = threshold()
+        candidates = []
+        for position in range(offsets[node], offsets[node + 1]):
+            if simple and visited >> targets[position] & 1:
+                stats.pruned_cycles += 1
+                continue
+            upper = score + weights[position] + reachable[targets[position]]
+            if upper > lowest:
+                candidates.append((upper, position))
+            else:
+                stats.pruned_bound += 1
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for num, (upper, position) in enumerate(candidates):
+            if upper <= threshold():
+                # candidates are sorted, the rest are even worse
+                stats.pruned_bound += len(candidates) - num
+                break
+            edges.append(position)
+            visit(
+                targets[position],
+                score + weights[position],
+                visited | 1 << targets[position],
+            )
+            edges.pop()
+
+    visit(source, 0.0, 1 << source)
+    return [path for _, _, path in sorted(found, key=lambda item: (-item[0], item[1]))]
+
+
+def best_paths_from(
+    graph: CompactGraph,
+    source: int,
+    max_length: int,
+    top_k: int = 10,
+    hop_penalty: float = 0,
+    simple: bool = False,
+    targets: Optional[Iterable[int]] = None,
+    stats: Optional[SearchStats] = None,
+) -> Dict[int, List[List[int]]]:
+    """
+    Find top K paths from ``source`` to every reachable node in one pass.
+
+    The same as best_paths for each target. One depth first branch and bound
+    collects paths of all targets: upper bounds of all targets are computed
+    at once (see remaining_bounds_many) and a branch is dropped as soon as it
+    can't enter top K of any target it can still reach. A path to a target
+    ends as soon as it reaches it, so branches going on past a target are
+    bounded by the other targets only.
+
+    :param targets: nodes to find paths to. None - all nodes except source,
+        bounds take memory of nodes x nodes for each hop then.
+    :param stats: counters to fill
+    :return: paths (CSR edge positions) by reachable target, best first
+    """
+    stats = stats if stats is not None else SearchStats()
+    if targets is None:
+        targets = range(len(graph))
+    targets = [target for target in dict.fromkeys(targets) if target != source]
+    if top_k <= 0 or not targets:
+        return {}
+
+    weights = graph.weights(hop_penalty)
+    bounds = remaining_bounds_many(graph, weights, targets, max_length)
+    offsets = graph.offsets.tolist()
+    next_nodes = graph.targets.tolist()
+    # index of each target node in bounds columns, -1 for other nodes
+    target_index = np.full(len(graph), -1)
+    target_index[targets] = np.arange(len(targets))
+    target_index = target_index.tolist()
+
+    # min-heaps of (score, sequence, edges) of each target, like in best_paths
+    found: List[list] = [[] for _ in targets]
+    thresholds = np.full(len(targets), NO_PATH)
+    # targets not on the path yet, paths to the ones on it have ended
+    reachable = np.ones(len(targets), dtype=bool)
+    on_path = np.zeros(len(graph), dtype=bool)
+    sequence = 0
+    edges: List[int] = []
+
+    def visit(node: int, score: float, reached: int):
+        nonlocal sequence
+        stats.explored += 1
+        if reached >= 0:
+            sequence += 1
+            item = (score, sequence, list(edges))
+            heap = found[reached]
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif score > heap[0][0]:
+                # branches kept for other targets can reach it with worse scores
+                heapq.heapreplace(heap, item)
+            if len(heap) >= top_k:
+                thresholds[reached] = heap[0][0]
+        remaining = max_length - len(edges) - 1
+        if remaining < 0:
+            return
+        start, end = offsets[node], offsets[node + 1]
+        tos = graph.targets[start:end]
+        # best score each out-edge can get for each target
+        uppers = score + weights[start:end, None] + bounds[remaining][tos]
+        uppers[:, ~reachable] = NO_PATH
+        candidates = (uppers > thresholds).any(axis=1)
+        if simple:
+            cycles = on_path[tos]
+            stats.pruned_cycles += int(cycles.sum())
+            stats.pruned_bound += int((~cycles & ~candidates).sum())
+            candidates &= ~cycles
+        else:
+            stats.pruned_bound += int((~candidates).sum())
+        candidates = np.flatnonzero(candidates)
+        best_uppers = uppers[candidates].max(axis=1)
+        candidates = candidates[np.argsort(-best_uppers, kind="stable")]
+        for candidate in candidates.tolist():
+            if not (uppers[candidate] > thresholds).any():
+                # sorted by the best target, others can still be entered
+                stats.pruned_bound += 1
+                continue
+            position = start + candidate
+            to = next_nodes[position]
+            # a path reaches target once, later visits go on to other targets
+            entered = not on_path[to]
+            index = target_index[to] if entered else -1
+            on_path[to] = True
+            if index >= 0:
+                reachable[index] = False
+            edges.append(position)
+            visit(to, score + float(weights[position]), index)
+            edges.pop()
+            if entered:
+                on_path[to] = False
+                if index >= 0:
+                    reachable[index] = True
+
+    on_path[source] = True
+    visit(source, 0.0, -1)
+    return {
+        targets[index]: [
+            path for _, _, path in sorted(heap, key=lambda item: (-item[0], item[1]))
+        ]
+        for index, heap in enumerate(found)
+        if heap
+    }
+
+
+def iter_paths(
+    graph: CompactGraph,
+    source: int,
+    target: int,
+    max_length: int,
+    simple: bool = False,
+    stats: Optional[SearchStats] = None,
+) -> Iterator[List[int]]:
+    """
+    Yield all paths up to ``max_length`` hops (CSR edge positions) one by one.
+
+    Paths end as soon as they reach target. Order is depth first following
+    the order in which edges were added to the graph. Traversal keeps an
+    explicit stack of out-edge iterators and one shared prefix of edges, so
+    memory doesn't depend on the number of paths.
+
+    :param simple: skip paths which visit the same node twice
+    :param stats: counters to fill
+    """
+    stats = stats if stats is not None else SearchStats()
+    offsets = graph.offsets.tolist()
+    targets = graph.targets.tolist()
+    stats.explored += 1
+    if source == target:
+        yield []
+        return
+    if max_length < 1:
+        return
+    # counted locally, stats are updated when the search ends or is dropped
+    explored = pruned_cycles = 0
+    edges: List[int] = []
+    # iterators over out-edges of each node on the path, shared prefix
+    stack = [iter(range(offsets[source], offsets[source + 1]))]
+    visited = 1 << source
+    last_hop = max_length - 1
+    try:
+        while stack:
+            for position in stack[-1]:
+                to = targets[position]
+                if simple and visited >> to & 1:
+                    pruned_cycles += 1
+                    continue
+                explored += 1
+                if to == target:
+                    yield edges + [position]
+                elif len(edges) < last_hop:
+                    edges.append(position)
+                    visited |= 1 << to
+                    stack.append(iter(range(offsets[to], offsets[to + 1])))
+                    break
+            else:
+                stack.pop()
+                if edges:
+                    visited ^= 1 << targets[edges.pop()]
+    finally:
+        stats.explored += explored
+        stats.pruned_cycles += pruned_cycles
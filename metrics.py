@@ -0,0 +1,141 @@
+"""
+Per-stage timers and counters of answering queries.
+
+Stages of a query (upstream calls, graph build, search, ranking, results
+serialization) record their time and counters to the process wide
+``METRICS`` registry:
+
+    with METRICS.timer("search"):
+        ...
+    METRICS.inc("paths_explored", stats.explored)
+
+The registry is exported in Prometheus text format by the API ``/metrics``
+endpoint and printed by ``cli.py --timings``.
+"""
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+PREFIX = "easypeezy"
+
+# (name, sorted label items)
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _labels(items: Tuple[Tuple[str, str], ...]) -> str:
+    if not items:
+        return ""
+    escaped = (
+        (label, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in items
+    )
+    return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+
+class Metrics:
+    """
+    Counters, gauges and stage timers. Safe to use from threads.
+
+    Stage timers are Prometheus summaries without quantiles: total seconds
+    and number of runs of each stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        # stage -> [total seconds, runs]
+        self.stages: Dict[str, List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increase counter, like ``inc("upstream_requests", api="c2c_search")``."""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set gauge to the last observed value."""
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Record time of the block as a run of stage, failed runs too."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count_cached(self, response, api: str):
+        """
+        Count upstream request and whether requests_cache answered it.
+
+        Responses are not counted as hits or misses when requests_cache is
+        not installed.
+        """
+        self.inc("upstream_requests", api=api)
+        from_cache = getattr(response, "from_cache", None)
+        if from_cache is not None:
+            result = "hit" if from_cache else "miss"
+            self.inc("requests_cache_requests", api=api, result=result)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.stages.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            stages = {stage: list(totals) for stage, totals in self.stages.items()}
+        lines = []
+        if stages:
+            name = f"{PREFIX}_stage_seconds"
+            lines.append(f"# TYPE {name} summary")
+            for stage, (seconds, runs) in sorted(stages.items()):
+                labels = _labels((("stage", stage),))
+                lines.append(f"{name}_sum{labels} {seconds}")
+                lines.append(f"{name}_count{labels} {runs}")
+        for kind, values, suffix in (
+            ("counter", counters, "_total"),
+            ("gauge", gauges, ""),
+        ):
+            for name in sorted({name for name, _ in values}):
+                full_name = f"{PREFIX}_{name}{suffix}"
+                lines.append(f"# TYPE {full_name} {kind}")
+                for (key_name, items), value in sorted(values.items()):
+                    if key_name == name:
+                        lines.append(f"{full_name}{_labels(items)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Human readable stage timings and counters, like for cli --timings."""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+            values = sorted({**self.counters, **self.gauges}.items())
+        lines = [
+            f"{stage:24} {seconds * 1000:10.1f}ms  runs={runs}"
+            for stage, (seconds, runs) in stages
+        ]
+        lines += [
+            f"{name + _labels(items):48} {value:g}" for (name, items), value in values
+        ]
+        return "\n".join(lines)
+
+
+METRICS = Metrics()
@@ -0,0 +1,204 @@
+"""
+Opt-in profiling of single queries.
+
+A query is run under a deterministic (cProfile) or a sampling profiler and
+the report is kept as an artifact: pstats file for ``snakeviz`` / ``pstats``
+or collapsed stacks for flamegraphs (``flamegraph.pl``, speedscope).
+
+The profile of a query is set in ``CURRENT`` by the API middleware, functions
+run in worker threads are profiled with run_profiled(). Sampling rate and
+number of profiled queries per minute are capped, so profiling can be
+enabled under load.
+"""
+import collections
+import contextlib
+import cProfile
+import marshal
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Set
+
+MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.005
+# the shortest interval between samples, caps overhead of the sampler
+MIN_SAMPLE_INTERVAL = 0.001
+# profiled API queries per minute, more are served without profiling
+MAX_PROFILES_PER_MINUTE = 6
+# reports kept for download, older are dropped
+MAX_STORED_PROFILES = 20
+
+
+def _collapse(frame) -> str:
+    """Stack of frame, root first, like ``module:function;module:function``."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Collapsed stacks of threads sampled by a background thread."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, all_threads: bool = False):
+        """
+        :param interval: seconds between samples, at least MIN_SAMPLE_INTERVAL
+        :param all_threads: sample all threads, not only added ones
+        """
+        self.interval = max(interval, MIN_SAMPLE_INTERVAL)
+        self.all_threads = all_threads
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._threads: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, thread_id: int):
+        self._threads.add(thread_id)
+
+    def remove_thread(self, thread_id: int):
+        self._threads.discard(thread_id)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if self.all_threads or thread_id in self._threads:
+                    self.stacks[_collapse(frame)] += 1
+
+    def collapsed(self) -> str:
+        """Stacks in collapsed format, one ``stack count`` per line."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class QueryProfile:
+    """Profile of one query, parts of which can run in different threads."""
+
+    def __init__(
+        self,
+        mode: str = "cprofile",
+        interval: float = SAMPLE_INTERVAL,
+        all_threads: bool = False,
+    ):
+        """
+        :param mode: cprofile - deterministic, sample - sampling profiler
+        :param interval: seconds between samples of sampling profiler
+        :param all_threads: sample all threads of the process, like for CLI
+        :raises ValueError: unknown mode
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, use one of {MODES}")
+        self.mode = mode
+        self.id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._stats: Optional[pstats.Stats] = None
+        self._sampler = None
+        if mode == "sample":
+            self._sampler = StackSampler(interval, all_threads=all_threads)
+            self._sampler.start()
+
+    @contextlib.contextmanager
+    def running(self) -> Iterator[None]:
+        """Profile the block run in the current thread."""
+        if self._sampler is not None:
+            thread_id = threading.get_ident()
+            self._sampler.add_thread(thread_id)
+            try:
+                yield
+            finally:
+                self._sampler.remove_thread(thread_id)
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    @property
+    def filename(self) -> str:
+        extension = "prof" if self.mode == "cprofile" else "collapsed"
+        return f"query-{self.id}.{extension}"
+
+    def finish(self) -> bytes:
+        """
+        Stop profiling and return the report.
+
+        :return: marshalled pstats data (the same as ``Stats.dump_stats()``
+            writes) or collapsed stacks text
+        """
+        if self._sampler is not None:
+            self._sampler.stop()
+            return self._sampler.collapsed().encode()
+        with self._lock:
+            return marshal.dumps(self._stats.stats if self._stats else {})
+
+
+CURRENT: ContextVar[Optional[QueryProfile]] = ContextVar("profile", default=None)
+
+
+def run_profiled(profile: Optional[QueryProfile], func: Callable, *args, **kwargs):
+    """Call func under profile, if there is one."""
+    if profile is None:
+        return func(*args, **kwargs)
+    with profile.running():
+        return func(*args, **kwargs)
+
+
+class ProfileLimiter:
+    """Allows at most ``max_per_minute`` profiles in any sliding minute."""
+
+    def __init__(self, max_per_minute: int = MAX_PROFILES_PER_MINUTE):
+        self.max_per_minute = max_per_minute
+        self._started = collections.deque()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        while self._started and self._started[0] <= now - 60:
+            self._started.popleft()
+        if len(self._started) >= self.max_per_minute:
+            return False
+        self._started.append(now)
+        return True
+
+
+class ProfileStore:
+    """The latest reports by profile id."""
+
+    def __init__(self, max_size: int = MAX_STORED_PROFILES):
+        self.max_size = max_size
+        # id -> (filename, report)
+        self._reports: Dict[str, tuple] = collections.OrderedDict()
+
+    def add(self, profile: QueryProfile, report: bytes):
+        self._reports[profile.id] = (profile.filename, report)
+        while len(self._reports) > self.max_size:
+            self._reports.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[tuple]:
+        """(filename, report) of profile, None if it is unknown or dropped."""
+        return self._reports.get(profile_id)
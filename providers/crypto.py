@@ -2,14 +2,28 @@
 Cryptocurrencies providers.
 """
 
+import json
 import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
 
 from decider.core import Graph, Node, Edge
 
 logger = logging.getLogger(__name__)
 
+# price levels of order book side to load
+ORDER_BOOK_DEPTH = 100
+# tickers of more symbols are fetched all at once, request weight is the same
+TICKERS_QUERY_MAX_SYMBOLS = 100
+# best bid / ask updates of all symbols
+BINANCE_BOOK_TICKER_STREAM = "wss://stream.binance.com:9443/ws/!bookTicker"
+
 
 class BinanceEdge(Edge):
+    provider = "binance"
+
     def __init__(
         self, from_: Node, to: Node, ticker: dict, market: dict, is_direct: bool
     ):
@@ -32,6 +46,63 @@ class BinanceEdge(Edge):
         return str([self.from_, self.to, self.converted(), self.commission()])
 
 
+class BinanceOrderBookEdge(BinanceEdge):
+    """
+    Binance edge which rate depends on converted amount.
+
+    Converted amount walks price levels of the order book: base is sold to
+    bids, quote buys base from asks. Until order book is set rates are the
+    top of the same side of the book: best bid or best ask.
+    """
+
+    def __init__(
+        self, from_: Node, to: Node, ticker: dict, market: dict, is_direct: bool
+    ):
+        super().__init__(from_, to, ticker, market, is_direct)
+        # output per unit of input at each level
+        self._rates = None
+        # cumulative input and output amounts at the end of each level
+        self._input_ends = None
+        self._output_ends = None
+
+    @property
+    def has_depth(self) -> bool:
+        return self._rates is not None
+
+    def set_order_book(self, order_book: dict):
+        """
+        :param order_book: ccxt order book like {"bids": [[price, amount], ...], "asks": ...}
+        """
+        side = order_book["bids"] if self.is_direct else order_book["asks"]
+        levels = np.array(side, dtype=np.float64).reshape(-1, 2)[:, :2]
+        if not len(levels):
+            return
+        prices, amounts = levels[:, 0], levels[:, 1]
+        if self.is_direct:
+            inputs, self._rates = amounts, prices
+        else:
+            inputs, self._rates = amounts * prices, 1 / prices
+        self._input_ends = np.cumsum(inputs)
+        self._output_ends = np.cumsum(inputs * self._rates)
+
+    def load_depth(self, fetch_order_book: Callable[..., dict]):
+        """Set order book fetched by function like ccxt ``binance.fetch_order_book``."""
+        self.set_order_book(fetch_order_book(self.ticker["symbol"], ORDER_BOOK_DEPTH))
+
+    def converted(self, amount: float = 1) -> float:
+        if self._rates is None:
+            price = self.ticker["bid"] if self.is_direct else 1 / self.ticker["ask"]
+            return amount * price
+        # level where the amount is filled, the rest of too large amount
+        # is filled at the last loaded level price
+        level = min(
+            int(np.searchsorted(self._input_ends, amount)), len(self._rates) - 1
+        )
+        filled_input = self._input_ends[level - 1] if level else 0
+        filled_output = self._output_ends[level - 1] if level else 0
+        return float(filled_output + (amount - filled_input) * self._rates[level])
+
+
 def add_quotes_to_graph(tickers, markets, graph: Graph):
     market_by_symbold = {v["symbol"]: v for v in markets}
     for ticker in tickers.values():
@@ -49,12 +120,108 @@ def add_quotes_to_graph(tickers, markets, graph: Graph):
 
         market = market_by_symbold[symbol]
 
-        edge_direct = BinanceEdge(
+        edge_direct = BinanceOrderBookEdge(
             from_=base, to=quote, ticker=ticker, market=market, is_direct=True
         )
         graph.add(edge_direct)
 
-        edge_reverse = BinanceEdge(
+        edge_reverse = BinanceOrderBookEdge(
             from_=quote, to=base, ticker=ticker, market=market, is_direct=False
         )
         graph.add(edge_reverse)
+
+
+def _distances(adjacent: Dict[str, set], starts: Iterable[str], hops: int):
+    """Number of conversions from the nearest of starts, up to hops."""
+    distances = {currency: 0 for currency in starts}
+    frontier = list(distances)
+    for hop in range(1, hops + 1):
+        reached = []
+        for currency in frontier:
+            for neighbour in adjacent[currency]:
+                if neighbour not in distances:
+                    distances[neighbour] = hop
+                    reached.append(neighbour)
+        frontier = reached
+    return distances
+
+
+def markets_within_hops(
+    markets: List[dict], sources: Iterable[str], targets: Iterable[str], hops: int
+) -> List[dict]:
+    """
+    Markets which can be on a conversion path from any of sources to any of
+    targets in at most ``hops`` conversions.
+    """
+    adjacent = defaultdict(set)
+    for market in markets:
+        adjacent[market["base"]].add(market["quote"])
+        adjacent[market["quote"]].add(market["base"])
+    from_sources = _distances(adjacent, sources, hops)
+    to_targets = _distances(adjacent, targets, hops)
+
+    def path_length(from_, to):
+        return from_sources.get(from_, hops) + 1 + to_targets.get(to, hops)
+
+    return [
+        market
+        for market in markets
+        if min(
+            path_length(market["base"], market["quote"]),
+            path_length(market["quote"], market["base"]),
+        )
+        <= hops
+    ]
+
+
+def fetch_market_tickers(binance, markets: List[dict]) -> dict:
+    """
+    Tickers of the markets only, by symbol.
+
+    :param binance: ccxt binance client which markets are loaded
+    """
+    if not markets:
+        return {}
+    if len(markets) > TICKERS_QUERY_MAX_SYMBOLS:
+        return binance.fetch_tickers([market["symbol"] for market in markets])
+    ids = [market["id"] for market in markets]
+    return binance.fetch_tickers(
+        [market["symbol"] for market in markets],
+        # binance accepts a json list without spaces
+        params={"symbols": json.dumps(ids, separators=(",", ":"))},
+    )
+
+
+def markets_by_id(graph: Graph) -> Dict[str, dict]:
+    """Binance markets of graph edges by exchange id, like 'ETHBTC'."""
+    return {
+        edge.market["id"]: edge.market
+        for edge in graph.edges()
+        if isinstance(edge, BinanceEdge)
+    }
+
+
+def book_ticker_edges(
+    graph: Graph, markets: Dict[str, dict], message: dict
+) -> List[BinanceEdge]:
+    """
+    Edges of the symbol with prices of book ticker stream message.
+
+    :param markets: markets_by_id() of the graph
+    :param message: like {"u": 400900217, "s": "BNBUSDT", "b": "25.35", "B": "31.21", "a": "25.36", "A": "40.66"}
+    :return: new edges for graph.update_edge(), empty for unknown symbol
+    """
+    market = markets.get(message["s"])
+    bid, ask = float(message["b"]), float(message["a"])
+    if market is None or not bid or not ask:
+        return []
+    base, quote = market["symbol"].split("/")
+    edges = []
+    for key in ((base, quote, BinanceEdge.provider), (quote, base, BinanceEdge.provider)):
+        edge = graph.get_edge(key)
+        if edge is not None:
+            ticker = dict(edge.ticker, bid=bid, ask=ask)
+            edges.append(
+                type(edge)(edge.from_, edge.to, ticker, edge.market, edge.is_direct)
+            )
+    return edges
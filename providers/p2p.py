@@ -1,19 +1,56 @@
 """
 Customer to Customer exchange providers.
 """
+import asyncio
+import bisect
+import copy
+import json
 import logging
 import statistics
-from typing import List, Dict, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-import requests
+import numpy as np
 
 from decider import core
 from decider.core import Edge, Node
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    # http clients are imported by functions using them, the API doesn't
+    # need requests and the CLI doesn't need httpx
+    import httpx
+    import requests
 
 logger = logging.getLogger(__name__)
 
+BINANCE_C2C_URL = "https://c2c.binance.com/bapi/c2c/v2/friendly/c2c"
+C2C_CONFIG_EXPIRE = timedelta(days=3)
+C2C_SEARCH_EXPIRE = timedelta(minutes=30)
+# requests to C2C API in flight at once by one loader / client
+C2C_MAX_CONCURRENT_REQUESTS = 10
+# page size and limit of pages loaded to collect liquidity for large amounts
+C2C_PAGE_ROWS = 20
+C2C_MAX_PAGES = 10
+# offer fields used by BinnanceP2PEdge, the rest of search response is dropped
+C2C_OFFER_FIELDS = (
+    "tradeType",
+    "asset",
+    "fiatUnit",
+    "price",
+    "minSingleTransAmount",
+    "maxSingleTransAmount",
+    "surplusAmount",
+    "tradableQuantity",
+)
+
 
 class BinnanceP2PEdge(Edge):
+    provider = "binance_p2p"
+
     def __init__(
         self, offers: list, median_price_of_first_n=4
     ):
@@ -53,16 +90,84 @@ class BinnanceP2PEdge(Edge):
         self.fiat = fiat_currency
         self.asset = asset_currency
 
+        # reference price, used for amounts too small for any offer
         self.price = price
         self.offers = offers
+        self._set_offer_arrays(offers)
 
         super().__init__(base, quote)
 
+    def _set_offer_arrays(self, offers: list):
+        """Offers as arrays in input currency of the edge, best rate first."""
+        prices = np.array([float(offer["adv"]["price"]) for offer in offers])
+        min_fiat = np.array(
+            [float(offer["adv"]["minSingleTransAmount"]) for offer in offers]
+        )
+        max_fiat = np.array(
+            [float(offer["adv"]["maxSingleTransAmount"]) for offer in offers]
+        )
+        available = np.array(
+            [
+                float(offer["adv"].get("tradableQuantity") or offer["adv"]["surplusAmount"])
+                for offer in offers
+            ]
+        )
+        if self.trade_type == "BUY":
+            # asset to fiat
+            rates = prices
+            min_inputs = min_fiat / prices
+            max_inputs = np.minimum(max_fiat / prices, available)
+        else:
+            # fiat to asset
+            rates = 1 / prices
+            min_inputs = min_fiat
+            max_inputs = np.minimum(max_fiat, available * prices)
+        order = np.argsort(-rates, kind="stable")
+        rates, min_inputs, max_inputs = rates[order], min_inputs[order], max_inputs[order]
+        self._rates = rates
+        # the best offer is the same between any two neighbouring limits, so
+        # rate of every interval between limits is found once: rate of the
+        # best offer covering interval start, NaN if there is no such offer
+        self._bounds = np.unique(np.concatenate([min_inputs, max_inputs]))
+        covers = (min_inputs <= self._bounds[:, None]) & (
+            self._bounds[:, None] < max_inputs
+        )
+        self._bound_rates = np.where(
+            covers.any(axis=1), rates[covers.argmax(axis=1)], np.nan
+        )
+        # offers filled one after another when amount is too large for any of them
+        self._input_ends = np.cumsum(max_inputs)
+        self._output_ends = np.cumsum(max_inputs * rates)
+
     def commission(self, amount: float = 1) -> float:
         return 0
 
+    def at_amount(self, amount: float) -> "BinnanceP2PEdge":
+        """The same offers rated by searches at ``amount`` of input currency."""
+        edge = copy.copy(self)
+        edge.rate_amount = amount
+        return edge
+
     def converted(self, amount: float = 1) -> float:
-        return amount * self.price
+        """
+        Amount received by the best offer which can take the whole amount.
+
+        Amount smaller than limits of all offers is converted by reference
+        price, too large amount is split between offers best first. Amount
+        larger than all loaded offers can take can't be filled, it gives 0.
+        """
+        interval = bisect.bisect_right(self._bounds, amount) - 1
+        if interval < 0:
+            return amount * self.price
+        rate = self._bound_rates[interval]
+        if rate == rate:
+            return float(amount * rate)
+        if amount > self._input_ends[-1]:
+            return 0.0
+        level = bisect.bisect_left(self._input_ends, amount)
+        filled_input = self._input_ends[level - 1] if level else 0
+        filled_output = self._output_ends[level - 1] if level else 0
+        return float(filled_output + (amount - filled_input) * self._rates[level])
 
     def url(self) -> Optional[str]:
         if self.trade_type == 'SELL':
@@ -75,6 +180,56 @@ class BinnanceP2PEdge(Edge):
         return str([self.from_, self.to, self.converted(), self.commission()])
 
 
+def _api_name(path: str) -> str:
+    """Name of C2C API in metrics, like c2c_search for adv/search."""
+    return f"c2c_{path.rsplit('/', 1)[-1]}"
+
+
+class AsyncC2CClient:
+    """
+    Async client for Binance C2C API.
+
+    Responses are cached in memory (the same expiration as requests cache of
+    sync functions), concurrent identical requests share one upstream call and
+    number of requests in flight is limited.
+    """
+
+    def __init__(
+        self,
+        http: "httpx.AsyncClient",
+        max_concurrent_requests: int = C2C_MAX_CONCURRENT_REQUESTS,
+    ):
+        self.http = http
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # (path, payload) -> (expires at, response future)
+        self._cache: Dict[tuple, tuple] = {}
+
+    async def post(self, path: str, payload: dict, expire: timedelta) -> dict:
+        key = (path, json.dumps(payload, sort_keys=True))
+        api = _api_name(path)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            METRICS.inc("c2c_client_cache_requests", api=api, result="hit")
+            return await asyncio.shield(cached[1])
+        METRICS.inc("c2c_client_cache_requests", api=api, result="miss")
+        future = asyncio.ensure_future(self._post(path, payload))
+        self._cache[key] = (time.monotonic() + expire.total_seconds(), future)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            self._cache.pop(key, None)
+            raise
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        api = _api_name(path)
+        async with self._semaphore:
+            METRICS.inc("upstream_requests", api=api)
+            with METRICS.timer(api):
+                r = await self.http.post(f"{BINANCE_C2C_URL}/{path}", json=payload)
+        r.raise_for_status()
+        return r.json()
+
+
 def binance_c2c_search(
     fiat: str,
     asset: str,
@@ -84,6 +239,7 @@ def binance_c2c_search(
     publisher_type=None,
     rows=10,
     page=1,
+    session: Optional["requests.Session"] = None,
 ):
     """
     Search for C2C offers.
@@ -96,12 +252,49 @@ def binance_c2c_search(
     :param publisher_type: None for any, 'merchant' for only from merchants.
     :param rows: number or items to return
     :param page: page number. Starts with 1.
+    :param session: session to send request with, like c2c_session()
     :return:
     """
+    import requests
+
+    request_payload = _search_payload(
+        fiat, asset, trade_type, pay_types, countries, publisher_type, rows, page
+    )
+    with METRICS.timer("c2c_search"):
+        r = (session or requests).post(
+            f"{BINANCE_C2C_URL}/adv/search", json=request_payload
+        )
+    METRICS.count_cached(r, api="c2c_search")
+    r.raise_for_status()
+    response_payload = r.json()
+    return response_payload
+
+
+async def binance_c2c_search_async(
+    client: AsyncC2CClient,
+    fiat: str,
+    asset: str,
+    trade_type: str,
+    pay_types=(),
+    countries=(),
+    publisher_type=None,
+    rows=10,
+    page=1,
+):
+    """Same as binance_c2c_search using async client."""
+    request_payload = _search_payload(
+        fiat, asset, trade_type, pay_types, countries, publisher_type, rows, page
+    )
+    return await client.post("adv/search", request_payload, expire=C2C_SEARCH_EXPIRE)
+
+
+def _search_payload(
+    fiat, asset, trade_type, pay_types, countries, publisher_type, rows, page
+) -> dict:
     assert fiat
     assert asset
     assert trade_type in ("BUY", "SELL")
-    request_payload = {
+    return {
         "page": page,
         "rows": rows,
         "payTypes": pay_types,
@@ -111,50 +304,255 @@ def binance_c2c_search(
         "fiat": fiat,
         "tradeType": trade_type,
     }
-    r = requests.post(
-        "https://c2c.binance.com/bapi/c2c/v2/friendly/c2c/adv/search",
-        json=request_payload,
-    )
-    r.raise_for_status()
-    response_payload = r.json()
-    return response_payload
 
 
-def binance_c2c_config(fiat: str):
+def binance_c2c_config(fiat: str, session: Optional["requests.Session"] = None):
+    import requests
+
     assert fiat
     request_payload = {
         "fiat": fiat,
     }
-    r = requests.post(
-        "https://c2c.binance.com/bapi/c2c/v2/friendly/c2c/portal/config",
-        json=request_payload,
-    )
+    with METRICS.timer("c2c_config"):
+        r = (session or requests).post(
+            f"{BINANCE_C2C_URL}/portal/config", json=request_payload
+        )
+    METRICS.count_cached(r, api="c2c_config")
     r.raise_for_status()
     response_payload = r.json()
 
     return response_payload
 
 
-def load_binance_c2c_offers(fiat: str, trade_type: str, max_offers=10):
-    logger.info(f"Loading config for {fiat}")
-    c2c_config = binance_c2c_config(
-        fiat=fiat,
-    )
+async def binance_c2c_config_async(client: AsyncC2CClient, fiat: str):
+    """Same as binance_c2c_config using async client."""
+    assert fiat
+    return await client.post("portal/config", {"fiat": fiat}, expire=C2C_CONFIG_EXPIRE)
+
+
+def _trade_side_assets(c2c_config: dict, trade_type: str) -> List[str]:
     areas = {v["area"]: v for v in c2c_config["data"]["areas"]}
     trade_sides = {v["side"]: v for v in areas["P2P"]["tradeSides"]}
+    return [asset["asset"] for asset in trade_sides[trade_type]["assets"]]
+
+
+def binance_c2c_assets(
+    fiat: str, trade_type: str, session: Optional["requests.Session"] = None
+) -> List[str]:
+    """Assets which P2P offers of fiat and trade type are for."""
+    return _trade_side_assets(binance_c2c_config(fiat, session=session), trade_type)
+
+
+def slim_offer(offer: dict) -> dict:
+    """Offer with only fields needed by BinnanceP2PEdge."""
+    adv = offer["adv"]
+    return {"adv": {field: adv.get(field) for field in C2C_OFFER_FIELDS}}
+
+
+def offer_liquidity(offer: dict) -> float:
+    """Fiat amount offer can take in one trade."""
+    adv = offer["adv"]
+    available = float(adv.get("tradableQuantity") or adv["surplusAmount"])
+    return min(float(adv["maxSingleTransAmount"]), available * float(adv["price"]))
+
+
+def _is_last_page(
+    response: dict, rows: int, page: int, liquidity: float, min_liquidity
+) -> bool:
+    return (
+        min_liquidity is None
+        or liquidity >= min_liquidity
+        or len(response["data"]) < rows
+        or page * rows >= response.get("total", 0)
+    )
+
+
+def iter_binance_c2c_offers(
+    fiat: str,
+    asset: str,
+    trade_type: str,
+    max_offers=10,
+    min_liquidity: Optional[float] = None,
+    session: Optional["requests.Session"] = None,
+) -> Iterator[dict]:
+    """
+    Yield slim offers page by page.
+
+    Without ``min_liquidity`` only the first ``max_offers`` offers are loaded.
+    Otherwise pages are loaded until offers can take ``min_liquidity`` of fiat
+    in total, offers run out or C2C_MAX_PAGES are loaded.
+    """
+    rows = max_offers if min_liquidity is None else C2C_PAGE_ROWS
+    liquidity = 0
+    for page in range(1, C2C_MAX_PAGES + 1):
+        response = binance_c2c_search(
+            fiat=fiat,
+            asset=asset,
+            trade_type=trade_type,
+            rows=rows,
+            page=page,
+            session=session,
+        )
+        for offer in response["data"]:
+            liquidity += offer_liquidity(offer)
+            yield slim_offer(offer)
+        if _is_last_page(response, rows, page, liquidity, min_liquidity):
+            break
+
+
+async def iter_binance_c2c_offers_async(
+    client: AsyncC2CClient,
+    fiat: str,
+    asset: str,
+    trade_type: str,
+    max_offers=10,
+    min_liquidity: Optional[float] = None,
+) -> AsyncIterator[dict]:
+    """Same as iter_binance_c2c_offers using async client."""
+    rows = max_offers if min_liquidity is None else C2C_PAGE_ROWS
+    liquidity = 0
+    for page in range(1, C2C_MAX_PAGES + 1):
+        response = await binance_c2c_search_async(
+            client, fiat=fiat, asset=asset, trade_type=trade_type, rows=rows, page=page
+        )
+        for offer in response["data"]:
+            liquidity += offer_liquidity(offer)
+            yield slim_offer(offer)
+        if _is_last_page(response, rows, page, liquidity, min_liquidity):
+            break
+
 
-    asset_offers = {}
-    for asset in trade_sides[trade_type]["assets"]:
-        asset_name = asset["asset"]
-        logger.info(f"Loading offers for {asset_name}")
-        offers = binance_c2c_search(
-            fiat=fiat, asset=asset_name, trade_type=trade_type, rows=max_offers
-        )["data"]
+def _collect_offers(*args, **kwargs) -> list:
+    return list(iter_binance_c2c_offers(*args, **kwargs))
+
+
+async def _collect_offers_async(*args, **kwargs) -> list:
+    return [offer async for offer in iter_binance_c2c_offers_async(*args, **kwargs)]
+
+
+async def load_binance_c2c_offers_async(
+    client: AsyncC2CClient,
+    fiat: str,
+    trade_type: str,
+    max_offers=10,
+    min_liquidity: Optional[float] = None,
+):
+    """Same as load_binance_c2c_offers, all assets are loaded concurrently."""
+    logger.info(f"Loading config for {fiat}")
+    c2c_config = await binance_c2c_config_async(client, fiat=fiat)
+    asset_names = _trade_side_assets(c2c_config, trade_type)
+    asset_offers = await asyncio.gather(
+        *[
+            _collect_offers_async(
+                client,
+                fiat=fiat,
+                asset=asset_name,
+                trade_type=trade_type,
+                max_offers=max_offers,
+                min_liquidity=min_liquidity,
+            )
+            for asset_name in asset_names
+        ]
+    )
+    for asset_name, offers in zip(asset_names, asset_offers):
         logger.info(
             f"Loaded {len(offers)} offers for P2P {trade_type} {fiat} to {asset_name}"
         )
-        asset_offers[asset_name] = offers
-    return asset_offers
+    return dict(zip(asset_names, asset_offers))
+
+
+def c2c_session(pool_size: int = C2C_MAX_CONCURRENT_REQUESTS) -> "requests.Session":
+    """Session which keeps alive connections for all concurrent requests."""
+    import requests.adapters
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def load_binance_c2c_offers_bulk(
+    sides: List[Tuple[str, str]],
+    max_offers=10,
+    max_workers=C2C_MAX_CONCURRENT_REQUESTS,
+    session: Optional["requests.Session"] = None,
+    min_liquidity: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, list]]:
+    """
+    Load offers of several fiats / trade types at once.
+
+    Configs of all fiats and then offers of all assets are requested
+    concurrently by a pool of ``max_workers`` threads sharing one session.
+    Pages of each asset are loaded one by one, see iter_binance_c2c_offers.
+
+    :param sides: list of (fiat, trade_type)
+    :param session: session to use. By default new c2c_session() is created.
+    :param min_liquidity: fiat amount offers of each asset should take, by fiat
+    :return: offers by asset for each side
+    """
+    session_context = nullcontext(session) if session else c2c_session(max_workers)
+    with session_context as session, ThreadPoolExecutor(max_workers) as executor:
+        fiats = list(dict.fromkeys(fiat for fiat, _ in sides))
+        for fiat in fiats:
+            logger.info(f"Loading config for {fiat}")
+        configs = dict(
+            zip(
+                fiats,
+                executor.map(
+                    lambda fiat: binance_c2c_config(fiat, session=session), fiats
+                ),
+            )
+        )
+        searches = [
+            (fiat, trade_type, asset_name)
+            for fiat, trade_type in sides
+            for asset_name in _trade_side_assets(configs[fiat], trade_type)
+        ]
+        min_liquidity = min_liquidity or {}
+        futures = [
+            executor.submit(
+                _collect_offers,
+                fiat=fiat,
+                asset=asset_name,
+                trade_type=trade_type,
+                max_offers=max_offers,
+                min_liquidity=min_liquidity.get(fiat),
+                session=session,
+            )
+            for fiat, trade_type, asset_name in searches
+        ]
+        side_offers = {side: {} for side in sides}
+        for (fiat, trade_type, asset_name), future in zip(searches, futures):
+            offers = future.result()
+            logger.info(
+                f"Loaded {len(offers)} offers for P2P {trade_type} {fiat} to {asset_name}"
+            )
+            side_offers[(fiat, trade_type)][asset_name] = offers
+    return [side_offers[side] for side in sides]
+
+
+def load_binance_c2c_offers(
+    fiat: str,
+    trade_type: str,
+    max_offers=10,
+    max_workers=C2C_MAX_CONCURRENT_REQUESTS,
+    session: Optional["requests.Session"] = None,
+    min_liquidity: Optional[float] = None,
+):
+    """
+    Load offers for all P2P assets of fiat. Assets are loaded concurrently.
+
+    :param min_liquidity: fiat amount offers of each asset should take in
+        total, more pages are loaded for large amounts
+    """
+    return load_binance_c2c_offers_bulk(
+        [(fiat, trade_type)],
+        max_offers=max_offers,
+        max_workers=max_workers,
+        session=session,
+        min_liquidity={fiat: min_liquidity} if min_liquidity else None,
+    )[0]
 
 
 def add_c2c_offers_to_graph(
@@ -163,13 +561,18 @@ def add_c2c_offers_to_graph(
     """
     Register C2C offers in graph.
 
+    Offers of the same trade_type, fiat and asset loaded before are replaced,
+    so offers can be loaded to the same graph several times.
+
     :param offers: list of offers. Should be same trade_type, fiat and asset currency
     :param graph:
-    :param median_price_of_first_n: median value of first N items will be taken as price
     :return:
     """
     if not offers:
         return
 
     edge = BinnanceP2PEdge(offers=offers)
-    graph.add(edge)
+    if graph.get_edge(edge.key()) is None:
+        graph.add(edge)
+    else:
+        graph.update_edge(edge)
@@ -0,0 +1,95 @@
+"""
+In-memory cache of computed search results for long running services.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Hashable
+
+from providers.p2p import C2C_SEARCH_EXPIRE
+
+# results depend on P2P offers, don't keep them longer than offers are cached
+RESULT_CACHE_EXPIRE = C2C_SEARCH_EXPIRE
+RESULT_CACHE_SIZE = 1024
+
+
+class ResultCache:
+    """
+    TTL + LRU cache of async computed values.
+
+    Concurrent requests of the same key share one computation. Failed
+    computations are not cached. Must be used from one event loop.
+    """
+
+    def __init__(
+        self, max_size: int = RESULT_CACHE_SIZE, expire: timedelta = RESULT_CACHE_EXPIRE
+    ):
+        self.max_size = max_size
+        self.expire = expire
+        # key -> (expires at, value future), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value of key, ``compute()`` is awaited on miss."""
+        cached = self._entries.get(key)
+        if cached:
+            if cached[0] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return await asyncio.shield(cached[1])
+            self.expirations += 1
+            del self._entries[key]
+        self.misses += 1
+        future = asyncio.ensure_future(compute())
+        self._entries[key] = (time.monotonic() + self.expire.total_seconds(), future)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+            raise
+
+    def invalidate_values(self, predicate: Callable[[Any], bool]) -> int:
+        """
+        Drop entries which computed values match predicate, like results
+        using changed data. Entries still being computed are dropped too, as
+        they can use data from before the change.
+        """
+        keys = [
+            key
+            for key, (_, future) in self._entries.items()
+            if not future.done()
+            or future.cancelled()
+            or future.exception() is not None
+            or predicate(future.result())
+        ]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
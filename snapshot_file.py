@@ -0,0 +1,276 @@
+"""
+Binary file of a built conversion graph.
+
+A fresh process loads the graph without network requests or parsing
+exchange responses. The file is a small JSON header followed by numpy
+arrays aligned to 64 bytes, which are memory-mapped on load:
+
+    magic (8 bytes) | header length (uint64) | JSON header | arrays...
+
+Header keeps interned currencies, markets and other string data. Arrays
+keep edges in insertion order: ends, multipliers and prices by edge type.
+Only data used for rates and results is kept, like bid / ask of tickers
+and offer limits of P2P offers.
+"""
+import json
+import math
+import os
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from decider.compact import CompactGraph
+from decider.core import EdgeRaw, Graph, Node
+from providers.crypto import BinanceEdge, BinanceOrderBookEdge
+from providers.p2p import BinnanceP2PEdge
+
+MAGIC = b"EPZGRAPH"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+EDGE_TYPES = {
+    edge_type.__name__: edge_type
+    for edge_type in (EdgeRaw, BinanceEdge, BinanceOrderBookEdge, BinnanceP2PEdge)
+}
+
+# offers fields kept as float arrays, None is saved as NaN. Fields are
+# loaded as strings, like in responses of the C2C API.
+OFFER_ARRAYS = {
+    "offer_prices": "price",
+    "offer_min_amounts": "minSingleTransAmount",
+    "offer_max_amounts": "maxSingleTransAmount",
+    "offer_surplus_amounts": "surplusAmount",
+    "offer_tradable_quantities": "tradableQuantity",
+}
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _data_start(header_size: int) -> int:
+    return _aligned(len(MAGIC) + 8 + header_size)
+
+
+def write_arrays(path: str, header: dict, arrays: Dict[str, np.ndarray]):
+    """
+    Write header and arrays, descriptions of arrays are added to the header.
+
+    Offsets of arrays are relative to the first array, which starts at the
+    first aligned position after the header. File is replaced atomically,
+    readers see either the old or the new file.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    descriptions = {}
+    offset = 0
+    for name, array in arrays.items():
+        descriptions[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+    encoded = json.dumps(dict(header, arrays=descriptions)).encode()
+    data_start = _data_start(len(encoded))
+    written_path = f"{path}.{os.getpid()}.tmp"
+    with open(written_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(data_start + descriptions[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(written_path, path)
+
+
+def _read_header(f) -> Tuple[dict, int]:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a graph snapshot file")
+    size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+    return json.loads(f.read(size)), _data_start(size)
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        return _read_header(f)[0]
+
+
+def read_arrays(file: Union[str, BinaryIO]) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Header and read only memory-mapped arrays.
+
+    :param file: path or file opened in binary mode. Header and arrays of an
+        open file are of the same file, even if the path is replaced meanwhile.
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return read_arrays(f)
+    file.seek(0)
+    header, data_start = _read_header(file)
+    data = np.memmap(file, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, description in header["arrays"].items():
+        dtype = np.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        start = data_start + description["offset"]
+        size = dtype.itemsize * math.prod(shape)
+        arrays[name] = data[start : start + size].view(dtype).reshape(shape)
+    return header, arrays
+
+
+def save_graph(path: str, graph: Graph, metadata: Optional[dict] = None):
+    """
+    Save graph to a snapshot file.
+
+    :param metadata: json serializable data to keep with the graph, like
+        time it was built at
+    :raises ValueError: graph has edges of unknown type
+    """
+    write_arrays(path, *graph_arrays(graph, metadata))
+
+
+def graph_arrays(
+    graph: Graph, metadata: Optional[dict] = None
+) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Header and arrays of graph file, more arrays can be added to them."""
+    compact = graph.compact()
+    sources, targets, multipliers = compact.insertion_arrays()
+    edges = graph.edges()
+    edge_types = list(EDGE_TYPES)
+    types = np.zeros(len(edges), dtype=np.uint8)
+    # index of edge data in markets, offer groups or raw prices
+    refs = np.zeros(len(edges), dtype=np.int32)
+    directs = np.zeros(len(edges), dtype=bool)
+    bids = np.full(len(edges), np.nan)
+    asks = np.full(len(edges), np.nan)
+    markets: Dict[str, int] = {}
+    market_rows = []
+    offer_groups = []
+    offers = []
+    raw_prices = []
+    for num, edge in enumerate(edges):
+        edge_type = type(edge).__name__
+        if EDGE_TYPES.get(edge_type) is not type(edge):
+            raise ValueError(f"Can't save edge of type {edge_type}")
+        types[num] = edge_types.index(edge_type)
+        if isinstance(edge, BinanceEdge):
+            market = edge.market
+            if market["id"] not in markets:
+                markets[market["id"]] = len(market_rows)
+                market_rows.append(
+                    {
+                        field: market[field]
+                        for field in ("id", "symbol", "base", "quote", "taker")
+                    }
+                )
+            refs[num] = markets[market["id"]]
+            directs[num] = edge.is_direct
+            bids[num], asks[num] = edge.ticker["bid"], edge.ticker["ask"]
+        elif isinstance(edge, BinnanceP2PEdge):
+            refs[num] = len(offer_groups)
+            offer_groups.append(
+                {
+                    "trade_type": edge.trade_type,
+                    "fiat": edge.fiat,
+                    "asset": edge.asset,
+                    "start": len(offers),
+                    "end": len(offers) + len(edge.offers),
+                }
+            )
+            offers.extend(offer["adv"] for offer in edge.offers)
+        else:
+            refs[num] = len(raw_prices)
+            raw_prices.append([edge.price, edge.fee])
+    arrays = {
+        "edge_types": types,
+        "sources": sources.astype(np.int32),
+        "targets": targets.astype(np.int32),
+        "multipliers": multipliers,
+        "refs": refs,
+        "directs": directs,
+        "bids": bids,
+        "asks": asks,
+    }
+    for name, field in OFFER_ARRAYS.items():
+        arrays[name] = np.array(
+            [
+                np.nan if offer.get(field) is None else float(offer[field])
+                for offer in offers
+            ],
+            dtype=np.float64,
+        )
+    header = {
+        "format": FORMAT_VERSION,
+        "metadata": metadata or {},
+        "currencies": compact.currencies,
+        "edge_types": edge_types,
+        "markets": market_rows,
+        "offer_groups": offer_groups,
+        "raw_prices": raw_prices,
+    }
+    return header, arrays
+
+
+def _load_offers(group: dict, offer_arrays: Dict[str, list]) -> list:
+    return [
+        {
+            "adv": {
+                "tradeType": group["trade_type"],
+                "fiatUnit": group["fiat"],
+                "asset": group["asset"],
+                **{
+                    field: None if math.isnan(values[num]) else str(values[num])
+                    for field, values in offer_arrays.items()
+                },
+            }
+        }
+        for num in range(group["start"], group["end"])
+    ]
+
+
+def load_graph(path: str) -> Graph:
+    """
+    Graph saved by save_graph().
+
+    Compact form of the graph is made of the file arrays, searches don't
+    compute edge rates again.
+    """
+    return graph_from_arrays(*read_arrays(path))
+
+
+def graph_from_arrays(header: dict, arrays: Dict[str, np.ndarray]) -> Graph:
+    if header["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {header['format']}")
+    currencies = header["currencies"]
+    nodes = [Node(currency=currency) for currency in currencies]
+    edge_types = [EDGE_TYPES[name] for name in header["edge_types"]]
+    markets = header["markets"]
+    offer_arrays = {
+        field: arrays[name].tolist() for name, field in OFFER_ARRAYS.items()
+    }
+    edges = []
+    for type_num, source, target, ref, is_direct, bid, ask in zip(
+        arrays["edge_types"].tolist(),
+        arrays["sources"].tolist(),
+        arrays["targets"].tolist(),
+        arrays["refs"].tolist(),
+        arrays["directs"].tolist(),
+        arrays["bids"].tolist(),
+        arrays["asks"].tolist(),
+    ):
+        edge_type = edge_types[type_num]
+        if issubclass(edge_type, BinanceEdge):
+            market = markets[ref]
+            ticker = {"symbol": market["symbol"], "bid": bid, "ask": ask}
+            edge = edge_type(nodes[source], nodes[target], ticker, market, is_direct)
+        elif edge_type is BinnanceP2PEdge:
+            edge = edge_type(_load_offers(header["offer_groups"][ref], offer_arrays))
+        else:
+            price, fee = header["raw_prices"][ref]
+            edge = edge_type(nodes[source], nodes[target], price, fee)
+        edges.append(edge)
+    compact = CompactGraph.from_arrays(
+        currencies, arrays["sources"], arrays["targets"], arrays["multipliers"], edges
+    )
+    return Graph.from_compact(compact)
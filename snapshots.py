@@ -0,0 +1,344 @@
+"""
+Shared crypto graph snapshots for long running services.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import timedelta
+from typing import (
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import snapshot_file
+from decider.allpairs import BestRates
+from decider.core import Edge, EdgeKey, Graph
+
+logger = logging.getLogger(__name__)
+
+# all tickers request is heavy for binance rate limits, don't poll it too often
+GRAPH_REFRESH_INTERVAL = timedelta(minutes=5)
+# snapshots shared through a file are written and checked for changes this often
+SNAPSHOT_FILE_INTERVAL = timedelta(seconds=1)
+# snapshots changed only by streamed tickers are written at most this often,
+# the whole file is written and every reader loads it again
+SNAPSHOT_FILE_UPDATES_INTERVAL = timedelta(seconds=30)
+
+
+class GraphSnapshot:
+    """
+    Crypto graph built at some moment.
+
+    Snapshot is shared between requests and must not be changed.
+    Use ``graph.copy()`` to add request specific edges (like P2P offers).
+
+    Version changes when the graph is built again, snapshots with edges
+    updated by streamed tickers keep it and count ``updates`` instead.
+    """
+
+    def __init__(
+        self,
+        graph: Graph,
+        version: int,
+        best_rates: Optional[BestRates] = None,
+        created_at: Optional[float] = None,
+        updates: int = 0,
+    ):
+        self.graph = graph
+        self.version = version
+        # all pairs rates of the graph, if refresher precomputes them
+        self.best_rates = best_rates
+        self.created_at = created_at or time.time()
+        # updates of edges applied since the graph of the version was built
+        self.updates = updates
+
+    def __repr__(self) -> str:
+        return (
+            f"GraphSnapshot(version={self.version}, updates={self.updates}, "
+            f"created_at={self.created_at})"
+        )
+
+
+class GraphRefresher:
+    """Keeps the latest graph snapshot and rebuilds it on schedule."""
+
+    def __init__(
+        self,
+        build: Callable[[], Awaitable[Graph]],
+        interval: timedelta = GRAPH_REFRESH_INTERVAL,
+        precompute_rates: Optional[Callable[[Graph], BestRates]] = None,
+        on_update: Optional[Callable[[Set[EdgeKey]], None]] = None,
+    ):
+        """
+        :param build: coroutine function which builds a fresh graph
+        :param interval: time between refreshes
+        :param precompute_rates: function computing all pairs rates of the
+            fresh graph, called in a thread
+        :param on_update: function called with keys of edges changed by
+            update_edges(), like to drop cached results using them
+        """
+        self.build = build
+        self.interval = interval
+        self.precompute_rates = precompute_rates
+        self.on_update = on_update
+        self.snapshot: Optional[GraphSnapshot] = None
+        # full refreshes and updates publish snapshots one at a time
+        self._lock: Optional[asyncio.Lock] = None
+        # the latest edges updated while a refresh builds a new graph
+        self._refresh_updates: Optional[Dict[EdgeKey, Edge]] = None
+
+    @property
+    def _publish_lock(self) -> asyncio.Lock:
+        # created in a running loop, python < 3.10 binds it to the current loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def refresh(self) -> GraphSnapshot:
+        """
+        Build a new graph and swap it in.
+
+        Edges updated while the graph is built are newer than it, they are
+        applied to the new graph before it is published.
+        """
+        self._refresh_updates = {}
+        try:
+            graph = await self.build()
+            # warm up arrays used by searches before publishing
+            await asyncio.to_thread(graph.compact)
+            best_rates = None
+            if self.precompute_rates:
+                best_rates = await asyncio.to_thread(self.precompute_rates, graph)
+            async with self._publish_lock:
+                edges = self._refresh_updates.values()
+                _, _, best_rates = await self._update_graph(graph, best_rates, edges)
+                version = self.snapshot.version + 1 if self.snapshot else 1
+                # single reference assignment, readers see either old or new snapshot
+                self.snapshot = GraphSnapshot(graph, version, best_rates=best_rates)
+        finally:
+            self._refresh_updates = None
+        logger.info(f"Graph refreshed: {self.snapshot}")
+        return self.snapshot
+
+    async def update_edges(self, edges: List[Edge]) -> int:
+        """
+        Publish snapshot with edges replaced by fresh ones (see Graph.update_edge).
+
+        The current snapshot is not changed: edges are updated in a copy of
+        its graph, precomputed rates are updated only for affected rows. The
+        version is kept, so results cached by it stay, ``on_update`` is
+        called to drop the ones using changed edges.
+
+        :return: number of updated edges, edges unknown to the graph are skipped
+        """
+        async with self._publish_lock:
+            if self._refresh_updates is not None:
+                self._refresh_updates.update((edge.key(), edge) for edge in edges)
+            snapshot = self.snapshot
+            graph = snapshot.graph.copy()
+            updated, dirty, best_rates = await self._update_graph(
+                graph, snapshot.best_rates, edges
+            )
+            if dirty:
+                self.snapshot = GraphSnapshot(
+                    graph,
+                    snapshot.version,
+                    best_rates=best_rates,
+                    updates=snapshot.updates + 1,
+                )
+        if self.on_update is not None and dirty:
+            self.on_update(dirty)
+        return updated
+
+    @staticmethod
+    async def _update_graph(
+        graph: Graph, best_rates: Optional[BestRates], edges: Iterable[Edge]
+    ) -> Tuple[int, Set[EdgeKey], Optional[BestRates]]:
+        """
+        Update edges of graph in place and rows of precomputed rates going
+        through them in a copy.
+
+        :return: number of updated edges, keys of changed edges and rates
+        """
+        updated = 0
+        for edge in edges:
+            if graph.get_edge(edge.key()) is not None:
+                graph.update_edge(edge)
+                updated += 1
+        dirty = graph.pop_dirty()
+        if best_rates is not None and dirty:
+            best_rates = best_rates.copy()
+            await asyncio.to_thread(
+                best_rates.update,
+                graph.compact(),
+                [currency for currency, _, _ in dirty],
+            )
+        return updated, dirty, best_rates
+
+    async def run(self):
+        """Refresh graph forever. Failed refresh keeps serving previous snapshot."""
+        while True:
+            await asyncio.sleep(self.interval.total_seconds())
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Graph refresh failed, keeping previous snapshot")
+
+
+def save_snapshot(path: str, snapshot: GraphSnapshot):
+    """Write snapshot to a file, the file is replaced atomically."""
+    header, arrays = snapshot_file.graph_arrays(snapshot.graph)
+    header["snapshot"] = {
+        "version": snapshot.version,
+        "created_at": snapshot.created_at,
+    }
+    best_rates = snapshot.best_rates
+    if best_rates is not None:
+        header["best_rates"] = {
+            "max_length": best_rates.max_length,
+            "hop_penalty": best_rates.hop_penalty,
+        }
+        arrays["best_rates_scores"] = best_rates.scores
+        arrays["best_rates_predecessors"] = best_rates.predecessors
+    snapshot_file.write_arrays(path, header, arrays)
+
+
+def load_snapshot(file: Union[str, BinaryIO], version: int) -> GraphSnapshot:
+    """
+    Snapshot saved by save_snapshot(). Precomputed rates are memory-mapped.
+
+    :param file: path or file opened in binary mode
+    :param version: version of the loaded snapshot, versions of the writer
+        start from 1 again when it is restarted
+    """
+    header, arrays = snapshot_file.read_arrays(file)
+    graph = snapshot_file.graph_from_arrays(header, arrays)
+    best_rates = None
+    if "best_rates" in header:
+        best_rates = BestRates.from_arrays(
+            graph.compact(),
+            max_length=header["best_rates"]["max_length"],
+            hop_penalty=header["best_rates"]["hop_penalty"],
+            scores=arrays["best_rates_scores"],
+            predecessors=arrays["best_rates_predecessors"],
+        )
+    return GraphSnapshot(
+        graph,
+        version,
+        best_rates=best_rates,
+        created_at=header["snapshot"]["created_at"],
+    )
+
+
+class SnapshotFileWriter:
+    """
+    Writes new snapshots of a refresher to a file for other processes.
+
+    A rebuilt graph is written at the next check. Snapshots changed only by
+    streamed tickers are written at most once per ``updates_interval``, as
+    the whole file is written and loaded by every reader for each of them.
+    """
+
+    def __init__(
+        self,
+        refresher: GraphRefresher,
+        path: str,
+        interval: timedelta = SNAPSHOT_FILE_INTERVAL,
+        updates_interval: timedelta = SNAPSHOT_FILE_UPDATES_INTERVAL,
+    ):
+        """
+        :param interval: time between checks for a new snapshot, snapshots
+            published in between are not written
+        :param updates_interval: the shortest time between writes of
+            snapshots of the same version
+        """
+        self.refresher = refresher
+        self.path = path
+        self.interval = interval
+        self.updates_interval = updates_interval
+        # (version, updates) of the written snapshot
+        self.written: Optional[Tuple[int, int]] = None
+        self._written_at = -math.inf
+
+    async def write(self) -> bool:
+        """Write the current snapshot if it was not written yet."""
+        snapshot = self.refresher.snapshot
+        if snapshot is None or (snapshot.version, snapshot.updates) == self.written:
+            return False
+        same_version = self.written is not None and self.written[0] == snapshot.version
+        next_write = self._written_at + self.updates_interval.total_seconds()
+        if same_version and time.monotonic() < next_write:
+            return False
+        await asyncio.to_thread(save_snapshot, self.path, snapshot)
+        self.written = (snapshot.version, snapshot.updates)
+        self._written_at = time.monotonic()
+        logger.debug(f"Snapshot written to {self.path}: {snapshot}")
+        return True
+
+    async def run(self):
+        """Write snapshots forever."""
+        while True:
+            try:
+                await self.write()
+            except Exception:
+                logger.exception(f"Writing snapshot to {self.path} failed")
+            await asyncio.sleep(self.interval.total_seconds())
+
+
+class SnapshotFileReader:
+    """
+    Keeps the latest snapshot written to a file by SnapshotFileWriter.
+
+    Used in place of GraphRefresher by processes which don't build the graph
+    themselves. Arrays of snapshots are memory-mapped, so memory of the
+    largest of them (precomputed rates) is shared by all readers.
+    """
+
+    def __init__(self, path: str, interval: timedelta = SNAPSHOT_FILE_INTERVAL):
+        """:param interval: time between checks of the file for changes"""
+        self.path = path
+        self.interval = interval
+        self.snapshot: Optional[GraphSnapshot] = None
+        self._file_id = None
+
+    async def reload(self) -> bool:
+        """Load the file if it was replaced since the last load."""
+        with open(self.path, "rb") as f:
+            # the loaded file, the path can be replaced by the writer meanwhile
+            stat = os.fstat(f.fileno())
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_id == self._file_id:
+                return False
+            version = self.snapshot.version + 1 if self.snapshot else 1
+            self.snapshot = await asyncio.to_thread(load_snapshot, f, version)
+        self._file_id = file_id
+        logger.info(f"Snapshot loaded from {self.path}: {self.snapshot}")
+        return True
+
+    async def wait_loaded(self) -> GraphSnapshot:
+        """The first snapshot, waits until the file is written."""
+        while True:
+            try:
+                await self.reload()
+                return self.snapshot
+            except FileNotFoundError:
+                await asyncio.sleep(self.interval.total_seconds())
+
+    async def run(self):
+        """Reload changed file forever. Failed load keeps the previous snapshot."""
+        while True:
+            await asyncio.sleep(self.interval.total_seconds())
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception(f"Loading snapshot from {self.path} failed")
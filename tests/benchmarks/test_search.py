@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks import search
+from benchmarks.synthetic import SyntheticMarket
+
+
+def test_synthetic_market_is_seeded():
+    market = SyntheticMarket(assets=50, pairs=200, fiats=2, seed=1)
+
+    assert market.tickers == SyntheticMarket(50, 200, 2, seed=1).tickers
+    assert market.tickers != SyntheticMarket(50, 200, 2, seed=2).tickers
+    assert len(market.markets) == 200
+    graph = market.graph()
+    assert {"KZT(f)", "RUB(f)"} <= set(graph.compact().currencies)
+    assert graph.best_paths("KZT(f)", "RUB(f)", max_length=3, top_k=1)
+
+
+@pytest.mark.parametrize("hops", search.HOPS["small"])
+def test_small_graph_counters_match_baselines(hops):
+    assets, pairs, fiats = search.SIZES["small"]
+    graph = SyntheticMarket(assets, pairs, fiats).graph()
+    baselines = search.load_baselines()
+
+    for stage, func in search.stages(graph, hops).items():
+        explored, found = func()
+        baseline = baselines[f"small/hops={hops}/{stage}"]
+        assert (explored, found) == (baseline["explored"], baseline["found"])
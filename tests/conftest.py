@@ -1,6 +1,10 @@
 import pytest
 import requests_cache
 
+import common
+from providers import p2p
+from tests.replay_server import ReplayServer
+
 
 @pytest.fixture(scope="module")
 def cached_requests_fixture(request):
@@ -14,3 +18,16 @@ def cached_requests_fixture(request):
     )
     yield True
     requests_cache.uninstall_cache()
+
+
+@pytest.fixture
+def binance_replay_server(monkeypatch):
+    """Recorded responses of all Binance APIs used by sync loaders."""
+    with ReplayServer() as server:
+        monkeypatch.setattr(
+            p2p, "BINANCE_C2C_URL", f"{server.url}/bapi/c2c/v2/friendly/c2c"
+        )
+        monkeypatch.setattr(
+            common, "BINANCE_CONFIG", {"urls": {"api": {"public": f"{server.url}/api/v3"}}}
+        )
+        yield server
@@ -0,0 +1,140 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from decider.core import EdgeRaw, Graph, Node
+from tests.decider.test_core import EDGES, BTC, ETH, USDT, ETH_USDT
+
+
+def graph_of(edges):
+    graph = Graph()
+    for edge in edges:
+        graph.add(edge)
+    return graph
+
+
+def walks(graph, source, target, length):
+    """All walks of exactly ``length`` hops, brute force."""
+    if length == 0:
+        return [[]] if source == target else []
+    return [
+        [edge] + rest
+        for edge in graph.edges_from(source)
+        for rest in walks(graph, edge.to.currency, target, length - 1)
+    ]
+
+
+def log_score(edges, hop_penalty):
+    return sum(
+        math.log(edge.converted() * (1 - edge.commission()) * (1 - hop_penalty))
+        for edge in edges
+    )
+
+
+def test_best_rates_match_brute_force():
+    graph = graph_of(EDGES)
+    compact = graph.compact()
+    best_rates = graph.best_rates(max_length=3, hop_penalty=0.02)
+
+    for source, target in itertools.product(compact.currencies, repeat=2):
+        for length in range(4):
+            found = walks(graph, source, target, length)
+            i, j = compact.index(source), compact.index(target)
+            if not found:
+                assert best_rates.scores[length, i, j] == -math.inf
+                continue
+            expected = max(log_score(walk, 0.02) for walk in found)
+            assert best_rates.scores[length, i, j] == pytest.approx(expected)
+            walk = [compact.edge(p) for p in best_rates.walk(i, j, length)]
+            assert log_score(walk, 0.02) == pytest.approx(expected)
+
+
+def test_best_paths_join_edges():
+    graph = graph_of(EDGES)
+    best_rates = graph.best_rates(max_length=2)
+    fiat = Node(currency="KZT(f)")
+    buy_eth = EdgeRaw(from_=fiat, to=ETH, price=0.001)
+    buy_btc = EdgeRaw(from_=fiat, to=BTC, price=0.00005)
+    buy_unknown = EdgeRaw(from_=fiat, to=Node(currency="XXX"), price=1)
+    sell_usdt = EdgeRaw(from_=USDT, to=fiat, price=450)
+
+    paths = best_rates.best_paths(
+        [buy_eth, buy_btc, buy_unknown], [sell_usdt], max_length=3
+    )
+
+    assert paths[0] == [buy_eth, ETH_USDT, sell_usdt]
+    assert all(path[0] is not buy_unknown for path in paths)
+    assert all(len(path) <= 3 for path in paths)
+    # walks visiting the same currency twice are skipped
+    for path in paths:
+        currencies = [edge.from_.currency for edge in path]
+        assert len(set(currencies)) == len(currencies)
+    assert best_rates.best_paths([buy_eth], [sell_usdt], max_length=1) == []
+
+
+def test_best_paths_many_targets():
+    graph = graph_of(EDGES)
+    best_rates = graph.best_rates(max_length=2)
+    fiat, other = Node(currency="KZT(f)"), Node(currency="RUB(f)")
+    first_edges = [
+        EdgeRaw(from_=fiat, to=ETH, price=0.001),
+        EdgeRaw(from_=fiat, to=BTC, price=0.00005),
+    ]
+    targets = [
+        [EdgeRaw(from_=USDT, to=fiat, price=450)],
+        [EdgeRaw(from_=BTC, to=other, price=1_500_000)],
+        [EdgeRaw(from_=Node(currency="XXX"), to=other, price=1)],
+    ]
+
+    paths = best_rates.best_paths_many(first_edges, targets, max_length=4, top_k=3)
+
+    assert paths == [
+        best_rates.best_paths(first_edges, last_edges, max_length=4, top_k=3)
+        for last_edges in targets
+    ]
+    assert paths[0] and paths[1] and paths[2] == []
+
+
+def test_update_rows():
+    graph = graph_of(EDGES)
+    best_rates = graph.best_rates(max_length=3)
+    graph.update_edge(EdgeRaw(from_=ETH, to=USDT, price=5000.0, fee=0.01))
+
+    updated = best_rates.update(
+        graph.compact(), [currency for currency, _, _ in graph.pop_dirty()]
+    )
+
+    expected = graph.best_rates(max_length=3)
+    assert updated == 4
+    assert (best_rates.scores == expected.scores).all()
+    assert (best_rates.predecessors == expected.predecessors).all()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_best_paths_same_as_search(seed):
+    random = np.random.default_rng(seed)
+    nodes = [Node(currency=f"N{num}") for num in range(8)]
+    graph = graph_of(
+        EdgeRaw(from_=a, to=b, price=random.uniform(0.5, 1.5))
+        for a, b in itertools.permutations(nodes, 2)
+        if random.random() < 0.5
+    )
+    best_rates = graph.best_rates(max_length=2, hop_penalty=0.02)
+    fiat, other = Node(currency="KZT(f)"), Node(currency="RUB(f)")
+    first_edges = [EdgeRaw(from_=fiat, to=node, price=1) for node in nodes[:4]]
+    last_edges = [EdgeRaw(from_=node, to=other, price=1) for node in nodes[4:]]
+    for edge in first_edges + last_edges:
+        graph.add(edge)
+
+    for max_length in (3, 4, 6):
+        joined = best_rates.best_paths(
+            first_edges, last_edges, max_length=max_length, top_k=10
+        )
+        found = graph.best_paths(
+            "KZT(f)", "RUB(f)", max_length, top_k=10, hop_penalty=0.02, simple=True
+        )
+        assert [log_score(path, 0.02) for path in joined] == pytest.approx(
+            [log_score(path, 0.02) for path in found]
+        )
@@ -0,0 +1,83 @@
+import math
+
+import pytest
+
+from decider.core import EdgeRaw, Graph, Node
+from tests.decider.test_core import EDGES
+
+A = Node(currency="A")
+B = Node(currency="B")
+C = Node(currency="C")
+D = Node(currency="D")
+
+A_B = EdgeRaw(from_=A, to=B, price=2)
+B_A = EdgeRaw(from_=B, to=A, price=0.55)
+B_C = EdgeRaw(from_=B, to=C, price=3)
+C_A = EdgeRaw(from_=C, to=A, price=0.17)
+C_D = EdgeRaw(from_=C, to=D, price=1)
+D_A = EdgeRaw(from_=D, to=A, price=0.2)
+D_B = EdgeRaw(from_=D, to=B, price=0.3)
+
+CYCLE_EDGES = [A_B, B_A, B_C, C_A, C_D, D_A, D_B]
+
+
+def profit(cycle):
+    return math.prod(edge.converted() for edge in cycle) - 1
+
+
+@pytest.mark.parametrize(
+    "max_length, min_profit, expected",
+    [
+        [2, 0, [[A_B, B_A]]],
+        [3, 0, [[A_B, B_A], [A_B, B_C, C_A]]],
+        [4, 0, [[A_B, B_C, C_D, D_A], [A_B, B_A], [A_B, B_C, C_A]]],
+        [4, 0.15, [[A_B, B_C, C_D, D_A]]],
+    ],
+)
+def test_cycles(max_length, min_profit, expected):
+    graph = Graph()
+    for edge in CYCLE_EDGES:
+        graph.add(edge)
+
+    cycles = graph.cycles(max_length=max_length, min_profit=min_profit)
+
+    assert [cycle for _, cycle in cycles] == expected
+    assert [found_profit for found_profit, _ in cycles] == pytest.approx(
+        [profit(cycle) for cycle in expected]
+    )
+
+
+def test_no_cycles():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    assert graph.cycles(max_length=4) == []
+
+
+def test_cycles_through_the_same_node():
+    a, b, c, d, e, f = (Node(currency=currency) for currency in "ABCDEF")
+    edges = [
+        # A-B-C-A, 0.5 profit
+        EdgeRaw(from_=a, to=b, price=1.5),
+        EdgeRaw(from_=b, to=c, price=1),
+        EdgeRaw(from_=c, to=a, price=1),
+        # D-E-F-D, 0.5 profit
+        EdgeRaw(from_=d, to=e, price=1.5),
+        EdgeRaw(from_=e, to=f, price=1),
+        EdgeRaw(from_=f, to=d, price=1),
+        # A-E-C-A, 0.1 profit, shares A and C-A with the best cycle
+        EdgeRaw(from_=a, to=e, price=1.1),
+        EdgeRaw(from_=e, to=c, price=1),
+    ]
+    graph = Graph()
+    for edge in edges:
+        graph.add(edge)
+
+    cycles = graph.cycles(max_length=3)
+
+    assert [
+        "-".join(edge.from_.currency for edge in cycle) for _, cycle in cycles
+    ] == ["A-B-C", "D-E-F", "A-E-C"]
+    assert [found_profit for found_profit, _ in cycles] == pytest.approx(
+        [0.5, 0.5, 0.1]
+    )
@@ -0,0 +1,44 @@
+import numpy as np
+
+from decider.core import Graph
+from tests.decider.test_core import (
+    EDGES,
+    BTC_ETH,
+    BTC_USDT,
+    ETH_BTC,
+    ETH_EOS,
+    ETH_USDT,
+)
+
+
+def test_compact_graph():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    compact = graph.compact()
+
+    assert compact.currencies == ["BTC", "ETH", "EOS", "USDT"]
+    assert compact.offsets.tolist() == [0, 2, 5, 6, 8]
+    assert compact.targets.tolist() == [1, 3, 0, 2, 3, 1, 0, 1]
+    # out-edges keep order in which they were added
+    assert [compact.edge(position) for position in range(5)] == [
+        BTC_ETH,
+        BTC_USDT,
+        ETH_BTC,
+        ETH_EOS,
+        ETH_USDT,
+    ]
+    assert compact.multipliers[0] == BTC_ETH.converted()
+    assert compact.index("ETH") == 1
+    assert compact.index("XXX") is None
+    np.testing.assert_allclose(
+        compact.weights(0.02)[4], np.log(ETH_USDT.converted() * 0.98)
+    )
+
+
+def test_compact_graph_rebuilt_after_add():
+    graph = Graph()
+    graph.add(BTC_ETH)
+    assert len(graph.compact()) == 2
+    graph.add(BTC_USDT)
+    assert len(graph.compact()) == 3
@@ -1,9 +1,12 @@
+import itertools
 import math
+import random
 from typing import List
 
 import pytest
 
 from decider.core import Node, Edge, Graph, EdgeRaw
+from decider.search import SearchStats
 
 # TODO: get rig of crypto here. Build graph from scratch
 
@@ -84,4 +87,258 @@ def test_graph(kwargs, expected: List[Edge], expected_rates):
     ] == expected_rates
 
 
-# TODO: write test to remove loops in found Path
+def score(path: List[Edge], hop_penalty: float) -> float:
+    return math.prod(
+        [edge.converted() * (1 - edge.commission()) for edge in path]
+    ) * (1 - hop_penalty) ** len(path)
+
+
+@pytest.mark.parametrize("hop_penalty", [0, 0.02])
+@pytest.mark.parametrize("max_length", [1, 2, 3, 4, 5])
+@pytest.mark.parametrize("top_k", [1, 3, 100])
+def test_best_paths_same_as_exhaustive(top_k, max_length, hop_penalty):
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    all_paths = graph.paths(from_currency="EOS", to_currency="USDT", max_length=max_length)
+    expected = sorted(all_paths, key=lambda path: score(path, hop_penalty), reverse=True)
+
+    paths = graph.best_paths(
+        from_currency="EOS",
+        to_currency="USDT",
+        max_length=max_length,
+        top_k=top_k,
+        hop_penalty=hop_penalty,
+    )
+    assert [score(path, hop_penalty) for path in paths] == pytest.approx(
+        [score(path, hop_penalty) for path in expected[:top_k]]
+    )
+
+
+def test_best_paths_unreachable():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    assert graph.best_paths(from_currency="USDT", to_currency="EOS", max_length=1) == []
+    assert graph.best_paths(from_currency="USDT", to_currency="XXX") == []
+    assert graph.best_paths(from_currency="USDT", to_currency="USDT") == [[]]
+
+
+def currencies(path: List[Edge]) -> List[str]:
+    return [edge.from_.currency for edge in path] + [path[-1].to.currency]
+
+
+def test_paths_simple():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    all_paths = graph.paths(from_currency="EOS", to_currency="USDT", max_length=4)
+    stats = SearchStats()
+    paths = graph.paths(
+        from_currency="EOS", to_currency="USDT", max_length=4, simple=True, stats=stats
+    )
+
+    assert [currencies(path) for path in paths] == [
+        ["EOS", "ETH", "BTC", "USDT"],
+        ["EOS", "ETH", "USDT"],
+    ]
+    assert [path for path in all_paths if len(set(currencies(path))) == len(path) + 1] == paths
+    assert stats.pruned_cycles == stats.pruned > 0
+
+
+def recursive_paths(graph: Graph, currency: str, to: str, max_length: int):
+    if currency == to:
+        return [[]]
+    if max_length == 0:
+        return []
+    return [
+        [edge] + path
+        for edge in graph.edges_from(currency)
+        for path in recursive_paths(graph, edge.to.currency, to, max_length - 1)
+    ]
+
+
+@pytest.mark.parametrize("max_length", [0, 1, 2, 3, 5])
+def test_iter_paths_same_as_recursive(max_length):
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    expected = recursive_paths(graph, "EOS", "USDT", max_length)
+
+    paths = graph.iter_paths("EOS", "USDT", max_length=max_length)
+
+    assert not isinstance(paths, list)
+    assert list(paths) == expected
+    assert graph.paths_recursive(EOS, USDT, max_length) == expected
+
+
+def test_iter_paths_lazy():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    stats, all_stats = SearchStats(), SearchStats()
+
+    first = next(graph.iter_paths("EOS", "USDT", max_length=6, stats=stats))
+
+    assert first == graph.paths("EOS", "USDT", max_length=6, stats=all_stats)[0]
+    # search stops at the first path
+    assert stats.explored < all_stats.explored
+    assert list(graph.iter_paths("USDT", "USDT")) == [[]]
+    assert list(graph.iter_paths("USDT", "XXX")) == []
+
+
+@pytest.mark.parametrize("max_length", [2, 4, 6])
+def test_best_paths_simple(max_length):
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    simple_paths = graph.paths(
+        from_currency="EOS", to_currency="USDT", max_length=max_length, simple=True
+    )
+    stats = SearchStats()
+
+    paths = graph.best_paths(
+        from_currency="EOS",
+        to_currency="USDT",
+        max_length=max_length,
+        top_k=100,
+        simple=True,
+        stats=stats,
+    )
+
+    assert sorted(map(currencies, paths)) == sorted(map(currencies, simple_paths))
+    assert stats.pruned_cycles > 0
+
+
+@pytest.mark.parametrize("simple", [False, True])
+@pytest.mark.parametrize("max_length", [1, 3, 5])
+@pytest.mark.parametrize("top_k", [1, 3, 100])
+def test_best_paths_from_same_as_best_paths(top_k, max_length, simple):
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+
+    found = graph.best_paths_from(
+        from_currency="EOS",
+        max_length=max_length,
+        top_k=top_k,
+        hop_penalty=0.02,
+        simple=simple,
+    )
+
+    for target in ("BTC", "ETH", "USDT"):
+        expected = graph.best_paths(
+            from_currency="EOS",
+            to_currency=target,
+            max_length=max_length,
+            top_k=top_k,
+            hop_penalty=0.02,
+            simple=simple,
+        )
+        assert [score(path, 0.02) for path in found.get(target, [])] == pytest.approx(
+            [score(path, 0.02) for path in expected]
+        )
+    assert "EOS" not in found
+    assert set(graph.best_paths_from("EOS", ["USDT", "XXX"], max_length)) <= {"USDT"}
+    assert graph.best_paths_from("XXX") == {}
+
+
+def test_best_paths_from_end_at_target():
+    a, b, c, d, t = (Node(currency=currency) for currency in "ABCDT")
+    graph = Graph()
+    for from_, to, price in [
+        (a, t, 0.5),
+        (t, b, 4),
+        (b, t, 1),
+        (a, c, 1),
+        (c, d, 1),
+        (d, t, 1),
+    ]:
+        graph.add(EdgeRaw(from_=from_, to=to, price=price))
+
+    found = graph.best_paths_from("A", ["T"], max_length=3, top_k=1)
+
+    # A-T-B-T is better, but it reaches T twice
+    assert list(map(currencies, found["T"])) == [["A", "C", "D", "T"]]
+
+
+@pytest.mark.parametrize("simple", [False, True])
+@pytest.mark.parametrize("top_k", [1, 3])
+@pytest.mark.parametrize("seed", range(10))
+def test_best_paths_from_same_as_best_paths_random(seed, top_k, simple):
+    rng = random.Random(seed)
+    nodes = [Node(currency=f"N{num}") for num in range(7)]
+    graph = Graph()
+    for a, b in itertools.permutations(nodes, 2):
+        if rng.random() < 0.4:
+            graph.add(EdgeRaw(from_=a, to=b, price=rng.uniform(0.5, 2)))
+    targets = ["N1", "N2", "N3", "N4"]
+
+    for max_length in (2, 3, 5):
+        found = graph.best_paths_from(
+            "N0", targets, max_length, top_k=top_k, hop_penalty=0.02, simple=simple
+        )
+
+        for target in targets:
+            expected = graph.best_paths(
+                "N0", target, max_length, top_k=top_k, hop_penalty=0.02, simple=simple
+            )
+            assert [score(path, 0.02) for path in found.get(target, [])] == (
+                pytest.approx([score(path, 0.02) for path in expected])
+            )
+
+
+def test_copy_does_not_change_original():
+    graph = Graph()
+    for edge in EDGES[:4]:
+        graph.add(edge)
+    copy = graph.copy()
+    for edge in EDGES[4:]:
+        copy.add(edge)
+
+    assert graph.paths(from_currency="ETH", to_currency="USDT") == []
+    assert copy.paths(from_currency="ETH", to_currency="USDT", max_length=1) == [
+        [ETH_USDT]
+    ]
+    assert len(graph.compact()) == 3
+    assert len(copy.compact()) == 4
+
+
+def test_update_edge():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    compact = graph.compact()
+    copy = graph.copy()
+    cheaper = EdgeRaw(from_=ETH, to=USDT, price=500.0, fee=0.01)
+
+    assert graph.update_edge(cheaper) is ETH_USDT
+
+    assert graph.pop_dirty() == {("ETH", "USDT", "")}
+    assert graph.dirty == set()
+    assert graph.paths("ETH", "USDT", max_length=1) == [[cheaper]]
+    assert graph.edges_to("USDT") == [BTC_USDT, cheaper]
+    # compact form is shared with the copy, it is cloned
+    assert graph.compact() is not compact
+    assert graph.compact().multipliers[4] == cheaper.converted()
+    assert copy.paths("ETH", "USDT", max_length=1) == [[ETH_USDT]]
+    # no rebuild while compact form is not shared any more
+    patched = graph.compact()
+    graph.update_edge(ETH_USDT)
+    assert graph.compact() is patched
+    assert graph.best_paths("ETH", "USDT", max_length=1) == [[ETH_USDT]]
+
+
+def test_update_edge_of_copy():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    copy = graph.copy()
+    cheaper = EdgeRaw(from_=ETH, to=USDT, price=500.0, fee=0.01)
+    copy.add(EdgeRaw(from_=USDT, to=Node(currency="RUB"), price=60))
+    copy.update_edge(cheaper)
+
+    assert copy.best_paths("ETH", "RUB", max_length=2) == [[cheaper, copy._edges[-1]]]
+    assert graph.best_paths("ETH", "USDT", max_length=1) == [[ETH_USDT]]
+    with pytest.raises(KeyError):
+        graph.update_edge(EdgeRaw(from_=EOS, to=USDT, price=1))
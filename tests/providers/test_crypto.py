@@ -32,7 +32,73 @@ def test_binance_eth_rub(binance_tickers, binance_markets):
     # assert str(path) == "[[Node(currency='ETH'), Node(currency='BTC'), 0.054813, 0.001], [Node(currency='BTC'), Node(currency='RUB'), 1168501.0, 0.001]]"
     assert path[0].url() == "https://www.binance.com/ru/trade/ETH_BTC?type=spot"
     assert path[1].url() == "https://www.binance.com/ru/trade/BTC_RUB?type=spot"
-    assert path[0].converted(1000) == 54.813
-    assert path[0].converted() == 0.054813
+    # ETH is sold to the best bid
+    assert path[0].converted(1000) == 54.812
+    assert path[0].converted() == 0.054812
     assert path[0].commission(1000) == 1
     assert path[0].commission() == 0.001
+
+
+ORDER_BOOK = {
+    "bids": [[0.05, 2], [0.04, 10]],
+    "asks": [[0.06, 1], [0.08, 10]],
+}
+
+
+def order_book_edges():
+    base, quote = core.Node(currency="ETH"), core.Node(currency="BTC")
+    ticker = {"symbol": "ETH/BTC", "bid": 0.05, "ask": 0.06}
+    market = {"taker": 0.001, "base": "ETH", "quote": "BTC"}
+    direct = crypto.BinanceOrderBookEdge(base, quote, ticker, market, is_direct=True)
+    reverse = crypto.BinanceOrderBookEdge(quote, base, ticker, market, is_direct=False)
+    return direct, reverse
+
+
+def test_order_book_edge_without_depth():
+    direct, reverse = order_book_edges()
+
+    assert not direct.has_depth
+    # the same side of the book as with depth
+    assert direct.converted(10) == 10 * 0.05
+    assert reverse.converted(1) == 1 / 0.06
+
+
+def test_order_book_edge_walks_levels():
+    direct, reverse = order_book_edges()
+    for edge in (direct, reverse):
+        edge.load_depth(lambda symbol, limit: ORDER_BOOK)
+
+    # sell ETH to bids
+    assert direct.converted(1) == pytest.approx(0.05)
+    assert direct.converted(5) == pytest.approx(2 * 0.05 + 3 * 0.04)
+    # deeper than the book, the rest at the last level price
+    assert direct.converted(20) == pytest.approx(2 * 0.05 + 18 * 0.04)
+    # buy ETH from asks for BTC
+    assert reverse.converted(0.03) == pytest.approx(0.5)
+    assert reverse.converted(0.22) == pytest.approx(1 + 0.16 / 0.08)
+
+
+def test_markets_within_hops(binance_tickers, binance_markets):
+    markets = crypto.markets_within_hops(
+        binance_markets, sources=["USDT", "BTC"], targets=["RUB"], hops=1
+    )
+    assert {market["symbol"] for market in markets} == {"USDT/RUB", "BTC/RUB"}
+
+    markets = crypto.markets_within_hops(
+        binance_markets, sources=["ETH"], targets=["RUB"], hops=2
+    )
+    assert len(markets) < len(binance_markets)
+    # paths of the planned markets are the same as of all markets
+    full_graph, graph = core.Graph(), core.Graph()
+    crypto.add_quotes_to_graph(
+        tickers=binance_tickers, markets=binance_markets, graph=full_graph
+    )
+    tickers = {
+        market["symbol"]: binance_tickers[market["symbol"]]
+        for market in markets
+        if market["symbol"] in binance_tickers
+    }
+    crypto.add_quotes_to_graph(tickers=tickers, markets=markets, graph=graph)
+    assert sorted(map(str, graph.paths("ETH", "RUB", max_length=2))) == sorted(
+        map(str, full_graph.paths("ETH", "RUB", max_length=2))
+    )
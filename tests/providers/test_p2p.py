@@ -1,10 +1,25 @@
+import asyncio
+
+import httpx
+import pytest
 import vcr
 
 from decider import core
+from decider.compact import edge_multiplier
 from decider.core import Node
 from providers import p2p
+from tests.replay_server import ReplayServer
 from tests.testutils import cassette
 
+# searches differ only by body, match them by body
+c2c_vcr = vcr.VCR(match_on=["method", "uri", "body"])
+
+
+def load_recorded_offers(fiat, trade_type):
+    # vcr unpatches http connections globally while it creates each of them,
+    # opening connections from several threads is not safe
+    return p2p.load_binance_c2c_offers(fiat, trade_type, max_workers=1)
+
 search_item = {
     "adv": {
         "advNo": "11372091689796468736",
@@ -276,30 +291,30 @@ r = {
 }
 
 
-@vcr.use_cassette(cassette("cassettes/tests/binance_c2c_buy_kzt.yaml"))
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_buy_kzt.yaml"))
 def test_load_binance_p2p_offers_buy_kzt():
     fiat = "KZT"
     trade_type = "BUY"
-    offers = p2p.load_binance_c2c_offers(fiat, trade_type)
+    offers = load_recorded_offers(fiat, trade_type)
     assert set(offers) == {"USDT", "BTC", "BUSD", "BNB", "ETH", "SHIB"}
     for asset, offers in offers.items():
         assert 0 < len(offers) <= 10
 
 
-@vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
 def test_load_binance_c2c_offers_sell_rub():
     fiat = "RUB"
     trade_type = "SELL"
-    offers = p2p.load_binance_c2c_offers(fiat, trade_type)
+    offers = load_recorded_offers(fiat, trade_type)
     assert set(offers) == {"USDT", "BTC", "BUSD", "BNB", "ETH", "SHIB", "RUB"}
     for asset, offers in offers.items():
         assert len(offers) <= 10
 
 
-@vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
 def test_add_to_graph_sell_rub():
     graph = core.Graph()
-    offers = p2p.load_binance_c2c_offers(fiat="RUB", trade_type="SELL")
+    offers = load_recorded_offers(fiat="RUB", trade_type="SELL")
 
     p2p.add_c2c_offers_to_graph(offers["USDT"], graph)
 
@@ -316,9 +331,40 @@ def test_add_to_graph_sell_rub():
     assert edge.to == fiat_node
     assert edge.url() == 'https://c2c.binance.com/ru/trade/sell/USDT?fiat=RUB&payment=ALL'
 
-@vcr.use_cassette(cassette("cassettes/tests/binance_c2c_buy_kzt.yaml"))
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
+def test_converted_depends_on_amount():
+    offers = load_recorded_offers(fiat="RUB", trade_type="SELL")
+    edge = p2p.BinnanceP2PEdge(offers["USDT"])
+
+    # too small for any offer limits, reference price
+    assert edge.converted(1) == edge.price
+    # the best offer, 20.99 USDT available
+    assert edge.converted(20) == 20 * 61.45
+    # the best offer which limits allow 200 USDT
+    assert edge.converted(200) == 200 * 61.2
+    # no offer takes it all, split between offers
+    available = edge._input_ends[-1]
+    assert 61.11 * available < edge.converted(available) < 61.45 * available
+    # all loaded offers can't take it
+    assert edge.converted(available * 1.01) == 0
+
+
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_sell_rub.yaml"))
+def test_at_amount_rates_edge_for_searches():
+    offers = load_recorded_offers(fiat="RUB", trade_type="SELL")
+    edge = p2p.BinnanceP2PEdge(offers["USDT"])
+
+    rated = edge.at_amount(200)
+
+    assert rated.key() == edge.key()
+    assert (edge.rate_amount, rated.rate_amount) == (1, 200)
+    assert edge_multiplier(rated) == 61.2
+    assert edge_multiplier(edge.at_amount(edge._input_ends[-1] * 2)) == 0
+
+
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_buy_kzt.yaml"))
 def test_add_to_graph_buy_kzt():
-    offers = p2p.load_binance_c2c_offers(fiat="KZT", trade_type="BUY")
+    offers = load_recorded_offers(fiat="KZT", trade_type="BUY")
 
     graph = core.Graph()
     p2p.add_c2c_offers_to_graph(offers["USDT"], graph)
@@ -337,11 +383,23 @@ def test_add_to_graph_buy_kzt():
     assert edge.url() == 'https://c2c.binance.com/ru/trade/all-payments/USDT?fiat=KZT'
 
 
-@vcr.use_cassette(cassette("cassettes/tests/c2c_test_add_to_graph_all.yaml"))
+@c2c_vcr.use_cassette(cassette("cassettes/tests/binance_c2c_buy_kzt.yaml"))
+def test_add_to_graph_again_replaces_offers():
+    offers = load_recorded_offers(fiat="KZT", trade_type="BUY")
+
+    graph = core.Graph()
+    p2p.add_c2c_offers_to_graph(offers["USDT"], graph)
+    p2p.add_c2c_offers_to_graph(offers["USDT"][1:], graph)
+
+    assert len(graph.edges()) == 1
+    assert graph.edges_from("KZT(f)")[0].offers == offers["USDT"][1:]
+
+
+@c2c_vcr.use_cassette(cassette("cassettes/tests/c2c_test_add_to_graph_all.yaml"))
 def test_add_to_graph_all():
     graph = core.Graph()
-    offers_1 = p2p.load_binance_c2c_offers(fiat="KZT", trade_type="BUY")
-    offers_2 = p2p.load_binance_c2c_offers(fiat="RUB", trade_type="SELL")
+    offers_1 = load_recorded_offers(fiat="KZT", trade_type="BUY")
+    offers_2 = load_recorded_offers(fiat="RUB", trade_type="SELL")
 
     for asset_offers in list(offers_1.values()) + list(offers_2.values()):
         p2p.add_c2c_offers_to_graph(asset_offers, graph)
@@ -358,3 +416,94 @@ def test_add_to_graph_all():
         Node(currency="RUB(f)"),
     }
     assert 13, len(graph._edges)
+
+
+@pytest.fixture
+def replay_server(monkeypatch):
+    with ReplayServer() as server:
+        monkeypatch.setattr(
+            p2p, "BINANCE_C2C_URL", f"{server.url}/bapi/c2c/v2/friendly/c2c"
+        )
+        yield server
+
+
+def test_load_binance_c2c_offers_async(replay_server):
+    async def load():
+        async with httpx.AsyncClient() as http:
+            client = p2p.AsyncC2CClient(http)
+            first, second = await asyncio.gather(
+                p2p.load_binance_c2c_offers_async(client, "KZT", "BUY"),
+                p2p.load_binance_c2c_offers_async(client, "KZT", "BUY"),
+            )
+            assert first == second
+            return first
+
+    offers = asyncio.run(load())
+
+    assert set(offers) == {"USDT", "BTC", "BUSD", "BNB", "ETH", "SHIB"}
+    assert all(0 < len(asset_offers) <= 10 for asset_offers in offers.values())
+    # config and one search per asset, concurrent identical requests are shared
+    assert replay_server.requests_count == 1 + 6
+
+
+def test_load_binance_c2c_offers_bulk(replay_server):
+    buy_kzt, sell_rub = p2p.load_binance_c2c_offers_bulk(
+        [("KZT", "BUY"), ("RUB", "SELL")]
+    )
+
+    assert list(buy_kzt) == ["USDT", "BTC", "BUSD", "BNB", "ETH", "SHIB"]
+    assert set(sell_rub) == {"USDT", "BTC", "BUSD", "BNB", "ETH", "SHIB", "RUB"}
+    assert all(offer["adv"]["fiatUnit"] == "KZT" for offer in buy_kzt["USDT"])
+    assert replay_server.requests_count == 2 + 6 + 7
+    # connections are kept alive and reused by the pool
+    assert replay_server.connections_count <= p2p.C2C_MAX_CONCURRENT_REQUESTS
+
+
+def fake_search_pages(monkeypatch, total):
+    """Fake binance_c2c_search with ``total`` offers taking 1000 KZT each."""
+    requested_pages = []
+
+    def search(fiat, asset, trade_type, rows, page, session=None):
+        requested_pages.append(page)
+        offer = {
+            "adv": dict(search_item["adv"], maxSingleTransAmount="1000"),
+            "advertiser": {"nickName": "merchant"},
+        }
+        count = max(0, min(rows, total - (page - 1) * rows))
+        return {"data": [offer] * count, "total": total}
+
+    monkeypatch.setattr(p2p, "binance_c2c_search", search)
+    return requested_pages
+
+
+def test_iter_offers_stops_with_enough_liquidity(monkeypatch):
+    requested_pages = fake_search_pages(monkeypatch, total=100)
+
+    offers = list(
+        p2p.iter_binance_c2c_offers("KZT", "USDT", "SELL", min_liquidity=30000)
+    )
+
+    assert requested_pages == [1, 2]
+    assert len(offers) == 2 * p2p.C2C_PAGE_ROWS
+    assert set(offers[0]) == {"adv"}
+    assert set(offers[0]["adv"]) == set(p2p.C2C_OFFER_FIELDS)
+
+
+def test_iter_offers_stops_when_offers_run_out(monkeypatch):
+    requested_pages = fake_search_pages(monkeypatch, total=25)
+
+    offers = list(
+        p2p.iter_binance_c2c_offers("KZT", "USDT", "SELL", min_liquidity=10 ** 9)
+    )
+
+    assert requested_pages == [1, 2]
+    assert len(offers) == 25
+
+
+def test_iter_offers_first_page_without_liquidity(monkeypatch):
+    requested_pages = fake_search_pages(monkeypatch, total=100)
+
+    offers = list(p2p.iter_binance_c2c_offers("KZT", "USDT", "SELL", max_offers=10))
+
+    assert requested_pages == [1]
+    assert len(offers) == 10
@@ -0,0 +1,132 @@
+"""
+Local HTTP server which replays responses recorded in vcr cassettes.
+
+Used to run the service and its loaders against recorded Binance data
+without network access.
+"""
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import yaml
+
+from tests.testutils import cassette
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # many concurrent clients connect at once
+    request_queue_size = 1024
+
+
+DEFAULT_CASSETTES = [
+    cassette("cassettes/fixtures/binance.yaml"),
+    cassette("cassettes/tests/c2c_test_add_to_graph_all.yaml"),
+]
+
+
+def _body_key(body) -> Optional[str]:
+    if not body:
+        return None
+    return json.dumps(json.loads(body), sort_keys=True)
+
+
+def load_responses(paths: List[str]) -> Dict[Tuple[str, str, Optional[str]], bytes]:
+    """Recorded responses by (method, path, request json body)."""
+    responses = {}
+    for path in paths:
+        with open(path) as f:
+            interactions = yaml.safe_load(f)["interactions"]
+        for interaction in interactions:
+            request = interaction["request"]
+            body = interaction["response"]["body"]["string"]
+            if isinstance(body, str):
+                body = body.encode()
+            if body[:2] == b"\x1f\x8b":
+                body = gzip.decompress(body)
+            key = (
+                request["method"],
+                urlsplit(request["uri"]).path,
+                _body_key(request["body"]),
+            )
+            responses[key] = body
+    return responses
+
+
+class ReplayServer:
+    """
+    Serve recorded responses on localhost.
+
+    Requests are matched by method, path and json body. Hosts are ignored, so
+    all Binance APIs are served under the same url. Use as a context manager.
+    """
+
+    def __init__(
+        self, cassettes: List[str] = None, latency: float = 0, port: int = 0
+    ):
+        """
+        :param cassettes: vcr cassette files
+        :param latency: seconds to wait before each response, emulates upstream
+        :param port: port to listen, 0 - any free port
+        """
+        self.responses = load_responses(cassettes or DEFAULT_CASSETTES)
+        self.latency = latency
+        self.requests_count = 0
+        self.connections_count = 0
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are sent separately, don't wait for delayed ACK
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                server.connections_count += 1
+                super().setup()
+
+            def do_GET(self):
+                self._reply(None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self._reply(_body_key(self.rfile.read(length)))
+
+            def _reply(self, body_key):
+                server.requests_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                path = urlsplit(self.path).path
+                body = server.responses.get((self.command, path, body_key))
+                status = 200 if body is not None else 404
+                body = body if body is not None else b"{}"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "ReplayServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,10 @@
+import pytest
+
+import api
+
+
+@pytest.mark.parametrize(
+    "amount, tier", [(1, 1), (0.5, 1), (250, 1000), (1000, 1000), (1001, 10000)]
+)
+def test_amount_tier(amount, tier):
+    assert api.amount_tier(amount) == tier
@@ -0,0 +1,16 @@
+from click.testing import CliRunner
+
+import cli
+
+
+def test_best_path_is_default_command():
+    runner = CliRunner()
+
+    default = runner.invoke(cli.cli, ["--timings", "--currency-from", "KZT", "--help"])
+    group = runner.invoke(cli.cli, ["--timings", "--help"])
+    arbitrage = runner.invoke(cli.cli, ["arbitrage", "--help"])
+
+    assert default.exit_code == group.exit_code == arbitrage.exit_code == 0
+    assert default.output.startswith("Usage: cli best-path [OPTIONS]")
+    assert group.output.startswith("Usage: cli [OPTIONS] COMMAND [ARGS]")
+    assert arbitrage.output.startswith("Usage: cli arbitrage [OPTIONS]")
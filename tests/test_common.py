@@ -1,5 +1,8 @@
+import pytest
+
 import common
 from decider.core import EdgeRaw, Node
+from providers import crypto, p2p
 
 n1 = Node(currency="N1")
 n2 = Node(currency="N2")
@@ -17,3 +20,235 @@ def test_ordered_paths():
     ordered_paths = common.ordered_paths(paths)
 
     assert ordered_paths == [path2, path1]
+
+
+def test_ordered_paths_top_k():
+    path1 = common.Path(edges=[EdgeRaw(n1, n2, 4, 0.01)])
+    path2 = common.Path(edges=[EdgeRaw(n1, n3, 2, 0.01), EdgeRaw(n3, n2, 2.5, 0.01)])
+    path3 = common.Path(edges=[EdgeRaw(n1, n2, 4, 0.01)])
+    paths = [path1, path2, path3]
+
+    assert common.ordered_paths(paths) == [path2, path1, path3]
+    assert common.ordered_paths(paths, top_k=2) == [path2, path1]
+    assert common.ordered_paths([]) == []
+    # paths of a generator are kept in a heap of top_k
+    assert common.ordered_paths(iter(paths), top_k=2) == [path2, path1]
+    assert common.ordered_paths(iter(paths)) == [path2, path1, path3]
+
+
+def test_score_paths():
+    edge = EdgeRaw(n3, n2, 2.5, 0.01)
+    paths = [
+        common.Path(edges=[EdgeRaw(n1, n2, 4, 0.01)]),
+        common.Path(edges=[EdgeRaw(n1, n3, 2, 0.01), edge]),
+        common.Path(edges=[EdgeRaw(n1, n3, 3, 0), edge]),
+    ]
+
+    rates, scores = common.score_paths(paths)
+
+    assert rates == pytest.approx([path.rate() for path in paths])
+    assert scores == pytest.approx([path.score() for path in paths])
+
+
+def test_prepare_conversion_paths_top_k():
+    paths = [
+        common.Path(edges=[EdgeRaw(n1, n2, 4, 0.01)]),
+        common.Path(edges=[EdgeRaw(n1, n3, 2, 0.01), EdgeRaw(n3, n2, 2.5, 0.01)]),
+    ]
+
+    (best,) = common.prepare_conversion_paths(paths, source_amount=10, top_k=1)
+
+    assert best.conversion_rate == pytest.approx(paths[1].rate())
+    assert best.amount_target_currency == pytest.approx(10 * paths[1].rate())
+    assert [conversion.to_currency for conversion in best.conversions] == ["N3", "N2"]
+
+
+def test_prepare_conversion_paths_with_depth():
+    ticker = {"symbol": "N1/N2", "bid": 2, "ask": 2}
+    market = {"taker": 0, "base": "N1", "quote": "N2"}
+    book_edge = crypto.BinanceOrderBookEdge(n1, n2, ticker, market, is_direct=True)
+    other_edge = crypto.BinanceOrderBookEdge(n1, n2, ticker, market, is_direct=True)
+    paths = [
+        common.Path(edges=[book_edge]),
+        common.Path(edges=[other_edge]),
+        common.Path(edges=[EdgeRaw(n1, n3, 1.5, 0), EdgeRaw(n3, n2, 1, 0)]),
+    ]
+    fetched = []
+
+    def fetch_order_book(symbol, limit):
+        fetched.append(symbol)
+        return {"bids": [[2, 1], [1, 100]], "asks": []}
+
+    best, *_ = common.prepare_conversion_paths_with_depth(
+        paths, 10, fetch_order_book, top_k=3
+    )
+
+    # the same symbol is fetched once
+    assert fetched == ["N1/N2"]
+    # order book is too thin for 10 N1, P2P like path wins
+    assert [conversion.to_currency for conversion in best.conversions] == ["N3", "N2"]
+    assert best.amount_target_currency == 15
+
+
+def test_prepare_for_fiat(binance_replay_server):
+    full_graph = common.prepare()
+    graph = common.prepare_for_fiat("KZT", "RUB", max_length=3)
+
+    # KZT assets to RUB assets in one conversion
+    assert 0 < len(graph.edges()) < len(full_graph.edges()) / 10
+    for graph_ in (graph, full_graph):
+        common.load_c2c_to_graph("KZT", "RUB", graph_)
+    paths = common.search_paths_for_fiat("KZT", "RUB", graph, 3, top_k=10)
+    full_paths = common.search_paths_for_fiat("KZT", "RUB", full_graph, 3, top_k=10)
+    assert [path.rate() for path in paths] == [path.rate() for path in full_paths]
+
+
+def test_c2c_sides_of_queries():
+    sides, min_liquidity = common.c2c_sides_of_queries(
+        [("KZT", "RUB", 1000), ("KZT", "EUR", 5000), ("RUB", "KZT", None)]
+    )
+
+    assert sides == [
+        ("KZT", "BUY"),
+        ("RUB", "SELL"),
+        ("EUR", "SELL"),
+        ("RUB", "BUY"),
+        ("KZT", "SELL"),
+    ]
+    assert min_liquidity == {"KZT": 5000}
+
+
+def test_find_paths_for_queries(binance_replay_server):
+    crypto_graph = common.prepare()
+    graph = crypto_graph.copy()
+    queries = [("KZT", "RUB", None), ("KZT", "RUB", None)]
+
+    paths = common.find_paths_for_queries(queries, graph, 4, top_k=10)
+
+    # each P2P side is added once
+    single_graph = crypto_graph.copy()
+    common.load_c2c_to_graph("KZT", "RUB", single_graph)
+    assert len(graph.edges()) == len(single_graph.edges())
+    best_rates = common.precompute_best_rates(crypto_graph, 4)
+    expected = common.join_paths_for_fiat(
+        "KZT", "RUB", single_graph, best_rates, 4, top_k=10
+    )
+    assert len(paths) == 2
+    for query_paths in paths:
+        assert [path.rate() for path in query_paths] == [
+            path.rate() for path in expected
+        ]
+
+
+def test_search_paths_from_fiat(binance_replay_server):
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+
+    found = common.search_paths_from_fiat("KZT", graph, 4, top_k=10)
+
+    assert set(found) == {"RUB"}
+    expected = common.search_paths_for_fiat("KZT", "RUB", graph, 4, top_k=10)
+    assert [path.rate() for path in found["RUB"]] == [path.rate() for path in expected]
+
+
+def test_search_paths_at_amount(binance_replay_server):
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+    liquidity = sorted(edge._input_ends[-1] for edge in graph.edges_from("KZT(f)"))
+    # only offers of the most liquid asset can take it
+    amount = (liquidity[-2] + liquidity[-1]) / 2
+
+    paths = common.search_paths_for_fiat(
+        "KZT", "RUB", graph, 3, top_k=10, amount=amount
+    )
+
+    assert paths
+    for path in paths:
+        assert path.edges[0].rate_amount == amount
+        assert path.edges[0]._input_ends[-1] > amount
+        # rated at the asset amount bought for it
+        assert path.edges[-1].rate_amount not in (1, amount)
+    conversion_paths = common.prepare_conversion_paths(paths, amount)
+    assert all(path.amount_target_currency > 0 for path in conversion_paths)
+    # nothing can take it
+    assert not common.search_paths_for_fiat(
+        "KZT", "RUB", graph, 3, top_k=10, amount=liquidity[-1] * 2
+    )
+
+
+def test_c2c_target_liquidity(binance_replay_server):
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+    amount = max(edge._input_ends[-1] for edge in graph.edges_from("KZT(f)")) * 0.99
+
+    liquidity = common.c2c_target_liquidity("KZT", "RUB", graph, amount, 3)
+
+    # about 1.4M RUB, more than offers of some assets can take
+    assert 1e6 < liquidity < 2e6
+    assert any(
+        sum(map(p2p.offer_liquidity, edge.offers)) < liquidity
+        for edge in graph.edges_to("RUB(f)")
+    )
+    # the first page is deep enough
+    assert common.c2c_target_liquidity("KZT", "RUB", graph, 1000, 3) is None
+
+
+def test_loaded_graph_is_rated_at_amount(binance_replay_server, monkeypatch):
+    # only pages of 10 offers are recorded
+    monkeypatch.setattr(p2p, "C2C_PAGE_ROWS", 10)
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph, amount=1000, max_length=3)
+
+    rated = common.search_paths_for_fiat(
+        "KZT", "RUB", graph.copy(), 3, top_k=10, amount=1000, rated=True
+    )
+
+    found = common.search_paths_for_fiat(
+        "KZT", "RUB", graph.copy(), 3, top_k=10, amount=1000
+    )
+    assert rated
+    assert all(path.edges[0].rate_amount == 1000 for path in rated)
+    assert [path.score() for path in rated] == [path.score() for path in found]
+
+
+def test_load_c2c_for_queries_deepens_targets(binance_replay_server, monkeypatch):
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+    amount = max(edge._input_ends[-1] for edge in graph.edges_from("KZT(f)")) * 0.99
+    expected = common.c2c_target_liquidity("KZT", "RUB", graph, amount, 3)
+    load_bulk = p2p.load_binance_c2c_offers_bulk
+    calls = []
+
+    def load_first_pages(sides, min_liquidity=None):
+        calls.append((sides, min_liquidity))
+        # only first pages are recorded
+        return load_bulk(sides)
+
+    monkeypatch.setattr(p2p, "load_binance_c2c_offers_bulk", load_first_pages)
+    queries = [("KZT", "RUB", amount), ("KZT", "RUB", 1000), ("KZT", "RUB", None)]
+
+    common.load_c2c_for_queries(queries, common.prepare(), 3)
+
+    assert calls[1:] == [([("RUB", "SELL")], {"RUB": pytest.approx(expected)})]
+    assert common.c2c_targets_liquidity(queries[1:], graph, 3) == {}
+
+
+@pytest.mark.parametrize("max_length", [3, 4, 6])
+def test_join_paths_same_as_search(binance_replay_server, max_length):
+    crypto_graph = common.prepare()
+    # walks longer than precomputed are bounded by relaxing edges
+    best_rates = common.precompute_best_rates(crypto_graph, 4)
+    graph = crypto_graph.copy()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+
+    joined = common.join_paths_for_fiat(
+        "KZT", "RUB", graph.copy(), best_rates, max_length, top_k=10
+    )
+
+    found = common.search_paths_for_fiat(
+        "KZT", "RUB", graph.copy(), max_length, top_k=10
+    )
+    assert len(joined) == 10
+    assert [path.score() for path in joined] == pytest.approx(
+        [path.score() for path in found], rel=1e-12
+    )
@@ -0,0 +1,64 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+# heavy dependencies are imported only by the functions using them
+LAZY_MODULES = {"ccxt", "requests_cache", "requests", "httpx", "aiohttp", "uvicorn"}
+
+# cumulative import time, loose enough for slow CI machines (about 5x of what
+# it takes now), only to catch a heavy dependency imported eagerly
+IMPORT_TIME_BUDGET = {
+    "cli": 1.0,
+    "api": 1.5,
+}
+
+
+def imported_packages(module: str) -> set:
+    """Top level packages in ``sys.modules`` after importing module in a new process."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print('\\n'.join(sys.modules))",
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {name.partition(".")[0] for name in result.stdout.splitlines()}
+
+
+@pytest.mark.parametrize("module", ["cli", "api"])
+def test_heavy_dependencies_are_lazy(module):
+    packages = imported_packages(module)
+
+    assert module in packages
+    assert LAZY_MODULES & packages == set()
+
+
+def import_time(module: str) -> float:
+    """Cumulative import seconds of module in a new process, see ``-X importtime``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1_000_000
+    raise AssertionError(f"{module} is not imported")
+
+
+@pytest.mark.parametrize("module", IMPORT_TIME_BUDGET)
+def test_import_time(module):
+    # the fastest of a few runs, a single one can be slowed down by other tests
+    assert min(import_time(module) for _ in range(3)) < IMPORT_TIME_BUDGET[module]
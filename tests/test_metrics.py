@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import common
+from decider.core import EdgeRaw, Node
+from metrics import METRICS, Metrics
+
+
+def test_render_prometheus_text():
+    metrics = Metrics()
+    metrics.inc("upstream_requests", api="c2c_search")
+    metrics.inc("upstream_requests", 2, api="c2c_search")
+    metrics.set("graph_edges", 10, graph="crypto")
+    metrics.observe("search", 0.5)
+    metrics.observe("search", 0.25)
+
+    assert metrics.render().splitlines() == [
+        "# TYPE easypeezy_stage_seconds summary",
+        'easypeezy_stage_seconds_sum{stage="search"} 0.75',
+        'easypeezy_stage_seconds_count{stage="search"} 2',
+        "# TYPE easypeezy_upstream_requests_total counter",
+        'easypeezy_upstream_requests_total{api="c2c_search"} 3',
+        "# TYPE easypeezy_graph_edges gauge",
+        'easypeezy_graph_edges{graph="crypto"} 10',
+    ]
+
+
+def test_count_cached():
+    metrics = Metrics()
+
+    metrics.count_cached(SimpleNamespace(from_cache=True), api="c2c_config")
+    metrics.count_cached(SimpleNamespace(from_cache=False), api="c2c_config")
+    # requests_cache is not installed
+    metrics.count_cached(SimpleNamespace(), api="c2c_config")
+
+    assert metrics.counters == {
+        ("upstream_requests", (("api", "c2c_config"),)): 3,
+        ("requests_cache_requests", (("api", "c2c_config"), ("result", "hit"))): 1,
+        ("requests_cache_requests", (("api", "c2c_config"), ("result", "miss"))): 1,
+    }
+
+
+def test_stages_are_timed():
+    n1, n2 = Node(currency="N1"), Node(currency="N2")
+    paths = [common.Path(edges=[EdgeRaw(n1, n2, 2, 0.01)])] * 3
+    METRICS.reset()
+
+    common.prepare_conversion_paths(paths, top_k=2)
+
+    assert set(METRICS.stages) == {"rank", "serialize"}
+    assert METRICS.counters[("paths_returned", ())] == 2
+    assert "serialize" in METRICS.summary()
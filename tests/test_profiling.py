@@ -0,0 +1,75 @@
+import marshal
+import threading
+import time
+
+import pytest
+
+import common
+from decider.core import EdgeRaw, Node
+from profiling import ProfileLimiter, ProfileStore, QueryProfile, run_profiled
+
+
+def rates():
+    a, b, c = (Node(currency=currency) for currency in "ABC")
+    path = common.Path(edges=[EdgeRaw(a, b, 2), EdgeRaw(b, c, 3)])
+    return [path.rate() for _ in range(10)]
+
+
+def busy(seconds):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def test_cprofile_runs_in_threads():
+    profile = QueryProfile("cprofile")
+
+    thread = threading.Thread(target=run_profiled, args=(profile, rates))
+    thread.start()
+    thread.join()
+    run_profiled(profile, rates)
+    stats = marshal.loads(profile.finish())
+
+    calls = {func: stat[1] for (_, _, func), stat in stats.items()}
+    assert calls["rate"] == 20
+    assert profile.filename == f"query-{profile.id}.prof"
+
+
+def test_sample_collapsed_stacks():
+    profile = QueryProfile("sample", interval=0.001)
+
+    run_profiled(profile, busy, 0.1)
+    # not profiled
+    busy(0.05)
+    report = profile.finish().decode()
+
+    stacks = {
+        stack: int(count)
+        for stack, count in (line.rsplit(" ", 1) for line in report.splitlines())
+    }
+    assert stacks
+    # only the profiled call, a few samples can land in frames around it
+    assert all("profiling:run_profiled" in stack for stack in stacks)
+    in_busy = sum(
+        count
+        for stack, count in stacks.items()
+        if stack.endswith(";profiling:run_profiled;tests.test_profiling:busy")
+    )
+    assert in_busy > sum(stacks.values()) / 2
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        QueryProfile("perf")
+
+
+def test_limiter_and_store():
+    limiter = ProfileLimiter(max_per_minute=2)
+    store = ProfileStore(max_size=1)
+    first, second = QueryProfile(), QueryProfile()
+    store.add(first, b"first")
+    store.add(second, b"second")
+
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
+    assert store.get(first.id) is None
+    assert store.get(second.id) == (second.filename, b"second")
@@ -0,0 +1,98 @@
+import asyncio
+import functools
+from datetime import timedelta
+
+import pytest
+
+from result_cache import ResultCache
+
+
+def counting(calls):
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return len(calls)
+
+    return compute
+
+
+def test_hits_and_shared_computation():
+    cache = ResultCache()
+    calls = []
+
+    async def run():
+        first, second = await asyncio.gather(
+            cache.get("KZT-RUB", counting(calls)), cache.get("KZT-RUB", counting(calls))
+        )
+        third = await cache.get("KZT-RUB", counting(calls))
+        return first, second, third
+
+    assert asyncio.run(run()) == (1, 1, 1)
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_rate == pytest.approx(2 / 3)
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_size=2)
+    calls = []
+
+    async def run():
+        await cache.get("a", counting(calls))
+        await cache.get("b", counting(calls))
+        await cache.get("a", counting(calls))
+        # "b" is least recently used
+        await cache.get("c", counting(calls))
+        await cache.get("a", counting(calls))
+        await cache.get("b", counting(calls))
+
+    asyncio.run(run())
+    assert len(calls) == 4
+    assert cache.evictions == 2
+    assert len(cache) == 2
+
+
+def test_expiration():
+    cache = ResultCache(expire=timedelta(seconds=0))
+    calls = []
+
+    async def run():
+        await cache.get("a", counting(calls))
+        return await cache.get("a", counting(calls))
+
+    assert asyncio.run(run()) == 2
+    assert cache.expirations == 1
+
+
+def test_failure_is_not_cached():
+    cache = ResultCache()
+
+    async def fail():
+        raise RuntimeError("Upstream is down")
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await cache.get("a", fail)
+        return await cache.get("a", counting([]))
+
+    assert asyncio.run(run()) == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_invalidate_values():
+    cache = ResultCache()
+    calls = []
+
+    async def value(result):
+        calls.append(result)
+        return result
+
+    async def run():
+        await cache.get("a", functools.partial(value, ["KZT", "USDT"]))
+        await cache.get("b", functools.partial(value, ["RUB", "BTC"]))
+        assert cache.invalidate_values(lambda result: "USDT" in result) == 1
+        await cache.get("a", functools.partial(value, ["KZT", "USDT"]))
+        await cache.get("b", functools.partial(value, ["RUB", "BTC"]))
+
+    asyncio.run(run())
+    assert len(calls) == 3
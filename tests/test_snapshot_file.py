@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import common
+import snapshot_file
+from decider.core import EdgeRaw, Node
+
+
+def test_save_and_load_graph(binance_replay_server, tmp_path):
+    graph = common.prepare()
+    common.load_c2c_to_graph("KZT", "RUB", graph)
+    graph.add(EdgeRaw(Node(currency="RUB"), Node(currency="N1"), 0.5, fee=0.01))
+    path = str(tmp_path / "graph.bin")
+
+    snapshot_file.save_graph(path, graph, metadata={"source": "replay"})
+    loaded = snapshot_file.load_graph(path)
+
+    assert snapshot_file.read_header(path)["metadata"] == {"source": "replay"}
+    assert [edge.key() for edge in loaded.edges()] == [
+        edge.key() for edge in graph.edges()
+    ]
+    for edge, loaded_edge in zip(graph.edges(), loaded.edges()):
+        assert type(loaded_edge) is type(edge)
+        assert loaded_edge.url() == edge.url()
+        for amount in (1, 10_000):
+            assert loaded_edge.converted(amount) == edge.converted(amount)
+            assert loaded_edge.commission(amount) == edge.commission(amount)
+    assert [edge.key() for edge in loaded.edges_to("RUB(f)")] == [
+        edge.key() for edge in graph.edges_to("RUB(f)")
+    ]
+    compact, loaded_compact = graph.compact(), loaded.compact()
+    assert loaded_compact.currencies == compact.currencies
+    assert (loaded_compact.multipliers == compact.multipliers).all()
+    paths = common.search_paths_for_fiat("KZT", "RUB", graph, 4, top_k=10)
+    loaded_paths = common.search_paths_for_fiat("KZT", "RUB", loaded, 4, top_k=10)
+    assert [path.rate() for path in loaded_paths] == [path.rate() for path in paths]
+    assert [edge.url() for edge in loaded_paths[0].edges] == [
+        edge.url() for edge in paths[0].edges
+    ]
+
+
+def test_arrays_are_memory_mapped(tmp_path):
+    path = str(tmp_path / "arrays.bin")
+    arrays = {
+        "flags": np.array([True, False]),
+        "matrix": np.arange(12, dtype=np.float64).reshape(3, 4),
+        "empty": np.zeros(0, dtype=np.int32),
+    }
+
+    snapshot_file.write_arrays(path, {"name": "test"}, arrays)
+    header, loaded = snapshot_file.read_arrays(path)
+
+    assert header["name"] == "test"
+    for name, array in arrays.items():
+        assert isinstance(loaded[name], np.memmap) or not array.size
+        assert loaded[name].dtype == array.dtype
+        assert (loaded[name] == array).all()
+    with pytest.raises(ValueError):
+        loaded["matrix"][0, 0] = 1
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / "graph.bin"
+    path.write_bytes(b"{}")
+    with pytest.raises(ValueError):
+        snapshot_file.load_graph(str(path))
@@ -0,0 +1,174 @@
+import asyncio
+from datetime import timedelta
+
+import numpy as np
+
+from decider.core import EdgeRaw, Graph, Node
+from snapshots import GraphRefresher, SnapshotFileReader, SnapshotFileWriter
+from tests.decider.test_core import EDGES
+
+
+async def build_graph():
+    graph = Graph()
+    for edge in EDGES:
+        graph.add(edge)
+    return graph
+
+
+def test_refresh_swaps_snapshot():
+    refresher = GraphRefresher(build=build_graph)
+    first = asyncio.run(refresher.refresh())
+    second = asyncio.run(refresher.refresh())
+
+    assert (first.version, second.version) == (1, 2)
+    assert refresher.snapshot is second
+    assert first.graph is not second.graph
+
+
+class UpstreamDown(Exception):
+    pass
+
+
+def test_failed_refresh_keeps_snapshot():
+    async def run_once():
+        failed = asyncio.Event()
+
+        async def build():
+            if refresher.snapshot is None:
+                return await build_graph()
+            if failed.is_set():
+                # wait for cancel instead of failing again
+                await asyncio.Future()
+            failed.set()
+            raise UpstreamDown()
+
+        refresher = GraphRefresher(build=build, interval=timedelta(seconds=0))
+        snapshot = await refresher.refresh()
+        task = asyncio.create_task(refresher.run())
+        await failed.wait()
+        task.cancel()
+        return refresher, snapshot
+
+    refresher, snapshot = asyncio.run(run_once())
+    assert refresher.snapshot is snapshot
+
+
+def test_refresh_precomputes_rates():
+    refresher = GraphRefresher(
+        build=build_graph, precompute_rates=lambda graph: graph.best_rates(2)
+    )
+    snapshot = asyncio.run(refresher.refresh())
+
+    assert snapshot.best_rates.max_length == 2
+    assert snapshot.best_rates.graph is snapshot.graph.compact()
+
+
+def test_update_edges_reports_changed_edges():
+    changed = []
+    refresher = GraphRefresher(build=build_graph, on_update=changed.append)
+
+    async def run():
+        await refresher.refresh()
+        await refresher.update_edges(
+            [
+                EdgeRaw(Node(currency="ETH"), Node(currency="USDT"), 2000),
+                EdgeRaw(Node(currency="ETH"), Node(currency="XXX"), 1),
+            ]
+        )
+
+    asyncio.run(run())
+    assert changed == [{("ETH", "USDT", "")}]
+    assert (refresher.snapshot.version, refresher.snapshot.updates) == (1, 1)
+
+
+def test_refresh_applies_updates_made_while_building():
+    eth_usdt = EdgeRaw(Node(currency="ETH"), Node(currency="USDT"), 2000)
+
+    async def run():
+        building, updated = asyncio.Event(), asyncio.Event()
+
+        async def build():
+            if refresher.snapshot is not None:
+                building.set()
+                await updated.wait()
+            return await build_graph()
+
+        refresher = GraphRefresher(
+            build=build, precompute_rates=lambda graph: graph.best_rates(2)
+        )
+        first = await refresher.refresh()
+        refresh = asyncio.create_task(refresher.refresh())
+        await building.wait()
+        await refresher.update_edges([eth_usdt])
+        updated.set()
+        return first, await refresh
+
+    first, second = asyncio.run(run())
+
+    assert (first.version, second.version) == (1, 2)
+    assert second.graph.get_edge(eth_usdt.key()) is eth_usdt
+    expected = second.graph.best_rates(2)
+    assert (second.best_rates.scores == expected.scores).all()
+
+
+def test_snapshot_shared_through_file(tmp_path):
+    path = str(tmp_path / "graph.bin")
+    refresher = GraphRefresher(
+        build=build_graph, precompute_rates=lambda graph: graph.best_rates(2)
+    )
+    writer = SnapshotFileWriter(refresher, path)
+    reader = SnapshotFileReader(path)
+
+    async def run():
+        await refresher.refresh()
+        assert await writer.write()
+        # not changed snapshot is not written and not loaded again
+        assert not await writer.write()
+        first = await reader.wait_loaded()
+        assert not await reader.reload()
+        await refresher.update_edges(
+            [EdgeRaw(Node(currency="ETH"), Node(currency="USDT"), 2000)]
+        )
+        # streamed updates are written on a coarser interval
+        assert not await writer.write()
+        writer.updates_interval = timedelta(seconds=0)
+        assert await writer.write()
+        assert await reader.reload()
+        return first, reader.snapshot
+
+    first, second = asyncio.run(run())
+
+    assert (first.version, second.version) == (1, 2)
+    assert isinstance(second.best_rates.scores, np.memmap)
+    expected = refresher.snapshot
+    assert (second.best_rates.scores == expected.best_rates.scores).all()
+    assert second.graph.get_edge(("ETH", "USDT", "")).price == 2000
+    assert [
+        [edge.key() for edge in path]
+        for path in second.best_rates.best_paths(
+            second.graph.edges_to("ETH"), second.graph.edges_from("USDT")
+        )
+    ] == [
+        [edge.key() for edge in path]
+        for path in expected.best_rates.best_paths(
+            expected.graph.edges_to("ETH"), expected.graph.edges_from("USDT")
+        )
+    ]
+
+
+def test_rebuilt_graph_is_written_at_once(tmp_path):
+    refresher = GraphRefresher(build=build_graph)
+    writer = SnapshotFileWriter(refresher, str(tmp_path / "graph.bin"))
+
+    async def run():
+        await refresher.refresh()
+        assert await writer.write()
+        await refresher.update_edges(
+            [EdgeRaw(Node(currency="ETH"), Node(currency="USDT"), 2000)]
+        )
+        assert not await writer.write()
+        await refresher.refresh()
+        assert await writer.write()
+
+    asyncio.run(run())
+    assert writer.written == (2, 0)
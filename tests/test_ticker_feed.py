@@ -0,0 +1,62 @@
+import asyncio
+import json
+from datetime import timedelta
+
+import ccxt
+import pytest
+import vcr
+
+import common
+from snapshots import GraphRefresher
+from ticker_feed import TickerFeed, book_ticker_messages
+from tests.testutils import cassette
+from tests.ticker_replay_server import DEFAULT_RECORDING, TickerReplayServer
+
+
+@pytest.fixture(scope="module")
+def binance_graph_build():
+    # each cassette interaction is played once, load them separately
+    with vcr.use_cassette(cassette("cassettes/fixtures/binance.yaml")):
+        tickers = ccxt.binance().fetch_tickers()
+    with vcr.use_cassette(cassette("cassettes/fixtures/binance.yaml")):
+        markets = ccxt.binance().fetch_markets()
+
+    async def build():
+        return common.build_crypto_graph(tickers=tickers, markets=markets)
+
+    return build
+
+
+def test_feed_applies_stream(binance_graph_build):
+    refresher = GraphRefresher(
+        build=binance_graph_build,
+        precompute_rates=lambda graph: common.precompute_best_rates(graph, 4),
+    )
+
+    async def run():
+        first = await refresher.refresh()
+        async with TickerReplayServer() as server:
+            feed = TickerFeed(
+                refresher,
+                messages=lambda: book_ticker_messages(server.url),
+                batch_interval=timedelta(hours=1),
+                max_batch=500,
+            )
+            await feed.consume(feed.messages())
+        return first, feed, server
+
+    first, feed, server = asyncio.run(run())
+
+    assert feed.messages_count == server.sent_count == 3000
+    # updates keep the version, results cached by it stay
+    assert refresher.snapshot.version == first.version
+    assert feed.batches_count == refresher.snapshot.updates
+    assert feed.updated_edges_count > 0
+    # the last update of symbol wins, the first snapshot is not changed
+    with open(DEFAULT_RECORDING) as f:
+        last = [json.loads(line) for line in f if '"s":"BTCBIDR"' in line][-1]
+    edge = refresher.snapshot.graph.get_edge(("BTC", "BIDR", "binance"))
+    assert edge.ticker["ask"] == float(last["a"])
+    assert first.graph.get_edge(("BTC", "BIDR", "binance")).ticker["ask"] == 304482728
+    expected = common.precompute_best_rates(refresher.snapshot.graph, 4)
+    assert (refresher.snapshot.best_rates.scores == expected.scores).all()
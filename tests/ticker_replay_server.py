@@ -0,0 +1,75 @@
+"""
+Local websocket server which plays back recorded book ticker updates.
+
+Used to run the ticker feed without network access and to measure how fast
+updates are applied. The default recording is 3000 updates of Binance
+``!bookTicker`` stream format based on tickers of ``fixtures/binance.yaml``.
+"""
+import asyncio
+from typing import List, Optional
+
+from aiohttp import web
+
+from tests.testutils import cassette
+
+DEFAULT_RECORDING = cassette("cassettes/fixtures/binance_book_ticker.jsonl")
+
+
+def load_messages(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class TickerReplayServer:
+    """
+    Serve recorded stream at ``/ws/!bookTicker``. Use as async context manager.
+
+    Each connection gets all messages and then the stream is closed.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_RECORDING,
+        rate: Optional[float] = None,
+        repeat: int = 1,
+        port: int = 0,
+    ):
+        """
+        :param rate: messages per second, None - as fast as possible
+        :param repeat: times to play the recording in one stream
+        :param port: port to listen, 0 - any free port
+        """
+        self.messages = load_messages(path)
+        self.rate = rate
+        self.repeat = repeat
+        self.port = port
+        self.sent_count = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._runner.addresses[0][:2]
+        return f"ws://{host}:{port}/ws/!bookTicker"
+
+    async def _stream(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        for _ in range(self.repeat):
+            for message in self.messages:
+                await websocket.send_str(message)
+                self.sent_count += 1
+                if self.rate:
+                    await asyncio.sleep(1 / self.rate)
+        await websocket.close()
+        return websocket
+
+    async def __aenter__(self) -> "TickerReplayServer":
+        app = web.Application()
+        app.router.add_get("/ws/!bookTicker", self._stream)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
@@ -0,0 +1,109 @@
+"""
+Streaming crypto rates updates for long running services.
+
+Binance book ticker stream sends best bid / ask of a symbol every time it
+changes. Updates are collected in batches, only the latest update of each
+symbol in a batch is applied.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Callable, Dict
+
+from providers import crypto
+from snapshots import GraphRefresher
+
+logger = logging.getLogger(__name__)
+
+# snapshot is published at most once per interval
+FEED_BATCH_INTERVAL = timedelta(seconds=1)
+# symbols updated in one batch
+FEED_MAX_BATCH = 1000
+FEED_RECONNECT_DELAY = timedelta(seconds=5)
+
+
+async def book_ticker_messages(
+    url: str = crypto.BINANCE_BOOK_TICKER_STREAM,
+) -> AsyncIterator[dict]:
+    """Messages of book ticker websocket stream."""
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as websocket:
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                yield json.loads(message.data)
+
+
+class TickerFeed:
+    """Applies streamed ticker updates to refresher snapshots in batches."""
+
+    def __init__(
+        self,
+        refresher: GraphRefresher,
+        messages: Callable[[], AsyncIterator[dict]] = book_ticker_messages,
+        batch_interval: timedelta = FEED_BATCH_INTERVAL,
+        max_batch: int = FEED_MAX_BATCH,
+    ):
+        """
+        :param messages: function opening stream of book ticker messages
+        :param batch_interval: time to collect updates before applying them.
+            Batch is applied on the next message after the interval.
+        :param max_batch: number of symbols to apply before interval passed
+        """
+        self.refresher = refresher
+        self.messages = messages
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.messages_count = 0
+        self.updated_edges_count = 0
+        self.batches_count = 0
+        self.apply_seconds = 0.0
+
+    @property
+    def updates_per_second(self) -> float:
+        """Edges updated per second spent applying batches."""
+        return self.updated_edges_count / self.apply_seconds if self.apply_seconds else 0
+
+    async def run(self):
+        """Consume stream forever, reconnect when it fails."""
+        while True:
+            try:
+                await self.consume(self.messages())
+            except Exception:
+                logger.exception("Ticker stream failed")
+            await asyncio.sleep(FEED_RECONNECT_DELAY.total_seconds())
+
+    async def consume(self, messages: AsyncIterator[dict]):
+        """Apply updates until stream ends."""
+        pending: Dict[str, dict] = {}
+        deadline = time.monotonic() + self.batch_interval.total_seconds()
+        async for message in messages:
+            self.messages_count += 1
+            pending[message["s"]] = message
+            if len(pending) >= self.max_batch or time.monotonic() >= deadline:
+                await self.apply(pending)
+                pending = {}
+                deadline = time.monotonic() + self.batch_interval.total_seconds()
+        if pending:
+            await self.apply(pending)
+
+    async def apply(self, messages: Dict[str, dict]) -> int:
+        """Apply latest messages by symbol id, return number of updated edges."""
+        started_at = time.perf_counter()
+        graph = self.refresher.snapshot.graph
+        markets = crypto.markets_by_id(graph)
+        edges = [
+            edge
+            for message in messages.values()
+            for edge in crypto.book_ticker_edges(graph, markets, message)
+        ]
+        updated = await self.refresher.update_edges(edges)
+        self.apply_seconds += time.perf_counter() - started_at
+        self.updated_edges_count += updated
+        self.batches_count += 1
+        logger.debug(f"Applied {len(messages)} ticker updates to {updated} edges")
+        return updated